@@ -0,0 +1,77 @@
+from logging.config import fileConfig
+
+from sqlalchemy import engine_from_config, pool
+
+from alembic import context
+
+from app.config import settings
+from app.database import Base
+from app import models  # noqa: F401 - registra os modelos no metadata
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+# A URL do banco vem das Settings (variáveis de ambiente / .env), não do alembic.ini,
+# exceto quando informada explicitamente (ex.: alembic -x sqlalchemy.url=...)
+if not context.get_x_argument(as_dictionary=True).get("sqlalchemy.url"):
+    config.set_main_option("sqlalchemy.url", settings.mysql_url.replace("%", "%%"))
+else:
+    config.set_main_option(
+        "sqlalchemy.url",
+        context.get_x_argument(as_dictionary=True)["sqlalchemy.url"].replace("%", "%%")
+    )
+
+target_metadata = Base.metadata
+
+
+def include_object_for(dialect_name: str):
+    """Ignora no autogenerate objetos restritos a outro dialeto (ex.: índice FULLTEXT do MySQL)"""
+    def include_object(obj, name, type_, reflected, compare_to):
+        ddl_if = getattr(obj, "_ddl_if", None)
+        if ddl_if is not None and ddl_if.dialect is not None:
+            dialects = (ddl_if.dialect,) if isinstance(ddl_if.dialect, str) else ddl_if.dialect
+            return dialect_name in dialects
+        return True
+    return include_object
+
+
+def run_migrations_offline() -> None:
+    """Gera o SQL das migrações sem conectar ao banco (alembic upgrade --sql)"""
+    url = config.get_main_option("sqlalchemy.url")
+    context.configure(
+        url=url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    """Aplica as migrações conectando ao banco"""
+    connectable = engine_from_config(
+        config.get_section(config.config_ini_section, {}),
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+
+    with connectable.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=connection.dialect.name == "sqlite",
+            include_object=include_object_for(connection.dialect.name),
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
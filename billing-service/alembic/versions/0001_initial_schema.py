@@ -0,0 +1,100 @@
+"""Esquema inicial (tabelas criadas até então via Base.metadata.create_all)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+claim_status = sa.Enum('PENDING', 'APPROVED', 'REJECTED', 'PROCESSING', name='claimstatus')
+invoice_status = sa.Enum('PENDING', 'SETTLED', 'CANCELLED', name='invoicestatus')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Bancos já inicializados pelo create_all da aplicação mantêm as tabelas existentes
+    existing = set() if context.is_offline_mode() else set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'claim_items' not in existing:
+        op.create_table(
+            'claim_items',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('claim_id', sa.String(length=50), nullable=False),
+            sa.Column('description', sa.String(length=255), nullable=False),
+            sa.Column('code', sa.String(length=50), nullable=True),
+            sa.Column('value', sa.Numeric(10, 2), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_claim_items_id', 'claim_items', ['id'])
+        op.create_index('ix_claim_items_claim_id', 'claim_items', ['claim_id'])
+
+    if 'claims' not in existing:
+        op.create_table(
+            'claims',
+            sa.Column('id', sa.String(length=50), nullable=False),
+            sa.Column('patient_id', sa.String(length=50), nullable=False),
+            sa.Column('insurance_id', sa.String(length=100), nullable=True),
+            sa.Column('amount', sa.Numeric(10, 2), nullable=False),
+            sa.Column('currency', sa.String(length=3), nullable=False),
+            sa.Column('status', claim_status, nullable=False),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_claims_id', 'claims', ['id'])
+        op.create_index('ix_claims_patient_id', 'claims', ['patient_id'])
+        op.create_index('ix_claims_insurance_id', 'claims', ['insurance_id'])
+
+    if 'invoices' not in existing:
+        op.create_table(
+            'invoices',
+            sa.Column('id', sa.String(length=50), nullable=False),
+            sa.Column('claim_id', sa.String(length=50), nullable=True),
+            sa.Column('patient_id', sa.String(length=50), nullable=False),
+            sa.Column('amount', sa.Numeric(10, 2), nullable=False),
+            sa.Column('currency', sa.String(length=3), nullable=False),
+            sa.Column('status', invoice_status, nullable=False),
+            sa.Column('settled_at', sa.DateTime(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_invoices_id', 'invoices', ['id'])
+        op.create_index('ix_invoices_claim_id', 'invoices', ['claim_id'])
+        op.create_index('ix_invoices_patient_id', 'invoices', ['patient_id'])
+
+    if 'eligibility_checks' not in existing:
+        op.create_table(
+            'eligibility_checks',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('patient_id', sa.String(length=50), nullable=False),
+            sa.Column('insurance_id', sa.String(length=100), nullable=False),
+            sa.Column('is_eligible', sa.Integer(), nullable=False),
+            sa.Column('message', sa.Text(), nullable=True),
+            sa.Column('checked_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_eligibility_checks_id', 'eligibility_checks', ['id'])
+        op.create_index('ix_eligibility_checks_patient_id', 'eligibility_checks', ['patient_id'])
+        op.create_index('ix_eligibility_checks_insurance_id', 'eligibility_checks', ['insurance_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('eligibility_checks')
+    op.drop_table('invoices')
+    op.drop_table('claims')
+    op.drop_table('claim_items')
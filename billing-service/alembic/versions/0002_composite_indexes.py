@@ -0,0 +1,84 @@
+"""Índices compostos para os padrões de acesso reais
+
+- claims/invoices: (patient_id, status) cobre listagens por paciente com ou sem status
+- claims: (status) para filas de processamento por status
+- eligibility_checks: (patient_id, insurance_id, checked_at DESC) e
+  (insurance_id, checked_at DESC) atendem get_eligibility_history sem filesort;
+  (checked_at) atende o histórico sem filtros e a retenção por data
+- remove índices redundantes: prefixos dos compostos e índices duplicando a PK,
+  que só custavam escrita
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NEW_INDEXES = [
+    ('ix_claims_patient_id_status', 'claims', ['patient_id', 'status']),
+    ('ix_claims_status', 'claims', ['status']),
+    ('ix_invoices_patient_id_status', 'invoices', ['patient_id', 'status']),
+    (
+        'ix_eligibility_checks_patient_insurance_checked',
+        'eligibility_checks',
+        ['patient_id', 'insurance_id', sa.text('checked_at DESC')],
+    ),
+    (
+        'ix_eligibility_checks_insurance_checked',
+        'eligibility_checks',
+        ['insurance_id', sa.text('checked_at DESC')],
+    ),
+    ('ix_eligibility_checks_checked_at', 'eligibility_checks', ['checked_at']),
+]
+
+REDUNDANT_INDEXES = [
+    ('ix_claims_id', 'claims', ['id']),
+    ('ix_claims_patient_id', 'claims', ['patient_id']),
+    ('ix_invoices_id', 'invoices', ['id']),
+    ('ix_invoices_patient_id', 'invoices', ['patient_id']),
+    ('ix_claim_items_id', 'claim_items', ['id']),
+    ('ix_eligibility_checks_id', 'eligibility_checks', ['id']),
+    ('ix_eligibility_checks_patient_id', 'eligibility_checks', ['patient_id']),
+    ('ix_eligibility_checks_insurance_id', 'eligibility_checks', ['insurance_id']),
+]
+
+
+def _index_exists(name: str, table: str, default: bool) -> bool:
+    """Consulta o banco; no modo offline (--sql) assume o estado da revisão anterior"""
+    if context.is_offline_mode():
+        return default
+    return name in {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Cria os compostos antes de remover os antigos para nunca deixar a tabela sem índice
+    for name, table, columns in NEW_INDEXES:
+        if not _index_exists(name, table, default=False):
+            op.create_index(name, table, columns)
+
+    for name, table, _ in REDUNDANT_INDEXES:
+        if _index_exists(name, table, default=True):
+            op.drop_index(name, table_name=table)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table, columns in REDUNDANT_INDEXES:
+        if not _index_exists(name, table, default=False):
+            op.create_index(name, table, columns)
+
+    for name, table, _ in reversed(NEW_INDEXES):
+        if _index_exists(name, table, default=True):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,91 @@
+"""Particiona eligibility_checks por mês (RANGE em checked_at)
+
+No MySQL: checked_at passa a NOT NULL, a PK vira (id, checked_at) — exigência do
+particionamento, toda chave única precisa conter a coluna de partição — e a tabela é
+particionada por RANGE (TO_DAYS(checked_at)) com uma partição por mês desde o registro
+mais antigo até dois meses à frente, além de pmax. Novas partições são criadas pelo job
+de retenção (app/services/eligibility_partitions.py).
+
+Em outros bancos (SQLite) apenas checked_at passa a NOT NULL; o particionamento é emulado.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from app.services.eligibility_partitions import add_months, month_start, partition_name
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS_AHEAD = 2
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    op.execute("UPDATE eligibility_checks SET checked_at = CURRENT_TIMESTAMP WHERE checked_at IS NULL")
+
+    if bind.dialect.name != 'mysql':
+        with op.batch_alter_table('eligibility_checks') as batch_op:
+            batch_op.alter_column(
+                'checked_at', existing_type=sa.DateTime(), nullable=False,
+                existing_server_default=sa.func.now()
+            )
+        return
+
+    oldest = None
+    if not context.is_offline_mode():
+        oldest = bind.execute(sa.text("SELECT MIN(checked_at) FROM eligibility_checks")).scalar()
+    now = datetime.utcnow()
+    first = month_start(oldest or now)
+    last = add_months(month_start(now), PARTITIONS_AHEAD)
+
+    partitions = []
+    start = first
+    while start <= last:
+        end = add_months(start, 1)
+        partitions.append(
+            f"PARTITION {partition_name(start)} VALUES LESS THAN (TO_DAYS('{end:%Y-%m-%d}'))"
+        )
+        start = end
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    op.execute(
+        "ALTER TABLE eligibility_checks "
+        "MODIFY checked_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+        "DROP PRIMARY KEY, ADD PRIMARY KEY (id, checked_at)"
+    )
+    op.execute(
+        "ALTER TABLE eligibility_checks PARTITION BY RANGE (TO_DAYS(checked_at)) ("
+        + ", ".join(partitions) + ")"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        with op.batch_alter_table('eligibility_checks') as batch_op:
+            batch_op.alter_column(
+                'checked_at', existing_type=sa.DateTime(), nullable=True,
+                existing_server_default=sa.func.now()
+            )
+        return
+
+    op.execute("ALTER TABLE eligibility_checks REMOVE PARTITIONING")
+    op.execute(
+        "ALTER TABLE eligibility_checks "
+        "DROP PRIMARY KEY, ADD PRIMARY KEY (id), "
+        "MODIFY checked_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP"
+    )
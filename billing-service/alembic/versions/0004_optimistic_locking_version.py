@@ -0,0 +1,41 @@
+"""Coluna version em claims e invoices (concorrência otimista)
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _column_exists(table: str, column: str) -> bool:
+    """Consulta o banco; no modo offline (--sql) assume o estado da revisão anterior"""
+    if context.is_offline_mode():
+        return False
+    return column in {c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Bancos já inicializados pelo create_all da aplicação já têm a coluna
+    for table in ('claims', 'invoices'):
+        if not _column_exists(table, 'version'):
+            op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('invoices') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('claims') as batch_op:
+        batch_op.drop_column('version')
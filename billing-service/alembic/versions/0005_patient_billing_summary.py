@@ -0,0 +1,42 @@
+"""Read model patient_billing_summary
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Bancos já inicializados pelo create_all da aplicação já têm a tabela
+    if not context.is_offline_mode() and sa.inspect(op.get_bind()).has_table('patient_billing_summary'):
+        return
+    op.create_table(
+        'patient_billing_summary',
+        sa.Column('patient_id', sa.String(length=50), nullable=False),
+        sa.Column('outstanding_balance', sa.Numeric(precision=14, scale=2), server_default='0', nullable=False),
+        sa.Column('pending_invoices', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('open_claims', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('total_claims', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('last_settlement_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('patient_id')
+    )
+    # Preenchimento inicial: python -m app.services.patient_summary rebuild
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('patient_billing_summary')
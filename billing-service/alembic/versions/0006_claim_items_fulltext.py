@@ -0,0 +1,41 @@
+"""Índice FULLTEXT em claim_items (busca de claims, SEARCH_BACKEND=mysql)
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Só o MySQL tem FULLTEXT; nos demais bancos a busca usa o índice em memória
+    if op.get_context().dialect.name != "mysql":
+        return
+    # Bancos já inicializados pelo create_all da aplicação já têm o índice
+    if not context.is_offline_mode() and 'ix_claim_items_fulltext' in {
+        index['name'] for index in sa.inspect(op.get_bind()).get_indexes('claim_items')
+    }:
+        return
+    op.create_index(
+        'ix_claim_items_fulltext', 'claim_items', ['description', 'code'],
+        unique=False, mysql_prefix='FULLTEXT'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_context().dialect.name != "mysql":
+        return
+    op.drop_index('ix_claim_items_fulltext', table_name='claim_items')
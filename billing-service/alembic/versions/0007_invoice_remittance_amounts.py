@@ -0,0 +1,49 @@
+"""Valores pagos e glosas da remessa do convênio em invoices
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+COLUMNS = [
+    sa.Column('paid_amount', sa.Numeric(10, 2), nullable=True),
+    sa.Column('glosa_amount', sa.Numeric(10, 2), nullable=True),
+    sa.Column('glosa_code', sa.String(10), nullable=True),
+]
+
+
+def _existing_columns(table: str) -> set:
+    """Consulta o banco; no modo offline (--sql) assume o estado da revisão anterior"""
+    if context.is_offline_mode():
+        return set()
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Bancos já inicializados pelo create_all da aplicação já têm as colunas
+    existing = _existing_columns('invoices')
+    for column in COLUMNS:
+        if column.name not in existing:
+            op.add_column('invoices', column)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('invoices') as batch_op:
+        batch_op.drop_column('glosa_code')
+        batch_op.drop_column('glosa_amount')
+        batch_op.drop_column('paid_amount')
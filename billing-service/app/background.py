@@ -0,0 +1,94 @@
+"""
+Jobs periódicos em background (threads daemon iniciadas no lifespan da aplicação)
+"""
+import logging
+import threading
+from typing import Callable, List, Optional
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+background_job_runs_total = Counter(
+    'billing_background_job_runs_total',
+    'Background job executions',
+    ['job', 'result']
+)
+
+background_job_duration_seconds = Histogram(
+    'billing_background_job_duration_seconds',
+    'Background job execution time',
+    ['job'],
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+)
+
+
+class PeriodicJob:
+    """Executa uma função a cada `interval_seconds` em uma thread daemon"""
+
+    def __init__(self, name: str, func: Callable[[], object], interval_seconds: float,
+                 initial_delay_seconds: float = 0.0, on_stop: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.func = func
+        self.interval_seconds = interval_seconds
+        self.initial_delay_seconds = initial_delay_seconds
+        self.on_stop = on_stop
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"job-{self.name}", daemon=True)
+        self._thread.start()
+        logger.info(f"Job {self.name} iniciado (intervalo {self.interval_seconds}s)")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.on_stop is not None:
+            self.on_stop()
+
+    def run_once(self):
+        with background_job_duration_seconds.labels(job=self.name).time():
+            try:
+                result = self.func()
+                background_job_runs_total.labels(job=self.name, result="success").inc()
+                return result
+            except Exception as e:
+                background_job_runs_total.labels(job=self.name, result="error").inc()
+                logger.error(f"Erro no job {self.name}: {e}", exc_info=True)
+                return None
+
+    def _run(self):
+        if self._stop.wait(self.initial_delay_seconds):
+            return
+        while not self._stop.is_set():
+            self.run_once()
+            if self._stop.wait(self.interval_seconds):
+                break
+
+
+class JobRegistry:
+    """Agrupa os jobs para iniciar/parar todos juntos no lifespan"""
+
+    def __init__(self):
+        self.jobs: List[PeriodicJob] = []
+
+    def add(self, job: PeriodicJob) -> PeriodicJob:
+        self.jobs.append(job)
+        return job
+
+    def start_all(self):
+        for job in self.jobs:
+            job.start()
+
+    def stop_all(self):
+        for job in self.jobs:
+            job.stop()
+
+
+# Instância global
+background_jobs = JobRegistry()
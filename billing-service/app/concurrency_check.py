@@ -0,0 +1,152 @@
+"""
+Verificação de concorrência da liquidação de invoices e das atualizações com `version`
+
+Cria um SQLite em arquivo (cada thread com a sua conexão, como workers diferentes) e, para
+cada uma de `--invoices` invoices, dispara `--threads` liquidações simultâneas (barreira).
+Confere que:
+- cada invoice publica exatamente um InvoiceSettled (o UPDATE condicional tem um vencedor);
+- as demais chamadas respondem a invoice já liquidada, sem erro;
+- PATCHes concorrentes de um claim com a mesma `version` têm exatamente um vencedor e os
+  outros recebem 409.
+Reporta o throughput das liquidações. Os eventos são contados no lugar do Kafka.
+
+Uso (CI ou local, não precisa de MySQL nem Kafka):
+    python -m app.concurrency_check [--threads 16] [--invoices 50]
+"""
+import os
+import time
+import logging
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Dict, List
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base, ReplicaRouter, RoutingSession
+from app.kafka_producer import kafka_producer
+from app.models import Claim, ClaimStatus, Invoice, InvoiceStatus
+from app.schemas import ClaimUpdate
+from app.services.claim_service import ClaimService
+from app.services.invoice_service import InvoiceService
+from app.sharding import shards
+
+logger = logging.getLogger(__name__)
+
+
+def _race(pool: ThreadPoolExecutor, threads: int, call) -> List[str]:
+    """Executa `call()` em `threads` threads liberadas juntas; retorna o desfecho de cada uma"""
+    barrier = threading.Barrier(threads)
+
+    def run():
+        barrier.wait()
+        try:
+            call()
+            return "ok"
+        except HTTPException as e:
+            return str(e.status_code)
+        except Exception as e:
+            return type(e).__name__
+
+    return [future.result() for future in [pool.submit(run) for _ in range(threads)]]
+
+
+def run_check(threads: int = 16, invoices: int = 50, directory: str = None) -> Dict:
+    directory = directory or tempfile.mkdtemp(prefix="billing-concurrency-")
+    path = os.path.join(directory, "concurrency.db")
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(
+        class_=RoutingSession, autocommit=False, autoflush=False, bind=engine,
+        info={"shard": 0, "replica_router": ReplicaRouter()}
+    )
+    previous_factories = shards.session_factories
+    shards.configure([factory])
+
+    invoice_ids = [shards.new_id("INV", 0, f"{n:06X}") for n in range(invoices)]
+    claim_ids = [shards.new_id("CLM", 0, f"{n:06X}") for n in range(invoices)]
+    with factory() as db:
+        for n, (claim_id, invoice_id) in enumerate(zip(claim_ids, invoice_ids)):
+            patient_id = f"P{n:06d}"
+            db.add(Claim(id=claim_id, patient_id=patient_id, insurance_id="INS1", amount=Decimal("100.00"),
+                         status=ClaimStatus.PENDING))
+            db.add(Invoice(id=invoice_id, claim_id=claim_id, patient_id=patient_id, amount=Decimal("100.00"),
+                           status=InvoiceStatus.PENDING))
+        db.commit()
+
+    events: Counter = Counter()
+    events_lock = threading.Lock()
+
+    def count_event(invoice_data: dict):
+        with events_lock:
+            events[invoice_data["id"]] += 1
+        return True
+
+    def settle(invoice_id: str):
+        with factory() as db:
+            InvoiceService.settle_invoice(db, invoice_id)
+
+    def update_claim(claim_id: str):
+        with factory() as db:
+            ClaimService.update_claim(db, claim_id, ClaimUpdate(status=ClaimStatus.PROCESSING, version=1))
+
+    errors: List[str] = []
+    settle_outcomes: Counter = Counter()
+    update_outcomes: Counter = Counter()
+    publish = kafka_producer.publish_invoice_settled
+    kafka_producer.publish_invoice_settled = count_event
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            started = time.perf_counter()
+            for invoice_id in invoice_ids:
+                settle_outcomes.update(_race(pool, threads, lambda: settle(invoice_id)))
+            elapsed = time.perf_counter() - started
+
+            for claim_id in claim_ids:
+                outcomes = Counter(_race(pool, threads, lambda: update_claim(claim_id)))
+                update_outcomes.update(outcomes)
+                if outcomes["ok"] != 1 or outcomes["409"] != threads - 1:
+                    errors.append(f"{claim_id}: PATCH concorrente com a mesma versão -> {dict(outcomes)}")
+    finally:
+        kafka_producer.publish_invoice_settled = publish
+        shards.configure(previous_factories)
+        engine.dispose()
+
+    for invoice_id in invoice_ids:
+        if events[invoice_id] != 1:
+            errors.append(f"{invoice_id}: {events[invoice_id]} eventos InvoiceSettled (esperado 1)")
+    if settle_outcomes["ok"] != threads * invoices:
+        errors.append(f"liquidações com erro: {dict(settle_outcomes)}")
+
+    calls = threads * invoices
+    return {
+        "threads": threads,
+        "invoices": invoices,
+        "settle_calls": calls,
+        "events_published": sum(events.values()),
+        "settle_outcomes": dict(settle_outcomes),
+        "update_outcomes": dict(update_outcomes),
+        "seconds": round(elapsed, 3),
+        "settle_calls_per_second": round(calls / elapsed, 1) if elapsed else 0.0,
+        "invoices_settled_per_second": round(invoices / elapsed, 1) if elapsed else 0.0,
+        "errors": errors[:20],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Liquidação concorrente: um InvoiceSettled por invoice")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--invoices", type=int, default=50)
+    parser.add_argument("--dir", help="Diretório do SQLite (padrão: diretório temporário)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    result = run_check(args.threads, args.invoices, args.dir)
+    print(result)
+    raise SystemExit(1 if result["errors"] else 0)
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -10,6 +10,40 @@ class Settings(BaseSettings):
     MYSQL_PASSWORD: str = "billing_password"
     MYSQL_DATABASE: str = "billing_db"
     
+    # Pool de conexões (SQLAlchemy)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 300
+    SLOW_QUERY_THRESHOLD_MS: float = 200.0
+    
+    # Réplicas de leitura (host[:porta] separados por vírgula; vazio = só o primário)
+    MYSQL_REPLICA_HOSTS: str = ""
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    DB_REPLICA_LAG_CHECK_SECONDS: float = 2.0
+    # Janela de read-your-writes: após uma escrita o cliente lê do primário
+    DB_READ_YOUR_WRITES_SECONDS: float = 5.0
+    
+    # Sharding de claims/invoices por patient_id (URLs SQLAlchemy dos shards 1..N; o shard 0 é MYSQL_HOST)
+    SHARD_MYSQL_URLS: str = ""
+    SHARD_VNODES: int = 64
+    SHARD_SCATTER_WORKERS: int = 8
+    
+    # Threadpool do Starlette (limita endpoints síncronos concorrentes)
+    THREADPOOL_SIZE: int = 40
+    
+    # Controle de admissão (limite de concorrência adaptativo, 503 + Retry-After acima dele)
+    ADMISSION_CONTROL_ENABLED: str = "true"
+    ADMISSION_INITIAL_LIMIT: int = 40
+    ADMISSION_MIN_LIMIT: int = 4
+    ADMISSION_MAX_LIMIT: int = 400
+    ADMISSION_LATENCY_TOLERANCE: float = 2.0
+    ADMISSION_RETRY_AFTER_SECONDS: int = 1
+    
+    # Deadline por requisição (X-Request-Timeout / X-Request-Deadline); 0 = sem deadline padrão
+    REQUEST_TIMEOUT_DEFAULT_SECONDS: float = 0
+    REQUEST_TIMEOUT_MAX_SECONDS: float = 60
+    
     # Redis
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
@@ -18,12 +52,99 @@ class Settings(BaseSettings):
     # Kafka
     KAFKA_BOOTSTRAP_SERVERS: str = "localhost:9092"
     KAFKA_TOPIC_BILLING_EVENTS: str = "billing.events"
+    # Formato dos eventos: json, msgpack ou avro (schemas em KAFKA_SCHEMA_DIR)
+    KAFKA_SERIALIZATION_FORMAT: str = "json"
+    KAFKA_SCHEMA_DIR: Optional[str] = None
+    # Compressão do producer: none, gzip, snappy, lz4 ou zstd
+    KAFKA_COMPRESSION_TYPE: str = "lz4"
+    # Bloqueio máximo de send() esperando metadados do broker (broker fora do ar)
+    KAFKA_MAX_BLOCK_MS: int = 1000
+    
+    # Retenção de eligibility_checks (partições mensais)
+    ELIGIBILITY_RETENTION_ENABLED: str = "false"
+    ELIGIBILITY_RETENTION_MONTHS: int = 12
+    ELIGIBILITY_RETENTION_INTERVAL_SECONDS: int = 3600
+    ELIGIBILITY_PARTITIONS_AHEAD: int = 2
+    ELIGIBILITY_ARCHIVE_DIR: str = "archive/eligibility_checks"
+    ELIGIBILITY_HISTORY_RECENT_MONTHS: int = 1
+    
+    # Adjudicação de claims em background
+    ADJUDICATION_ENABLED: str = "false"
+    ADJUDICATION_RULES_FILE: Optional[str] = "adjudication_rules.json"
+    ADJUDICATION_BATCH_SIZE: int = 500
+    ADJUDICATION_PROCESSES: int = 1
+    ADJUDICATION_INTERVAL_SECONDS: int = 10
+    
+    # Conciliação invoices x claims (python -m app.services.reconciliation)
+    RECONCILIATION_REPORT_DIR: str = "data/reconciliation"
+    RECONCILIATION_CHUNK_SIZE: int = 10000
+    RECONCILIATION_PROCESSES: int = 1
+    
+    # Lotes TISS por convênio (python -m app.services.tiss_export)
+    TISS_PROVIDER_CODE: str = ""  # código do prestador na operadora
+    TISS_VERSION: str = "4.01.00"
+    TISS_OUTPUT_DIR: str = "data/tiss"
+    TISS_EXPORT_PROCESSES: int = 1
+    
+    # Importação de remessas de pagamento (POST /invoices/remittances, app.services.remittance_import)
+    REMITTANCE_CHUNK_SIZE: int = 500
+    REMITTANCE_DELIMITER: str = ";"
+    REMITTANCE_MAX_REJECTED_DETAILS: int = 1000  # linhas rejeitadas detalhadas na resposta
+    
+    # Regras de cobertura de elegibilidade (recarregadas quando o arquivo muda)
+    COVERAGE_RULES_FILE: Optional[str] = "coverage_rules.json"
+    COVERAGE_RULES_RELOAD_SECONDS: float = 5.0
+    
+    # Read model patient_billing_summary
+    PATIENT_SUMMARY_CACHE_TTL_SECONDS: int = 300
+    
+    # Busca de claims: memory (índice invertido em memória) ou mysql (FULLTEXT)
+    SEARCH_BACKEND: str = "memory"
+    # Catch-up do índice em memória só no job (defasagem máxima); nunca na requisição
+    SEARCH_INDEX_REFRESH_SECONDS: int = 1
+    # Janela relida abaixo da marca d'água (ids com commit fora de ordem)
+    SEARCH_INDEX_OVERLAP_IDS: int = 1000
+    # Documentos examinados na contagem do total após a página montada (total_exact=false além disso)
+    SEARCH_MAX_SCAN_DOCS: int = 10000
+    
+    # Carteiras de beneficiários (snapshots mmap compartilhados entre workers)
+    ROSTER_DIR: str = "data/rosters"
+    ROSTER_RELOAD_SECONDS: float = 5.0
     
     # Service
     SERVICE_NAME: str = "billing-service"
     SERVICE_PORT: int = 8000
     LOG_LEVEL: str = "INFO"
     
+    # Tracing (OpenTelemetry): head sampling por ratio + tail sampling de traces lentos/com erro
+    TRACING_ENABLED: str = "false"
+    TRACING_EXPORTER: str = "file"  # file, memory ou otlp
+    TRACING_FILE_PATH: str = "data/traces/spans.jsonl"
+    TRACING_OTLP_ENDPOINT: str = ""
+    TRACING_SAMPLE_RATIO: float = 0.01
+    TRACING_TAIL_SAMPLING: str = "true"
+    TRACING_TAIL_LATENCY_MS: float = 500.0
+    TRACING_TAIL_MAX_TRACES: int = 2000
+    
+    # Server-Timing por fase (db, commit, redis, kafka, serialize) em requisições amostradas
+    # ou das rotas listadas ("POST ^/claims/?$,^/invoices/settle")
+    SERVER_TIMING_ENABLED: str = "true"
+    SERVER_TIMING_SAMPLE_RATIO: float = 0.01
+    SERVER_TIMING_ROUTES: str = ""
+    
+    # Profiler de CPU sob demanda (/debug/profile, role billing:admin)
+    PROFILE_MAX_SECONDS: float = 60
+    PROFILE_MAX_OVERHEAD: float = 0.02  # fração de um core gasta amostrando
+    
+    # SLOs medidos no processo (/health/slo, billing_slo_burn_rate)
+    SLO_AVAILABILITY_TARGET: float = 0.999
+    SLO_LATENCY_TARGET: float = 0.99
+    SLO_LATENCY_THRESHOLD_MS: float = 300
+    SLO_LATENCY_ROUTES: str = ""  # "POST /claims/=500,GET /claims/{claim_id}=200"
+    
+    # Diagnóstico de memória (/debug/memory): tracemalloc desliga sozinho após esse tempo
+    MEMORY_TRACEMALLOC_MAX_SECONDS: float = 900
+    
     # OAuth2/OIDC
     AUTH_ENABLED: str = "false"  # Desabilitado por padrão para desenvolvimento
     OIDC_ISSUER: str = "http://localhost:8080/auth/realms/master"
@@ -41,6 +162,19 @@ class Settings(BaseSettings):
     def mysql_url(self) -> str:
         return f"mysql+pymysql://{self.MYSQL_USER}:{self.MYSQL_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DATABASE}"
     
+    @property
+    def mysql_replica_urls(self) -> List[str]:
+        urls = []
+        for entry in self.MYSQL_REPLICA_HOSTS.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            host, _, port = entry.partition(":")
+            urls.append(
+                f"mysql+pymysql://{self.MYSQL_USER}:{self.MYSQL_PASSWORD}@{host}:{port or self.MYSQL_PORT}/{self.MYSQL_DATABASE}"
+            )
+        return urls
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -1,33 +1,270 @@
-from sqlalchemy import create_engine, text
+"""
+Engines e sessões do banco de dados
+
+Leituras marcadas com @read_only (get_claim, get_claims, get_invoices,
+get_eligibility_history...) vão para uma réplica (MYSQL_REPLICA_HOSTS), exceto quando:
+- a sessão já escreveu (flush/DML) ou a consulta é SELECT ... FOR UPDATE;
+- o cliente escreveu há menos de DB_READ_YOUR_WRITES_SECONDS (read-your-writes);
+- nenhuma réplica está com lag abaixo de DB_REPLICA_MAX_LAG_SECONDS.
+Em todos esses casos a leitura cai para o primário. Sem réplicas, tudo vai para o primário.
+O read-your-writes entre requisições é por worker (X-Client-Id ou IP de origem).
+
+Verificação do roteamento com dois bancos SQLite locais (primário e réplica):
+    python -m app.replica_check --dir /tmp/billing-replica
+"""
+import time
+import logging
+import threading
+import functools
+import itertools
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.exc import OperationalError, SQLAlchemyError
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
+from prometheus_client import Counter, Gauge
 from app.config import settings
-import logging
+from app.db_instrumentation import InstrumentedQueuePool, instrument_pool, instrument_queries
+from app import deadline, tracing
+from app.middleware import server_timing
 
 logger = logging.getLogger(__name__)
 
-engine = create_engine(
-    settings.mysql_url,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    echo=False,
-    pool_reset_on_return='commit'
+db_read_routing_total = Counter(
+    'billing_db_read_routing_total',
+    'Read-only statements by target engine and routing reason',
+    ['target', 'reason']
+)
+
+db_replica_lag_seconds = Gauge(
+    'billing_db_replica_lag_seconds',
+    'Last measured replication lag per replica (-1 = unknown/stopped)',
+    ['replica']
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _create_engine(url: str, name: str) -> Engine:
+    db_engine = create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        echo=False,
+        pool_reset_on_return='commit'
+    )
+    instrument_pool(db_engine, name=name)
+    instrument_queries(db_engine, name=name, slow_query_threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS)
+    # Deadline da requisição: recusa statements após o prazo e limita SELECTs no MySQL
+    deadline.instrument_engine(db_engine)
+    tracing.instrument_engine(db_engine, name=name)
+    return db_engine
+
+
+engine = _create_engine(settings.mysql_url, "primary")
+
+
+def mysql_replica_lag(replica: Engine) -> Optional[float]:
+    """Seconds_Behind_Source da réplica (None se a replicação está parada)"""
+    if replica.dialect.name != "mysql":
+        return 0.0
+    with replica.connect() as conn:
+        try:
+            row = conn.execute(text("SHOW REPLICA STATUS")).mappings().first()
+            column = "Seconds_Behind_Source"
+        except SQLAlchemyError:
+            # MySQL < 8.0.22
+            row = conn.execute(text("SHOW SLAVE STATUS")).mappings().first()
+            column = "Seconds_Behind_Master"
+    if row is None:
+        # Não é réplica (ex.: apontando para o próprio primário)
+        return 0.0
+    lag = row.get(column)
+    return float(lag) if lag is not None else None
+
+
+class ReplicaRouter:
+    """Escolhe a engine das leituras: réplica saudável (round-robin) ou primário
+
+    O lag de cada réplica é medido no máximo a cada `lag_check_seconds`, por quem estiver
+    lendo no momento (sem thread dedicada); leituras concorrentes usam o último valor.
+    """
+
+    def __init__(self, replicas: Optional[Dict[str, Engine]] = None,
+                 max_lag_seconds: float = 5.0, lag_check_seconds: float = 2.0,
+                 read_your_writes_seconds: float = 5.0,
+                 lag_probe: Callable[[Engine], Optional[float]] = mysql_replica_lag):
+        self.replicas = dict(replicas or {})
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.lag_probe = lag_probe
+        self._lag: Dict[str, Optional[float]] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._probe_lock = threading.Lock()
+        self._next = itertools.count()
+        self._recent_writes: Dict[str, float] = {}
+        self._writes_lock = threading.Lock()
+
+    # Lag ----------------------------------------------------------------------
+
+    def lag(self, name: str) -> Optional[float]:
+        now = time.monotonic()
+        if now - self._checked_at.get(name, float("-inf")) >= self.lag_check_seconds:
+            if self._probe_lock.acquire(blocking=False):
+                try:
+                    self._checked_at[name] = now
+                    try:
+                        self._lag[name] = self.lag_probe(self.replicas[name])
+                    except Exception as e:
+                        logger.warning(f"Erro ao medir lag da réplica {name}: {e}")
+                        self._lag[name] = None
+                    lag = self._lag[name]
+                    db_replica_lag_seconds.labels(replica=name).set(-1 if lag is None else lag)
+                finally:
+                    self._probe_lock.release()
+        return self._lag.get(name)
+
+    def healthy_replicas(self) -> List[str]:
+        healthy = []
+        for name in self.replicas:
+            lag = self.lag(name)
+            if lag is not None and lag <= self.max_lag_seconds:
+                healthy.append(name)
+        return healthy
+
+    # Read-your-writes ---------------------------------------------------------
+
+    def mark_write(self, client_key: Optional[str]):
+        if not client_key or not self.replicas:
+            return
+        now = time.monotonic()
+        with self._writes_lock:
+            self._recent_writes[client_key] = now + self.read_your_writes_seconds
+            if len(self._recent_writes) > 10000:
+                self._recent_writes = {
+                    key: until for key, until in self._recent_writes.items() if until > now
+                }
+
+    def wrote_recently(self, client_key: Optional[str]) -> bool:
+        if not client_key:
+            return False
+        until = self._recent_writes.get(client_key)
+        return until is not None and until > time.monotonic()
+
+    # Roteamento ---------------------------------------------------------------
+
+    def route_read(self, client_key: Optional[str]):
+        """(engine da réplica ou None para o primário, motivo)"""
+        if not self.replicas:
+            return None, "no_replica"
+        if self.wrote_recently(client_key):
+            return None, "read_your_writes"
+        healthy = self.healthy_replicas()
+        if not healthy:
+            return None, "replica_lag"
+        name = healthy[next(self._next) % len(healthy)]
+        return self.replicas[name], "replica"
+
+
+replica_router = ReplicaRouter(
+    {
+        f"replica-{index}": _create_engine(url, f"replica-{index}")
+        for index, url in enumerate(settings.mysql_replica_urls)
+    },
+    max_lag_seconds=settings.DB_REPLICA_MAX_LAG_SECONDS,
+    lag_check_seconds=settings.DB_REPLICA_LAG_CHECK_SECONDS,
+    read_your_writes_seconds=settings.DB_READ_YOUR_WRITES_SECONDS,
+)
+
+
+class RoutingSession(Session):
+    """Session que envia as leituras marcadas como read_only para uma réplica
+
+    info["replica_router"] substitui o roteador global (ex.: testes com dois SQLite);
+    info["client_key"] identifica o cliente para o read-your-writes entre requisições.
+    """
+
+    @property
+    def router(self) -> ReplicaRouter:
+        return self.info.get("replica_router") or replica_router
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        primary = super().get_bind(mapper, clause=clause, **kw)
+        if self._flushing or getattr(clause, "is_dml", False):
+            self.info["wrote"] = True
+            return primary
+        if not self.info.get("read_only"):
+            return primary
+        if self.info.get("wrote"):
+            reason, replica = "session_wrote", None
+        elif getattr(clause, "_for_update_arg", None) is not None:
+            reason, replica = "for_update", None
+        else:
+            replica, reason = self.router.route_read(self.info.get("client_key"))
+        db_read_routing_total.labels(target="replica" if replica is not None else "primary", reason=reason).inc()
+        return replica if replica is not None else primary
+
+    def commit(self):
+        # Fase "commit" do Server-Timing: só o COMMIT, os statements do flush contam em "db"
+        with server_timing.phase("commit", exclude=("db",)):
+            super().commit()
+
+    def close(self):
+        # Sessões abertas em outros shards durante a requisição (app.sharding)
+        for session in self.info.pop("shard_sessions", {}).values():
+            session.close()
+        super().close()
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _record_client_write(session):
+    if session.info.get("wrote"):
+        session.router.mark_write(session.info.get("client_key"))
+
+
+def read_only(func):
+    """Marca um método de serviço (db como primeiro argumento) como leitura roteável para réplica"""
+    @functools.wraps(func)
+    def wrapper(db, *args, **kwargs):
+        previous = db.info.get("read_only", False)
+        db.info["read_only"] = True
+        try:
+            return func(db, *args, **kwargs)
+        finally:
+            db.info["read_only"] = previous
+    return wrapper
+
+
+def client_key(request: Request) -> Optional[str]:
+    """Identidade do cliente para o read-your-writes: X-Client-Id ou endereço de origem"""
+    key = request.headers.get("X-Client-Id")
+    if key:
+        return key
+    return request.client.host if request.client else None
+
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
-def get_db():
+def get_db(request: Request):
     """Dependency para obter sessão do banco de dados com tratamento de erros"""
     db = SessionLocal()
+    db.info["client_key"] = client_key(request)
     try:
         # Testa conexão antes de retornar
         db.execute(text("SELECT 1"))
         yield db
+    except HTTPException:
+        # Erros HTTP do endpoint (404, 409...) não são falhas de banco
+        db.rollback()
+        raise
     except OperationalError as e:
         db.close()
         logger.error(f"Erro de conexão com banco de dados: {e}")
@@ -63,6 +300,3 @@ def get_db():
     finally:
         db.close()
 
-
-
-
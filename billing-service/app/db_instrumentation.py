@@ -0,0 +1,299 @@
+"""
+Instrumentação do SQLAlchemy: métricas do pool de conexões, do threadpool
+e tempo por query (fingerprint + slow-query log)
+"""
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, List, Any
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from prometheus_client import Counter, Histogram, Gauge
+from app.middleware import server_timing
+
+logger = logging.getLogger(__name__)
+
+# Métricas do pool de conexões
+db_pool_size = Gauge(
+    'billing_db_pool_size',
+    'Configured connection pool size',
+    ['pool']
+)
+
+db_pool_checked_out = Gauge(
+    'billing_db_pool_checked_out',
+    'Connections currently checked out from the pool',
+    ['pool']
+)
+
+db_pool_overflow = Gauge(
+    'billing_db_pool_overflow',
+    'Connections currently open beyond pool_size (overflow)',
+    ['pool']
+)
+
+db_pool_checkout_wait_seconds = Histogram(
+    'billing_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the pool',
+    ['pool'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+db_pool_timeouts_total = Counter(
+    'billing_db_pool_timeouts_total',
+    'Checkouts that failed because the pool was exhausted (pool_timeout)',
+    ['pool']
+)
+
+db_connection_lifetime_seconds = Histogram(
+    'billing_db_connection_lifetime_seconds',
+    'Lifetime of DBAPI connections, from connect to close',
+    ['pool'],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+)
+
+# Métricas do sharding (app.sharding)
+shard_sessions_total = Counter(
+    'billing_shard_sessions_total',
+    'Sessions opened on a shard, by routing mode (patient, id, scatter)',
+    ['shard', 'mode']
+)
+
+shard_scatter_duration_seconds = Histogram(
+    'billing_shard_scatter_duration_seconds',
+    'Duration of cross-shard scatter-gather queries',
+    ['operation'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+# Métricas do threadpool (endpoints síncronos)
+threadpool_size = Gauge(
+    'billing_threadpool_size',
+    'Configured size of the threadpool used by sync endpoints'
+)
+
+threadpool_in_use = Gauge(
+    'billing_threadpool_in_use',
+    'Threadpool tokens currently borrowed by sync endpoints'
+)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mede o tempo de espera por uma conexão"""
+
+    # Nome usado no label "pool" das métricas (definido em instrument_pool)
+    metrics_name = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_timeouts_total.labels(pool=self.metrics_name).inc()
+            raise
+        finally:
+            db_pool_checkout_wait_seconds.labels(pool=self.metrics_name).observe(
+                time.perf_counter() - start
+            )
+
+
+def instrument_pool(engine, name: str = "primary"):
+    """Registra hooks de eventos do pool exportando métricas Prometheus"""
+    pool = engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        pool.metrics_name = name
+
+    if isinstance(pool, QueuePool):
+        db_pool_size.labels(pool=name).set(pool.size())
+
+    def _update_gauges():
+        if isinstance(pool, QueuePool):
+            db_pool_checked_out.labels(pool=name).set(pool.checkedout())
+            db_pool_overflow.labels(pool=name).set(max(pool.overflow(), 0))
+
+    @event.listens_for(pool, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        connection_record.info["connected_at"] = time.monotonic()
+
+    @event.listens_for(pool, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        _update_gauges()
+
+    @event.listens_for(pool, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        _update_gauges()
+
+    @event.listens_for(pool, "close")
+    def _on_close(dbapi_connection, connection_record):
+        connected_at = connection_record.info.pop("connected_at", None)
+        if connected_at is not None:
+            db_connection_lifetime_seconds.labels(pool=name).observe(
+                time.monotonic() - connected_at
+            )
+        _update_gauges()
+
+    return engine
+
+
+def configure_threadpool(size: int):
+    """Ajusta o limite do threadpool do AnyIO usado pelo Starlette para endpoints síncronos
+
+    Deve ser chamado dentro do event loop (ex.: no lifespan da aplicação).
+    """
+    from anyio import to_thread
+
+    limiter = to_thread.current_default_thread_limiter()
+    limiter.total_tokens = size
+    threadpool_size.set(size)
+    threadpool_in_use.set_function(lambda: limiter.borrowed_tokens)
+    logger.info(f"Threadpool configurado com {size} threads")
+    return limiter
+
+
+# Métricas por query (label = fingerprint curto, para manter cardinalidade baixa)
+db_query_duration_seconds = Histogram(
+    'billing_db_query_duration_seconds',
+    'SQL statement execution time per statement fingerprint',
+    ['pool', 'operation', 'query_id'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+db_slow_queries_total = Counter(
+    'billing_db_slow_queries_total',
+    'SQL statements slower than SLOW_QUERY_THRESHOLD_MS',
+    ['pool', 'query_id']
+)
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|:\w+|\?")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+# Hints do otimizador (ex.: MAX_EXECUTION_TIME do deadline) não distinguem statements
+_OPTIMIZER_HINT = re.compile(r"/\*\+.*?\*/\s*", re.DOTALL)
+
+
+@lru_cache(maxsize=2048)
+def fingerprint_statement(statement: str) -> str:
+    """Normaliza literais e placeholders para agrupar statements equivalentes
+
+    Ex.: "SELECT ... WHERE id = 'CLM1A2B3C' LIMIT 10" -> "SELECT ... WHERE id = ? LIMIT ?"
+    Listas IN (...) de tamanhos diferentes colapsam para "IN (?+)".
+    """
+    normalized = _OPTIMIZER_HINT.sub("", statement)
+    normalized = _STRING_LITERAL.sub("?", normalized)
+    normalized = _PLACEHOLDER.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _IN_LIST.sub("IN (?+)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+@lru_cache(maxsize=2048)
+def query_id(fingerprint: str) -> str:
+    """Identificador curto e estável de um fingerprint (usado como label)"""
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+
+def _caller_service_method() -> str:
+    """Localiza o método de serviço (app.services.*) que originou a query"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("app.services"):
+            code = frame.f_code
+            qualname = getattr(code, "co_qualname", code.co_name)
+            return f"{module}.{qualname}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class QueryStats:
+    """Agregado em memória de tempo por fingerprint (alimenta /debug/queries)"""
+
+    def __init__(self, max_fingerprints: int = 1000):
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, qid: str, fingerprint: str, duration: float):
+        with self._lock:
+            entry = self._stats.get(qid)
+            if entry is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    return
+                entry = self._stats[qid] = {
+                    "query_id": qid,
+                    "fingerprint": fingerprint,
+                    "calls": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                }
+            entry["calls"] += 1
+            entry["total_seconds"] += duration
+            if duration > entry["max_seconds"]:
+                entry["max_seconds"] = duration
+
+    def top(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [dict(entry) for entry in self._stats.values()]
+        entries.sort(key=lambda e: e["total_seconds"], reverse=True)
+        for entry in entries:
+            entry["mean_seconds"] = entry["total_seconds"] / entry["calls"]
+        return entries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
+
+
+def instrument_queries(engine, name: str = "primary", slow_query_threshold_ms: float = 200.0):
+    """Registra hooks before/after_cursor_execute medindo cada statement
+
+    O início fica no contexto de execução do statement (não em conn.info): statements que
+    falham ou são barrados por outro hook não deixam marcas na conexão do pool.
+    """
+    slow_threshold = slow_query_threshold_ms / 1000.0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._billing_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_billing_query_start", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        server_timing.record("db", duration)
+        fingerprint = fingerprint_statement(statement)
+        qid = query_id(fingerprint)
+        operation = fingerprint.split(" ", 1)[0].upper()
+
+        db_query_duration_seconds.labels(pool=name, operation=operation, query_id=qid).observe(duration)
+        query_stats.record(qid, fingerprint, duration)
+
+        if duration >= slow_threshold:
+            db_slow_queries_total.labels(pool=name, query_id=qid).inc()
+            log_data = {
+                "event": "slow_query",
+                "pool": name,
+                "query_id": qid,
+                "fingerprint": fingerprint,
+                "duration_ms": round(duration * 1000, 2),
+                "rowcount": cursor.rowcount,
+                "executemany": executemany,
+                "caller": _caller_service_method(),
+            }
+            logger.warning(f"Slow query: {json.dumps(log_data)}")
+
+    return engine
@@ -0,0 +1,200 @@
+"""
+Deadline por requisição (propagado para MySQL, Redis e Kafka)
+
+O cliente informa quanto tempo vai esperar:
+    X-Request-Timeout: 2.5        segundos (ou "2500ms") a partir da chegada
+    X-Request-Deadline: 1760000000.25   instante absoluto (epoch em segundos ou ms)
+Sem header vale REQUEST_TIMEOUT_DEFAULT_SECONDS (0 = sem deadline); o pedido é limitado
+a REQUEST_TIMEOUT_MAX_SECONDS.
+
+O deadline fica em um contextvar (visível no threadpool dos endpoints síncronos) e é
+aplicado como:
+- MySQL: hint MAX_EXECUTION_TIME nos SELECTs e recusa de qualquer statement após o prazo;
+- Redis: timeout de leitura do socket limitado ao tempo restante;
+- Kafka: espera pela confirmação do broker limitada ao tempo restante (o envio em si
+  não é cancelado, já que o evento corresponde a uma escrita já confirmada no banco).
+Depois do commit, o trabalho que acompanha a escrita confirmada (releitura, invalidação de
+cache e publicação do evento) roda em `suspended()`: um 504 nesse ponto perderia o evento,
+já que o retry encontra a escrita feita e não publica de novo.
+Requisições que chegam com o prazo vencido recebem 504 sem executar nada (o middleware
+fica por fora do controle de admissão, e 504 por deadline do cliente não reduz o limite).
+"""
+import re
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import HTTPException
+from prometheus_client import Counter
+from sqlalchemy import event
+from app.config import settings
+
+deadline_exceeded_total = Counter(
+    'billing_deadline_exceeded_total',
+    'Work cancelled or cut short because the request deadline expired',
+    ['stage']
+)
+
+HEADER_TIMEOUT = b"x-request-timeout"
+HEADER_DEADLINE = b"x-request-deadline"
+
+# Instante (time.monotonic) em que a requisição corrente expira
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    """Prazo da requisição esgotado (504); `stage` indica onde o trabalho foi interrompido"""
+
+    def __init__(self, stage: str):
+        deadline_exceeded_total.labels(stage=stage).inc()
+        super().__init__(
+            status_code=504,
+            detail={
+                "error": "Deadline exceeded",
+                "message": "Prazo da requisição esgotado; processamento interrompido.",
+                "stage": stage
+            }
+        )
+
+
+def set_deadline(timeout_seconds: Optional[float]):
+    """Define o deadline do contexto corrente; retorna o token para reset"""
+    value = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+    return _deadline.set(value)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+@contextmanager
+def suspended():
+    """Executa o bloco sem deadline (trabalho pós-commit de uma escrita já confirmada)"""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Segundos até o deadline (negativo se vencido; None se não há deadline)"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(stage: str):
+    """Interrompe o trabalho se o deadline já venceu"""
+    budget = remaining()
+    if budget is not None and budget <= 0:
+        raise DeadlineExceeded(stage)
+
+
+def timeout_for(default: Optional[float]) -> Optional[float]:
+    """Timeout de uma espera: o menor entre `default` e o tempo restante (mínimo 0)"""
+    budget = remaining()
+    if budget is None:
+        return default
+    budget = max(0.0, budget)
+    return budget if default is None else min(default, budget)
+
+
+_DURATION = re.compile(r"^\s*(?P<value>\d+(?:\.\d+)?)\s*(?P<unit>ms|s)?\s*$")
+
+
+def parse_timeout(headers) -> Optional[float]:
+    """Timeout (segundos a partir de agora) a partir dos headers ASGI; None se ausente/inválido"""
+    values = dict(headers)
+    raw_timeout = values.get(HEADER_TIMEOUT)
+    if raw_timeout:
+        match = _DURATION.match(raw_timeout.decode("latin-1"))
+        if match:
+            value = float(match["value"])
+            return value / 1000 if match["unit"] == "ms" else value
+    raw_deadline = values.get(HEADER_DEADLINE)
+    if raw_deadline:
+        try:
+            value = float(raw_deadline.decode("latin-1"))
+        except ValueError:
+            return None
+        # Epoch em milissegundos
+        if value > 1e11:
+            value /= 1000
+        return value - time.time()
+    return None
+
+
+class DeadlineMiddleware:
+    """Middleware ASGI: converte os headers em deadline e descarta requisições já vencidas"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = parse_timeout(scope["headers"])
+        if timeout is None and settings.REQUEST_TIMEOUT_DEFAULT_SECONDS > 0:
+            timeout = settings.REQUEST_TIMEOUT_DEFAULT_SECONDS
+        if timeout is not None:
+            timeout = min(timeout, settings.REQUEST_TIMEOUT_MAX_SECONDS)
+            if timeout <= 0:
+                deadline_exceeded_total.labels(stage="arrival").inc()
+                await self._reject(send)
+                return
+
+        token = set_deadline(timeout)
+        # Visível como request.state.deadline (e para o controle de admissão)
+        scope.setdefault("state", {})["deadline"] = _deadline.get()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_deadline(token)
+
+    async def _reject(self, send):
+        body = json.dumps({
+            "detail": {
+                "error": "Deadline exceeded",
+                "message": "Prazo da requisição já vencido na chegada.",
+                "stage": "arrival"
+            }
+        }).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+# MySQL: erro 3024 (ER_QUERY_TIMEOUT), statement interrompido por MAX_EXECUTION_TIME
+MYSQL_QUERY_TIMEOUT = 3024
+
+
+def instrument_engine(engine):
+    """Aplica o deadline a cada statement da engine"""
+    is_mysql = engine.dialect.name == "mysql"
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _apply_deadline(conn, cursor, statement, parameters, context, executemany):
+        budget = remaining()
+        if budget is None:
+            return statement, parameters
+        if budget <= 0:
+            raise DeadlineExceeded("db")
+        # MAX_EXECUTION_TIME só vale para SELECT (o MySQL ignora em escritas)
+        if is_mysql and statement[:6].upper() == "SELECT" and not statement.startswith("SELECT /*+"):
+            statement = f"SELECT /*+ MAX_EXECUTION_TIME({max(1, int(budget * 1000))}) */{statement[6:]}"
+        return statement, parameters
+
+    @event.listens_for(engine, "handle_error")
+    def _statement_timeout(context):
+        # SELECT interrompido pelo MAX_EXECUTION_TIME: vira 504 em vez de erro de banco
+        args = getattr(context.original_exception, "args", None)
+        if args and args[0] == MYSQL_QUERY_TIMEOUT and _deadline.get() is not None:
+            raise DeadlineExceeded("db_timeout") from context.original_exception
+
+    return engine
@@ -0,0 +1,58 @@
+"""
+Consumidor local de eventos (stand-in do Kafka para desenvolvimento e jobs batch)
+
+Lê eventos de um arquivo JSON Lines (um envelope de evento por linha, no mesmo formato
+publicado por KafkaEventProducer) em lotes, e guarda o offset consumido em um arquivo
+"<arquivo>.offset", como o commit de offset de um consumer group.
+"""
+import os
+import json
+import logging
+from typing import Iterator, List
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEventConsumer:
+    def __init__(self, path: str, batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self.offset_path = f"{path}.offset"
+        self._position = self._read_offset()
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def batches(self) -> Iterator[List[dict]]:
+        """Itera lotes de eventos a partir do último offset confirmado"""
+        with open(self.path, "rb") as f:
+            f.seek(self._position)
+            batch = []
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if line:
+                    try:
+                        batch.append(json.loads(line))
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Evento inválido ignorado em {self.path}: {e}")
+                if len(batch) >= self.batch_size:
+                    self._position = f.tell()
+                    yield batch
+                    batch = []
+            self._position = f.tell()
+            if batch:
+                yield batch
+
+    def commit(self):
+        """Confirma o offset dos lotes já entregues"""
+        tmp_path = f"{self.offset_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self._position))
+        os.replace(tmp_path, self.offset_path)
@@ -0,0 +1,308 @@
+"""
+Serialização dos eventos de billing publicados no Kafka
+
+Formatos suportados (KAFKA_SERIALIZATION_FORMAT):
+    json     - envelope JSON compacto (padrão, compatível com os consumidores atuais)
+    msgpack  - MessagePack (requer o pacote msgpack)
+    avro     - Avro sem schema embutido (requer fastavro e o schema do evento no registry)
+
+Cada mensagem leva o formato e a versão do schema nos headers, de modo que o consumidor
+decodifica sem depender da configuração do producer:
+    content-type    application/json | application/x-msgpack | application/avro
+    event-type      ClaimSubmitted, InvoiceSettled, ...
+    schema-version  versão do schema usada na escrita ("0" se o evento não tem schema)
+
+O registry é um stand-in local de um schema registry: arquivos
+app/event_schemas/<EventType>.v<versão>.avsc, e a maior versão é usada na escrita.
+
+Benchmark (tamanho e throughput de encode/decode por formato e compressão):
+    python -m app.event_serialization --benchmark 20000
+"""
+import io
+import os
+import re
+import json
+import random
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import fastavro
+except ImportError:
+    fastavro = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "event_schemas")
+_SCHEMA_FILE_PATTERN = re.compile(r"^(?P<event_type>\w+)\.v(?P<version>\d+)\.avsc$")
+
+HEADER_CONTENT_TYPE = "content-type"
+HEADER_EVENT_TYPE = "event-type"
+HEADER_SCHEMA_VERSION = "schema-version"
+
+Headers = List[Tuple[str, bytes]]
+
+
+class SchemaRegistry:
+    """Schemas Avro versionados lidos de um diretório local"""
+
+    def __init__(self, directory: str = DEFAULT_SCHEMA_DIR):
+        self.directory = directory
+        self._schemas: Optional[Dict[Tuple[str, int], dict]] = None
+        self._parsed: Dict[Tuple[str, int], object] = {}
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[Tuple[str, int], dict]:
+        if self._schemas is None:
+            with self._lock:
+                if self._schemas is None:
+                    schemas = {}
+                    names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+                    for name in names:
+                        match = _SCHEMA_FILE_PATTERN.match(name)
+                        if not match:
+                            continue
+                        with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                            schemas[(match["event_type"], int(match["version"]))] = json.load(f)
+                    self._schemas = schemas
+        return self._schemas
+
+    def latest_version(self, event_type: str) -> Optional[int]:
+        versions = [version for name, version in self._load() if name == event_type]
+        return max(versions) if versions else None
+
+    def get(self, event_type: str, version: int) -> Optional[dict]:
+        return self._load().get((event_type, version))
+
+    def parsed(self, event_type: str, version: int):
+        """Schema compilado pelo fastavro (cacheado)"""
+        key = (event_type, version)
+        if key not in self._parsed:
+            schema = self.get(event_type, version)
+            if schema is None:
+                raise ValueError(f"Schema não encontrado: {event_type} v{version}")
+            self._parsed[key] = fastavro.parse_schema(schema)
+        return self._parsed[key]
+
+
+class EventSerializer:
+    """Interface dos serializadores de evento"""
+    name = ""
+    content_type = ""
+    requires_schema = False
+
+    def encode(self, event: dict, schema=None) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes, schema=None) -> dict:
+        raise NotImplementedError
+
+
+class JsonEventSerializer(EventSerializer):
+    name = "json"
+    content_type = "application/json"
+
+    def encode(self, event: dict, schema=None) -> bytes:
+        return json.dumps(event, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def decode(self, payload: bytes, schema=None) -> dict:
+        return json.loads(payload)
+
+
+class MsgPackEventSerializer(EventSerializer):
+    name = "msgpack"
+    content_type = "application/x-msgpack"
+
+    def encode(self, event: dict, schema=None) -> bytes:
+        return msgpack.packb(event, use_bin_type=True)
+
+    def decode(self, payload: bytes, schema=None) -> dict:
+        return msgpack.unpackb(payload, raw=False)
+
+
+class AvroEventSerializer(EventSerializer):
+    name = "avro"
+    content_type = "application/avro"
+    requires_schema = True
+
+    def encode(self, event: dict, schema=None) -> bytes:
+        buffer = io.BytesIO()
+        fastavro.schemaless_writer(buffer, schema, event)
+        return buffer.getvalue()
+
+    def decode(self, payload: bytes, schema=None) -> dict:
+        return fastavro.schemaless_reader(io.BytesIO(payload), schema, None)
+
+
+SERIALIZERS = {
+    serializer.name: serializer
+    for serializer in (JsonEventSerializer, MsgPackEventSerializer, AvroEventSerializer)
+}
+
+# Dependência opcional de cada formato
+_REQUIRED_MODULES = {"msgpack": lambda: msgpack, "avro": lambda: fastavro}
+
+
+def get_serializer(name: str) -> EventSerializer:
+    serializer_class = SERIALIZERS.get(name)
+    if serializer_class is None:
+        raise ValueError(f"Formato de serialização desconhecido: {name}")
+    if name in _REQUIRED_MODULES and _REQUIRED_MODULES[name]() is None:
+        raise ValueError(f"Formato {name} requer um pacote não instalado (ver requirements.txt)")
+    return serializer_class()
+
+
+class EventCodec:
+    """Codifica envelopes de evento com o serializador configurado e monta os headers"""
+
+    def __init__(self, serializer: EventSerializer, registry: SchemaRegistry):
+        self.serializer = serializer
+        self.registry = registry
+        self._by_content_type = {serializer.content_type: serializer}
+
+    def encode(self, event: dict) -> Tuple[bytes, Headers]:
+        event_type = event["eventType"]
+        version = self.registry.latest_version(event_type)
+        schema = None
+        if self.serializer.requires_schema:
+            if version is None:
+                raise ValueError(f"Evento {event_type} sem schema registrado para {self.serializer.name}")
+            schema = self.registry.parsed(event_type, version)
+
+        headers = [
+            (HEADER_CONTENT_TYPE, self.serializer.content_type.encode()),
+            (HEADER_EVENT_TYPE, event_type.encode()),
+            (HEADER_SCHEMA_VERSION, str(version or 0).encode()),
+        ]
+        return self.serializer.encode(event, schema), headers
+
+    def _serializer_for(self, content_type: Optional[str]) -> EventSerializer:
+        if not content_type:
+            # Mensagens sem headers (anteriores ao versionamento) são JSON
+            content_type = JsonEventSerializer.content_type
+        serializer = self._by_content_type.get(content_type)
+        if serializer is None:
+            for serializer_class in SERIALIZERS.values():
+                if serializer_class.content_type == content_type:
+                    serializer = self._by_content_type[content_type] = get_serializer(serializer_class.name)
+                    break
+            else:
+                raise ValueError(f"content-type de evento desconhecido: {content_type}")
+        return serializer
+
+    def decode(self, payload: bytes, headers: Optional[Headers] = None) -> dict:
+        values = {key: value.decode() for key, value in (headers or [])}
+        serializer = self._serializer_for(values.get(HEADER_CONTENT_TYPE))
+        schema = None
+        if serializer.requires_schema:
+            schema = self.registry.parsed(values[HEADER_EVENT_TYPE], int(values[HEADER_SCHEMA_VERSION]))
+        return serializer.decode(payload, schema)
+
+
+def build_codec(format_name: str, schema_dir: Optional[str] = None) -> EventCodec:
+    return EventCodec(get_serializer(format_name), SchemaRegistry(schema_dir or DEFAULT_SCHEMA_DIR))
+
+
+def _sample_claim_event(index: int, items: int) -> dict:
+    rng = random.Random(index)
+    item_list = [
+        {
+            "description": f"Procedimento {rng.randrange(10**6):06d} - sessão {item}",
+            "code": f"{rng.randrange(10000000, 99999999)}",
+            "value": round(rng.uniform(10, 2000), 2),
+            "quantity": rng.randrange(1, 5),
+        }
+        for item in range(items)
+    ]
+    return {
+        "eventId": f"evt-1700000000000-{index:09d}",
+        "eventType": "ClaimSubmitted",
+        "timestamp": "2026-01-15T12:00:00.000000Z",
+        "source": "billing-service",
+        "resourceType": "Claim",
+        "data": {
+            "id": f"CLM{index:06X}",
+            "patientId": f"P{index:08d}",
+            "insuranceId": "UNIMED-001",
+            "amount": round(sum(item["value"] * item["quantity"] for item in item_list), 2),
+            "currency": "BRL",
+            "status": "pending",
+            "items": item_list,
+            "createdAt": "2026-01-15T12:00:00Z",
+        },
+    }
+
+
+def benchmark(events: int = 20000, items: int = 20, batch_size: int = 100) -> List[dict]:
+    """Compara tamanho por mensagem e throughput de encode/decode de cada formato
+
+    A compressão é medida por lote de `batch_size` mensagens, como o producer comprime
+    cada batch de uma partição.
+    """
+    import time
+    from kafka import codec as kafka_codec
+
+    compressors = {"none": lambda data: data}
+    if kafka_codec.has_gzip():
+        compressors["gzip"] = kafka_codec.gzip_encode
+    if kafka_codec.has_lz4():
+        compressors["lz4"] = kafka_codec.lz4_encode
+    if kafka_codec.has_zstd():
+        compressors["zstd"] = kafka_codec.zstd_encode
+
+    sample = [_sample_claim_event(i, items) for i in range(events)]
+    results = []
+    for name in SERIALIZERS:
+        try:
+            codec = build_codec(name)
+        except ValueError as e:
+            results.append({"format": name, "skipped": str(e)})
+            continue
+
+        started = time.perf_counter()
+        encoded = [codec.encode(event) for event in sample]
+        encode_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for payload, headers in encoded:
+            codec.decode(payload, headers)
+        decode_seconds = time.perf_counter() - started
+
+        payloads = [payload for payload, _ in encoded]
+        result = {
+            "format": name,
+            "bytes_per_event": round(sum(map(len, payloads)) / events, 1),
+            "encode_per_second": round(events / encode_seconds),
+            "decode_per_second": round(events / decode_seconds),
+        }
+        for compression, compress in compressors.items():
+            if compression == "none":
+                continue
+            compressed = sum(
+                len(compress(b"".join(payloads[i:i + batch_size])))
+                for i in range(0, events, batch_size)
+            )
+            result[f"{compression}_bytes_per_event"] = round(compressed / events, 1)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serialização de eventos de billing")
+    parser.add_argument("--benchmark", type=int, nargs="?", const=20000,
+                        help="Quantidade de eventos ClaimSubmitted sintéticos (padrão: 20000)")
+    parser.add_argument("--items", type=int, default=20, help="Itens por claim no benchmark")
+    args = parser.parse_args()
+    if args.benchmark:
+        for row in benchmark(args.benchmark, args.items):
+            print(row)
+    else:
+        parser.print_help()
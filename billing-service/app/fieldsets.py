@@ -0,0 +1,53 @@
+"""
+Sparse fieldsets para os endpoints de listagem (?fields=id,status&include=items)
+
+Os campos pedidos viram a lista de colunas do SELECT (o filtro é feito no SQL, não só
+na resposta); relações como os itens do claim só são carregadas quando incluídas.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+from fastapi import HTTPException
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+
+def parse_fields(fields: Optional[str], columns: Dict[str, object],
+                 always: Sequence[str] = ("id",)) -> List[object]:
+    """Converte `fields` na lista de colunas a selecionar (todas, se não informado)
+
+    Campos em `always` são sempre selecionados (ex.: id, usado para montar a resposta).
+    """
+    requested = _split(fields)
+    if not requested:
+        return list(columns.values())
+
+    invalid = [name for name in requested if name not in columns]
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid fields",
+                "message": f"Campos inválidos: {', '.join(invalid)}",
+                "allowed": list(columns)
+            }
+        )
+    names = [name for name in always if name in columns]
+    names += [name for name in requested if name not in names]
+    return [columns[name] for name in names]
+
+
+def parse_include(include: Optional[str], allowed: Iterable[str]) -> Set[str]:
+    requested = set(_split(include))
+    allowed = set(allowed)
+    invalid = sorted(requested - allowed)
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid include",
+                "message": f"Relações inválidas: {', '.join(invalid)}",
+                "allowed": sorted(allowed)
+            }
+        )
+    return requested
@@ -1,12 +1,19 @@
-import json
 import logging
 from datetime import datetime
+from typing import Optional
 from kafka import KafkaProducer
+from kafka import codec as kafka_codec
 from kafka.errors import KafkaError
 from app.config import settings
+from app.event_serialization import build_codec
+from app import deadline, tracing
+from app.middleware import server_timing
 
 logger = logging.getLogger(__name__)
 
+# Espera máxima pela confirmação do broker (limitada pelo deadline da requisição)
+PUBLISH_TIMEOUT_SECONDS = 10
+
 
 def generate_event_id() -> str:
     """Gera eventId no formato: evt-{timestamp}-{random_string}
@@ -21,34 +28,59 @@ def generate_event_id() -> str:
     return f"evt-{timestamp}-{random_str}"
 
 
+# Disponibilidade das bibliotecas de compressão no kafka-python
+COMPRESSION_CODECS = {
+    "gzip": kafka_codec.has_gzip,
+    "snappy": kafka_codec.has_snappy,
+    "lz4": kafka_codec.has_lz4,
+    "zstd": kafka_codec.has_zstd,
+}
+
+
+def resolve_compression_type(name: Optional[str]) -> Optional[str]:
+    """Valida KAFKA_COMPRESSION_TYPE; sem a biblioteca do codec, publica sem compressão"""
+    if not name or name == "none":
+        return None
+    has_codec = COMPRESSION_CODECS.get(name)
+    if has_codec is None:
+        logger.warning(f"Compressão Kafka desconhecida: {name}. Publicando sem compressão.")
+        return None
+    if not has_codec():
+        logger.warning(f"Biblioteca de compressão {name} não instalada. Publicando sem compressão.")
+        return None
+    return name
+
+
 class KafkaEventProducer:
     def __init__(self):
         self._producer = None
         self.topic = settings.KAFKA_TOPIC_BILLING_EVENTS
+        self.codec = build_codec(settings.KAFKA_SERIALIZATION_FORMAT, settings.KAFKA_SCHEMA_DIR)
     
     @property
     def producer(self):
         """Lazy initialization do producer Kafka"""
         if self._producer is None:
             try:
+                # Serialização feita em _send (o formato e a versão do schema vão nos headers,
+                # que exigem protocolo >= 0.11; zstd exige broker >= 2.1)
                 self._producer = KafkaProducer(
                     bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS.split(','),
-                    value_serializer=lambda v: json.dumps(v).encode('utf-8'),
                     key_serializer=lambda k: k.encode('utf-8') if k else None,
-                    api_version=(0, 10, 1)
+                    compression_type=resolve_compression_type(settings.KAFKA_COMPRESSION_TYPE),
+                    api_version=(2, 5, 0),
+                    # Com api_version fixa não há sondagem na criação: sem broker, é o send()
+                    # que bloqueia esperando metadados (padrão do kafka-python: 60s)
+                    max_block_ms=settings.KAFKA_MAX_BLOCK_MS
                 )
             except Exception as e:
                 logger.warning(f"Kafka não disponível: {e}. Eventos não serão publicados.")
                 self._producer = None
         return self._producer
     
-    def _publish_event(self, event_type: str, resource_type: str, data: dict):
-        """Publica evento no padrão definido"""
-        if self.producer is None:
-            logger.warning(f"Kafka não disponível. Evento {event_type} não publicado.")
-            return False
-        
-        event = {
+    def _build_event(self, event_type: str, resource_type: str, data: dict) -> dict:
+        """Monta o envelope do evento no padrão definido"""
+        return {
             "eventId": generate_event_id(),
             "eventType": event_type,
             "timestamp": datetime.utcnow().isoformat() + "Z",
@@ -56,19 +88,92 @@ class KafkaEventProducer:
             "resourceType": resource_type,
             "data": data
         }
-        
-        try:
-            future = self.producer.send(
-                self.topic,
-                key=data.get("id", ""),
-                value=event
-            )
-            future.get(timeout=10)
-            logger.info(f"Evento publicado: {event_type} - {data.get('id', 'N/A')}")
-            return True
-        except (KafkaError, Exception) as e:
-            logger.error(f"Erro ao publicar evento no Kafka: {e}")
+    
+    def _send(self, event: dict):
+        """Serializa o envelope e envia com os headers de formato/schema"""
+        with server_timing.phase("serialize"):
+            value, headers = self.codec.encode(event)
+        return self.producer.send(
+            self.topic,
+            key=event["data"].get("id", ""),
+            value=value,
+            headers=tracing.inject_headers(headers)
+        )
+
+    def _publish_span(self, event_type: str, count: int):
+        return tracing.span(
+            f"{self.topic} publish",
+            tracing.SpanKind.PRODUCER,
+            {
+                "messaging.system": "kafka",
+                "messaging.destination.name": self.topic,
+                "messaging.operation": "publish",
+                "messaging.batch.message_count": count,
+                "billing.event_type": event_type,
+            }
+        )
+    
+    def _wait_timeout(self, event_type: str) -> Optional[float]:
+        """Tempo de espera pelo broker; None se o deadline da requisição já venceu
+
+        O envio não é cancelado: o evento corresponde a uma escrita já confirmada no banco
+        e segue no buffer do producer, só a requisição deixa de esperar a confirmação.
+        """
+        timeout = deadline.timeout_for(PUBLISH_TIMEOUT_SECONDS)
+        if timeout <= 0:
+            deadline.deadline_exceeded_total.labels(stage="kafka_wait").inc()
+            logger.warning(f"Deadline da requisição vencido: confirmação de {event_type} não aguardada")
+            return None
+        return timeout
+
+    def _publish_event(self, event_type: str, resource_type: str, data: dict):
+        """Publica evento no padrão definido"""
+        if self.producer is None:
+            logger.warning(f"Kafka não disponível. Evento {event_type} não publicado.")
             return False
+        
+        event = self._build_event(event_type, resource_type, data)
+        
+        with self._publish_span(event_type, 1), server_timing.phase("kafka", exclude=("serialize",)):
+            try:
+                future = self._send(event)
+                timeout = self._wait_timeout(event_type)
+                if timeout is None:
+                    return False
+                future.get(timeout=timeout)
+                logger.info(f"Evento publicado: {event_type} - {data.get('id', 'N/A')}")
+                return True
+            except (KafkaError, Exception) as e:
+                logger.error(f"Erro ao publicar evento no Kafka: {e}")
+                return False
+    
+    def _publish_events(self, event_type: str, resource_type: str, data_list: list) -> int:
+        """Publica vários eventos de uma vez: envia todos e aguarda um único flush
+
+        Retorna a quantidade de eventos confirmados pelo broker.
+        """
+        if not data_list:
+            return 0
+        if self.producer is None:
+            logger.warning(f"Kafka não disponível. {len(data_list)} eventos {event_type} não publicados.")
+            return 0
+        
+        futures = []
+        with self._publish_span(event_type, len(data_list)), server_timing.phase("kafka", exclude=("serialize",)):
+            try:
+                for data in data_list:
+                    futures.append(self._send(self._build_event(event_type, resource_type, data)))
+                timeout = self._wait_timeout(event_type)
+                if timeout is not None:
+                    self.producer.flush(timeout=timeout)
+            except (KafkaError, Exception) as e:
+                logger.error(f"Erro ao publicar lote de eventos no Kafka: {e}")
+        
+        published = sum(1 for future in futures if future.is_done and future.succeeded())
+        if published < len(data_list):
+            logger.error(f"Lote {event_type}: {len(data_list) - published} de {len(data_list)} eventos não publicados")
+        logger.info(f"Lote de eventos publicado: {event_type} - {published} eventos")
+        return published
     
     def publish_claim_submitted(self, claim_data: dict):
         """Publica evento ClaimSubmitted"""
@@ -86,6 +191,14 @@ class KafkaEventProducer:
             data=invoice_data
         )
     
+    def publish_invoices_settled(self, invoices_data: list) -> int:
+        """Publica eventos InvoiceSettled em lote"""
+        return self._publish_events(
+            event_type="InvoiceSettled",
+            resource_type="Invoice",
+            data_list=invoices_data
+        )
+    
     def close(self):
         if self._producer is not None:
             self._producer.close()
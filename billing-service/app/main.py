@@ -1,11 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from prometheus_client import make_asgi_app
-from app.routers import claims, invoices, eligibility
-from app.middleware.slos import router as slos_router
+from app.routers import claims, invoices, eligibility, patients, debug
+from app.middleware.slos import router as slos_router, SloMiddleware
 from app.middleware.observability import ObservabilityMiddleware, setup_structured_logging
 from app.middleware.tls import get_ssl_context
+from app.middleware.admission import AdmissionControlMiddleware
+from app.middleware.server_timing import ServerTimingMiddleware
+from app.deadline import DeadlineMiddleware
+from app.tracing import setup_tracing, shutdown_tracing
 from app.database import engine, Base
+from app.db_instrumentation import configure_threadpool
+from app.background import PeriodicJob, background_jobs
+from app.services.eligibility_partitions import EligibilityPartitionManager
+from app.services.adjudication_service import build_worker as build_adjudication_worker
+from app.services.claim_search import ClaimSearchService
+from app.sharding import shards, shard_engines
 from app.config import settings
 import logging
 
@@ -15,20 +26,71 @@ logger = logging.getLogger(__name__)
 
 # Criar tabelas (se MySQL estiver disponível)
 try:
-    Base.metadata.create_all(bind=engine)
+    for shard_engine in shard_engines():
+        Base.metadata.create_all(bind=shard_engine)
     logger.info("Tabelas criadas/verificadas com sucesso")
 except Exception as e:
     logger.warning(f"MySQL não disponível: {e}. Tabelas serão criadas quando o banco estiver disponível.")
 
+# Retenção/arquivamento das partições mensais de eligibility_checks
+if settings.ELIGIBILITY_RETENTION_ENABLED.lower() == "true":
+    partition_manager = EligibilityPartitionManager(
+        engine,
+        archive_dir=settings.ELIGIBILITY_ARCHIVE_DIR,
+        retention_months=settings.ELIGIBILITY_RETENTION_MONTHS,
+        partitions_ahead=settings.ELIGIBILITY_PARTITIONS_AHEAD
+    )
+    background_jobs.add(PeriodicJob(
+        "eligibility_retention",
+        partition_manager.run_retention,
+        interval_seconds=settings.ELIGIBILITY_RETENTION_INTERVAL_SECONDS,
+        initial_delay_seconds=60
+    ))
+
+# Adjudicação de claims pendentes
+if settings.ADJUDICATION_ENABLED.lower() == "true":
+    adjudication_worker = build_adjudication_worker()
+    background_jobs.add(PeriodicJob(
+        "claim_adjudication",
+        adjudication_worker.run_once,
+        interval_seconds=settings.ADJUDICATION_INTERVAL_SECONDS,
+        on_stop=adjudication_worker.close
+    ))
+
+# Catch-up do índice de busca de claims em memória
+if settings.SEARCH_BACKEND == "memory":
+    background_jobs.add(PeriodicJob(
+        "claim_search_index",
+        ClaimSearchService.refresh_index,
+        interval_seconds=settings.SEARCH_INDEX_REFRESH_SECONDS
+    ))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Threadpool limita quantos endpoints síncronos rodam em paralelo
+    configure_threadpool(settings.THREADPOOL_SIZE)
+    background_jobs.start_all()
+    yield
+    background_jobs.stop_all()
+    shards.close()
+    shutdown_tracing()
+
+
 app = FastAPI(
     title="Billing Service",
     description="Microsserviço de Faturamento & Convênios (Billing/Claims)",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Middleware de Observabilidade (deve ser adicionado primeiro)
 app.add_middleware(ObservabilityMiddleware)
 
+# Server-Timing por fase nas requisições amostradas / rotas configuradas
+if settings.SERVER_TIMING_ENABLED.lower() == "true":
+    app.add_middleware(ServerTimingMiddleware)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -38,11 +100,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Controle de admissão: descarta excesso antes de qualquer outro trabalho
+if settings.ADMISSION_CONTROL_ENABLED.lower() == "true":
+    app.add_middleware(AdmissionControlMiddleware)
+
+# Deadline da requisição: por fora da admissão, descarta requisições que já chegam vencidas
+app.add_middleware(DeadlineMiddleware)
+
+# SLIs de disponibilidade/latência: mais externo, vê os 503 da admissão e os 504 do deadline
+app.add_middleware(SloMiddleware)
+
+# Tracing (TRACING_ENABLED): spans de requisição, SQL, Redis e Kafka
+setup_tracing(app)
+
 # Routers
 app.include_router(claims.router)
 app.include_router(invoices.router)
 app.include_router(eligibility.router)
+app.include_router(patients.router)
 app.include_router(slos_router)
+app.include_router(debug.router)
 
 # Métricas Prometheus
 metrics_app = make_asgi_app()
@@ -0,0 +1,220 @@
+"""
+Diagnóstico de memória em produção (tracemalloc + GC + RSS)
+
+Fluxo típico para atribuir crescimento de RSS a um trecho de código, sem reiniciar:
+    POST /debug/memory/tracemalloc/start?frames=1   (liga e tira o snapshot base)
+    ... deixa o worker rodar sob carga ...
+    GET  /debug/memory/allocations?group_by=module&compare=baseline
+    POST /debug/memory/snapshot                     (novo ponto de comparação)
+    GET  /debug/memory/allocations?compare=last
+    POST /debug/memory/tracemalloc/stop
+
+O tracemalloc deixa as alocações mais lentas (~2x com frames=1): desliga sozinho após
+MEMORY_TRACEMALLOC_MAX_SECONDS. RSS e coletas do GC também estão em /metrics
+(process_resident_memory_bytes, python_gc_collections_total).
+"""
+import gc
+import os
+import time
+import logging
+import threading
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List, Optional
+from prometheus_client import REGISTRY, Gauge
+from app.profiling import module_for_file
+
+logger = logging.getLogger(__name__)
+
+gc_generation_count = Gauge(
+    'billing_gc_generation_count',
+    'Allocations minus deallocations since the last collection of each GC generation',
+    ['generation']
+)
+for _generation in range(3):
+    gc_generation_count.labels(generation=str(_generation)).set_function(
+        lambda generation=_generation: gc.get_count()[generation]
+    )
+
+tracemalloc_traced_bytes = Gauge(
+    'billing_tracemalloc_traced_bytes',
+    'Memory currently traced by tracemalloc (0 when tracing is off)'
+)
+tracemalloc_traced_bytes.set_function(
+    lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+)
+
+GROUP_BY = ("module", "filename", "lineno", "traceback")
+
+# Alocações do próprio diagnóstico e do import de módulos
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def rss_bytes() -> Optional[int]:
+    """RSS atual do processo (Linux: /proc/self/statm)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def metric_series(limit: int = 10) -> List[Dict]:
+    """Métricas Prometheus com mais séries (label sets), suspeitas de cardinalidade"""
+    series = []
+    for metric in REGISTRY.collect():
+        series.append({"metric": metric.name, "series": len(metric.samples)})
+    series.sort(key=lambda entry: entry["series"], reverse=True)
+    return series[:limit]
+
+
+class MemoryTracker:
+    """Controle do tracemalloc com snapshot base e último snapshot para comparação"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._last: Optional[tracemalloc.Snapshot] = None
+        self._started_at: Optional[float] = None
+        self._timer: Optional[threading.Timer] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1, max_seconds: float = 900) -> bool:
+        """Liga o tracemalloc e tira o snapshot base; False se já estava ligado"""
+        with self._lock:
+            if tracemalloc.is_tracing():
+                return False
+            tracemalloc.start(frames)
+            self._started_at = time.monotonic()
+            self._baseline = self._take()
+            self._last = None
+            self._timer = threading.Timer(max_seconds, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+        logger.warning(f"tracemalloc ligado (frames={frames}, desliga em {max_seconds}s)")
+        return True
+
+    def stop(self) -> bool:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not tracemalloc.is_tracing():
+                return False
+            tracemalloc.stop()
+            self._baseline = self._last = None
+            self._started_at = None
+        logger.warning("tracemalloc desligado")
+        return True
+
+    def _expire(self):
+        logger.warning("tracemalloc atingiu MEMORY_TRACEMALLOC_MAX_SECONDS")
+        self.stop()
+
+    def _take(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+    def snapshot(self) -> bool:
+        """Tira um snapshot que passa a ser o ponto de comparação `last`"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return False
+            self._last = self._take()
+            return True
+
+    def allocations(self, group_by: str = "module", compare: str = "baseline", limit: int = 20) -> Optional[Dict]:
+        """Top sites de alocação: atuais (compare=none) ou crescimento desde baseline/last"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return None
+            reference = {"baseline": self._baseline, "last": self._last, "none": None}[compare]
+            current = self._take()
+        if compare != "none" and reference is None:
+            reference = self._baseline
+
+        key_type = "filename" if group_by == "module" else group_by
+        if reference is not None:
+            stats = current.compare_to(reference, key_type)
+        else:
+            stats = current.statistics(key_type)
+
+        if group_by == "module":
+            entries = self._group_by_module(stats, compared=reference is not None)
+        else:
+            entries = [self._entry(stat, compared=reference is not None) for stat in stats]
+        if reference is not None:
+            entries.sort(key=lambda entry: entry["size_diff_bytes"], reverse=True)
+        else:
+            entries.sort(key=lambda entry: entry["size_bytes"], reverse=True)
+
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            "group_by": group_by,
+            "compare": compare if reference is not None else "none",
+            "traced_bytes": traced,
+            "peak_bytes": peak,
+            "allocations": entries[:limit],
+        }
+
+    @staticmethod
+    def _entry(stat, compared: bool) -> Dict:
+        frames = stat.traceback.format() if len(stat.traceback) > 1 else [str(stat.traceback[0])]
+        entry = {
+            "site": frames[0] if len(frames) == 1 else frames,
+            "size_bytes": stat.size,
+            "count": stat.count,
+        }
+        if compared:
+            entry["size_diff_bytes"] = stat.size_diff
+            entry["count_diff"] = stat.count_diff
+        return entry
+
+    @staticmethod
+    def _group_by_module(stats, compared: bool) -> List[Dict]:
+        modules: Dict[str, Dict] = defaultdict(lambda: {"size_bytes": 0, "count": 0, "size_diff_bytes": 0, "count_diff": 0})
+        for stat in stats:
+            entry = modules[module_for_file(stat.traceback[0].filename)]
+            entry["size_bytes"] += stat.size
+            entry["count"] += stat.count
+            if compared:
+                entry["size_diff_bytes"] += stat.size_diff
+                entry["count_diff"] += stat.count_diff
+        result = []
+        for module, entry in modules.items():
+            if not compared:
+                del entry["size_diff_bytes"], entry["count_diff"]
+            result.append({"site": module, **entry})
+        return result
+
+    def status(self) -> Dict:
+        traced, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "rss_bytes": rss_bytes(),
+            "gc": {
+                "counts": list(gc.get_count()),
+                "thresholds": list(gc.get_threshold()),
+                "collections": [stat["collections"] for stat in gc.get_stats()],
+                "uncollectable": [stat["uncollectable"] for stat in gc.get_stats()],
+            },
+            "tracemalloc": {
+                "tracing": tracemalloc.is_tracing(),
+                "frames": tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else None,
+                "running_seconds": round(time.monotonic() - self._started_at, 1) if self._started_at else None,
+                "traced_bytes": traced,
+                "peak_bytes": peak,
+                "has_last_snapshot": self._last is not None,
+            },
+            "metric_series": metric_series(),
+        }
+
+
+# Instância global
+memory_tracker = MemoryTracker()
@@ -0,0 +1,212 @@
+"""
+Controle de admissão (load shedding) na borda da API
+
+Limite de concorrência adaptativo (AIMD) guiado pela latência observada:
+- cada rota tem uma latência de referência (mínimo observado, com deriva lenta para cima);
+- resposta acima de ADMISSION_LATENCY_TOLERANCE x referência, ou 503/504 da aplicação
+  (pool do banco esgotado, MySQL fora), reduz o limite multiplicativamente (no máximo
+  uma vez por janela de cooldown);
+- respostas saudáveis com o limite em uso aumentam o limite em ~1 por "janela" de limite.
+
+Cada classe de prioridade só é admitida até uma fração do limite, de modo que sob
+sobrecarga as requisições de baixa prioridade (histórico, exportações, buscas) são
+descartadas primeiro e elegibilidade/liquidação ficam com a folga:
+    critical  100% do limite  (POST /eligibility/check, liquidação de invoices)
+    normal     85%            (demais rotas)
+    low        50%            (histórico, listagens, busca, exportações)
+
+Acima da fração, a requisição recebe 503 imediato com Retry-After (sem fila). Health
+checks e /metrics não passam pelo controle.
+"""
+import re
+import json
+import time
+import logging
+from typing import List, Optional, Pattern, Tuple
+from prometheus_client import Counter, Gauge
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+admission_limit = Gauge(
+    'billing_admission_limit',
+    'Current adaptive concurrency limit'
+)
+
+admission_in_flight = Gauge(
+    'billing_admission_in_flight',
+    'Requests admitted and still in progress',
+    ['priority']
+)
+
+admission_rejected_total = Counter(
+    'billing_admission_rejected_total',
+    'Requests shed with 503 by admission control',
+    ['priority']
+)
+
+admission_limit_decreases_total = Counter(
+    'billing_admission_limit_decreases_total',
+    'Multiplicative decreases of the concurrency limit',
+    ['reason']
+)
+
+PRIORITY_SHARE = {"critical": 1.0, "normal": 0.85, "low": 0.5}
+
+# (método ou None para qualquer, regex do path, prioridade); a primeira regra que casa vale
+DEFAULT_ROUTE_PRIORITIES: List[Tuple[Optional[str], str, str]] = [
+    ("POST", r"^/eligibility/check$", "critical"),
+    ("POST", r"^/invoices/settle-batch$", "critical"),
+    ("POST", r"^/invoices/[^/]+/settle$", "critical"),
+    ("GET", r"^/eligibility/history$", "low"),
+    ("GET", r"^/claims/search$", "low"),
+    ("GET", r"^/(claims|invoices)/?$", "low"),
+    (None, r"^/exports?(/|$)", "low"),
+]
+
+EXEMPT_PATHS = re.compile(r"^/(health|metrics)(/|$)|^/$")
+
+
+class AIMDLimiter:
+    """Limite de concorrência AIMD por latência relativa à referência de cada rota"""
+
+    def __init__(self, initial_limit: float = 40, min_limit: float = 4, max_limit: float = 400,
+                 backoff: float = 0.9, tolerance: float = 2.0, cooldown_seconds: float = 0.5,
+                 warmup_samples: int = 20):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.cooldown_seconds = cooldown_seconds
+        self.warmup_samples = warmup_samples
+        self.in_flight = 0
+        self._baseline: dict = {}
+        self._samples: dict = {}
+        self._last_decrease = 0.0
+        admission_limit.set(self.limit)
+
+    def try_acquire(self, priority: str) -> bool:
+        if self.in_flight >= max(1.0, self.limit * PRIORITY_SHARE.get(priority, PRIORITY_SHARE["normal"])):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, route: str, latency: float, overloaded: bool = False):
+        in_flight = self.in_flight
+        self.in_flight -= 1
+
+        baseline = self._baseline.get(route)
+        samples = self._samples.get(route, 0) + 1
+        self._samples[route] = samples
+        if baseline is None or latency < baseline:
+            self._baseline[route] = latency
+        else:
+            # Deriva para cima: rápida com latência dentro da tolerância, lenta acima dela, de
+            # modo que fila não vira referência mas mudanças permanentes (mais dados, outro
+            # plano de execução) são absorvidas em alguns milhares de requisições
+            drift = 0.01 if latency <= baseline * self.tolerance else 0.0005
+            self._baseline[route] = baseline + (latency - baseline) * drift
+
+        if overloaded:
+            self._decrease("overloaded")
+        elif in_flight * 2 < self.limit:
+            # Limite ocioso: latência alta aqui é da própria requisição, não de fila
+            return
+        elif baseline is not None and samples > self.warmup_samples and latency > baseline * self.tolerance:
+            self._decrease("latency")
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            admission_limit.set(self.limit)
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown_seconds:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        admission_limit.set(self.limit)
+        admission_limit_decreases_total.labels(reason=reason).inc()
+
+
+class AdmissionControlMiddleware:
+    """Middleware ASGI puro: admite ou descarta a requisição antes de qualquer outro trabalho
+
+    Roda no event loop (estado do limiter sem locks); deve ficar por fora dos demais
+    middlewares (só o DeadlineMiddleware vem antes).
+    """
+
+    def __init__(self, app, limiter: Optional[AIMDLimiter] = None,
+                 route_priorities: Optional[List[Tuple[Optional[str], str, str]]] = None,
+                 retry_after_seconds: Optional[int] = None):
+        self.app = app
+        self.limiter = limiter or AIMDLimiter(
+            initial_limit=settings.ADMISSION_INITIAL_LIMIT,
+            min_limit=settings.ADMISSION_MIN_LIMIT,
+            max_limit=settings.ADMISSION_MAX_LIMIT,
+            tolerance=settings.ADMISSION_LATENCY_TOLERANCE,
+        )
+        self.retry_after_seconds = retry_after_seconds or settings.ADMISSION_RETRY_AFTER_SECONDS
+        self.route_priorities: List[Tuple[Optional[str], Pattern, str]] = [
+            (method, re.compile(pattern), priority)
+            for method, pattern, priority in (route_priorities or DEFAULT_ROUTE_PRIORITIES)
+        ]
+
+    def priority_for(self, method: str, path: str) -> str:
+        for rule_method, pattern, priority in self.route_priorities:
+            if (rule_method is None or rule_method == method) and pattern.match(path):
+                return priority
+        return "normal"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or EXEMPT_PATHS.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        priority = self.priority_for(method, path)
+        if not self.limiter.try_acquire(priority):
+            admission_rejected_total.labels(priority=priority).inc()
+            await self._reject(send, priority)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        admission_in_flight.labels(priority=priority).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            admission_in_flight.labels(priority=priority).dec()
+            # Rota para a referência de latência: método + template da rota casada (como no
+            # SloMiddleware), nunca o path cru, para o número de referências ser limitado
+            route = f"{method} {getattr(scope.get('route'), 'path', 'unmatched')}"
+            # 504 por deadline informado pelo cliente não indica sobrecarga (a latência já conta)
+            overloaded = status["code"] == 503 or (
+                status["code"] == 504 and scope.get("state", {}).get("deadline") is None
+            )
+            self.limiter.release(route, time.perf_counter() - start, overloaded=overloaded)
+
+    async def _reject(self, send, priority: str):
+        body = json.dumps({
+            "detail": {
+                "error": "Service overloaded",
+                "message": "Serviço sobrecarregado. Tente novamente em instantes.",
+                "priority": priority
+            }
+        }).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.retry_after_seconds).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
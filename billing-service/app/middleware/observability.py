@@ -1,11 +1,13 @@
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response as StarletteResponse
+from starlette.routing import Match
 import time
 import logging
 import json
 from prometheus_client import Counter, Histogram, Gauge
 from typing import Callable
+from opentelemetry import trace
 
 logger = logging.getLogger(__name__)
 
@@ -39,21 +41,70 @@ invoices_settled_total = Counter(
     'Total invoices settled'
 )
 
+remittance_lines_total = Counter(
+    'billing_remittance_lines_total',
+    'Insurer remittance lines by import result (settled or reject reason)',
+    ['result']
+)
+
 eligibility_checks_total = Counter(
     'billing_eligibility_checks_total',
     'Total eligibility checks',
     ['result']
 )
 
+# Métricas do tracing (app.tracing)
+tracing_traces_total = Counter(
+    'billing_tracing_traces_total',
+    'Local root spans by sampling decision (head, error, slow, dropped, evicted)',
+    ['decision']
+)
+
+tracing_spans_dropped_total = Counter(
+    'billing_tracing_spans_dropped_total',
+    'Sampled spans dropped because the export queue was full or the exporter failed'
+)
+
+
+def _match_route(routes, scope):
+    """(Match, template) da primeira rota que atende o scope, descendo em routers incluídos"""
+    partial = (Match.NONE, None)
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.NONE:
+            continue
+        # include_router do FastAPI embrulha o APIRouter; as rotas dele têm o path completo
+        included = getattr(route, "original_router", None)
+        if included is not None:
+            match, path = _match_route(included.routes, scope)
+        else:
+            path = getattr(route, "path", None)
+        if match == Match.FULL:
+            return match, path
+        if match == Match.PARTIAL and partial[0] == Match.NONE:
+            partial = (match, path)
+    return partial
+
+
+def route_template(request: Request) -> str:
+    """Template da rota (ex.: /claims/{claim_id}) para label de métrica
+
+    O path bruto como label cria uma série por ID e faz a memória do worker crescer sem limite.
+    """
+    _, path = _match_route(request.app.router.routes, request.scope)
+    return path or "unmatched"
+
 
 class ObservabilityMiddleware(BaseHTTPMiddleware):
     """Middleware para observabilidade: logging estruturado, métricas e tracing"""
     
     async def dispatch(self, request: Request, call_next: Callable) -> StarletteResponse:
+        endpoint = route_template(request)
+        
         # Iniciar métrica de requests em progresso
         http_requests_in_progress.labels(
             method=request.method,
-            endpoint=request.url.path
+            endpoint=endpoint
         ).inc()
         
         start_time = time.time()
@@ -67,6 +118,10 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
             "client_ip": request.client.host if request.client else None,
             "user_agent": request.headers.get("user-agent"),
         }
+        span_context = trace.get_current_span().get_span_context()
+        trace_id = format(span_context.trace_id, "032x") if span_context.is_valid else None
+        if trace_id:
+            log_data["trace_id"] = trace_id
         logger.info(f"Request iniciada: {json.dumps(log_data)}")
         
         try:
@@ -79,13 +134,13 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
             status_code = response.status_code
             http_requests_total.labels(
                 method=request.method,
-                endpoint=request.url.path,
+                endpoint=endpoint,
                 status_code=status_code
             ).inc()
             
             http_request_duration_seconds.labels(
                 method=request.method,
-                endpoint=request.url.path
+                endpoint=endpoint
             ).observe(duration)
             
             # Logging estruturado da resposta
@@ -99,6 +154,8 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
             # Adicionar headers de tracing
             response.headers["X-Request-Duration"] = str(duration)
             response.headers["X-Request-Id"] = request.headers.get("X-Request-Id", "unknown")
+            if trace_id:
+                response.headers["X-Trace-Id"] = trace_id
             
             return response
             
@@ -108,7 +165,7 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
             # Métricas de erro
             http_requests_total.labels(
                 method=request.method,
-                endpoint=request.url.path,
+                endpoint=endpoint,
                 status_code=500
             ).inc()
             
@@ -126,7 +183,7 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
             # Decrementar métrica de requests em progresso
             http_requests_in_progress.labels(
                 method=request.method,
-                endpoint=request.url.path
+                endpoint=endpoint
             ).dec()
 
 
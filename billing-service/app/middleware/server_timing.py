@@ -0,0 +1,198 @@
+"""
+Header Server-Timing com o tempo por fase da requisição
+
+Em requisições amostradas (SERVER_TIMING_SAMPLE_RATIO) ou de rotas configuradas
+(SERVER_TIMING_ROUTES), acumula o tempo gasto em cada fase e responde com:
+
+    Server-Timing: db;dur=4.10;desc="7 statements", commit;dur=1.20, redis;dur=0.31,
+                   kafka;dur=2.05, serialize;dur=0.40, app;dur=1.90, total;dur=9.96
+
+    db         statements SQL (inclusive flush, refresh e re-consultas)
+    commit     COMMIT (sem os statements do flush, já contados em db)
+    redis      comandos Redis (envio + resposta)
+    kafka      publicação de eventos e espera pela confirmação do broker
+    serialize  serialização dos eventos e da resposta (retorno do handler até o início da resposta)
+    app        restante (validação, regras de negócio, middlewares)
+
+As mesmas fases alimentam o histograma billing_request_phase_seconds{route, phase}.
+Fora das requisições medidas, os pontos de medição custam uma leitura de contextvar.
+"""
+import re
+import time
+import random
+import functools
+import inspect
+import threading
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Pattern, Tuple
+from fastapi.routing import APIRoute
+from prometheus_client import Histogram
+from app.config import settings
+
+request_phase_seconds = Histogram(
+    'billing_request_phase_seconds',
+    'Time per request phase (db, commit, redis, kafka, serialize, app) for timed requests',
+    ['route', 'phase'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+PHASES = ("db", "commit", "redis", "kafka", "serialize")
+
+
+class RequestTimings:
+    """Acumulador de tempo por fase de uma requisição (compartilhado com o threadpool e o scatter)"""
+
+    __slots__ = ("start", "totals", "counts", "handler_end", "_lock")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.totals: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.handler_end: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.totals[phase] = self.totals.get(phase, 0.0) + seconds
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def total(self, phases) -> float:
+        with self._lock:
+            return sum(self.totals.get(phase, 0.0) for phase in phases)
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def record(phase: str, seconds: float):
+    """Soma `seconds` à fase da requisição corrente (no-op fora de requisições medidas)"""
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+class PhaseTimer:
+    """Context manager que mede uma fase; `exclude` desconta fases aninhadas já medidas"""
+
+    __slots__ = ("name", "exclude", "_timings", "_start", "_excluded")
+
+    def __init__(self, name: str, exclude: Tuple[str, ...] = ()):
+        self.name = name
+        self.exclude = exclude
+
+    def __enter__(self):
+        self._timings = _timings.get()
+        if self._timings is not None:
+            self._excluded = self._timings.total(self.exclude) if self.exclude else 0.0
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        timings = self._timings
+        if timings is not None:
+            elapsed = time.perf_counter() - self._start
+            if self.exclude:
+                elapsed -= timings.total(self.exclude) - self._excluded
+            timings.add(self.name, max(0.0, elapsed))
+        return False
+
+
+def phase(name: str, exclude: Tuple[str, ...] = ()) -> PhaseTimer:
+    """Mede o bloco como a fase `name`
+
+    Ex.: o commit exclui "db" (statements do flush); o Kafka exclui "serialize".
+    """
+    return PhaseTimer(name, exclude)
+
+
+def _mark_handler_end():
+    timings = _timings.get()
+    if timings is not None:
+        timings.handler_end = time.perf_counter()
+
+
+class TimedRoute(APIRoute):
+    """APIRoute que marca o fim do handler (início da serialização da resposta)"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kw):
+                try:
+                    return await endpoint(*args, **kw)
+                finally:
+                    _mark_handler_end()
+        else:
+            @functools.wraps(endpoint)
+            def timed_endpoint(*args, **kw):
+                try:
+                    return endpoint(*args, **kw)
+                finally:
+                    _mark_handler_end()
+        super().__init__(path, timed_endpoint, **kwargs)
+
+
+def parse_route_rules(value: str) -> List[Tuple[Optional[str], Pattern]]:
+    """"POST ^/claims/?$, ^/invoices/" -> [(método ou None, regex do path)]"""
+    rules = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        method, _, pattern = entry.partition(" ") if " " in entry else (None, "", entry)
+        rules.append((method.upper() if method else None, re.compile(pattern.strip())))
+    return rules
+
+
+class ServerTimingMiddleware:
+    """Middleware ASGI: mede as requisições selecionadas e emite o header Server-Timing"""
+
+    def __init__(self, app, sample_ratio: Optional[float] = None, routes: Optional[str] = None):
+        self.app = app
+        self.sample_ratio = settings.SERVER_TIMING_SAMPLE_RATIO if sample_ratio is None else sample_ratio
+        self.route_rules = parse_route_rules(settings.SERVER_TIMING_ROUTES if routes is None else routes)
+
+    def selected(self, method: str, path: str) -> bool:
+        for rule_method, pattern in self.route_rules:
+            if (rule_method is None or rule_method == method) and pattern.search(path):
+                return True
+        return self.sample_ratio > 0 and random.random() < self.sample_ratio
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.selected(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                header = self._finish(scope, timings)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+
+    def _finish(self, scope, timings: RequestTimings) -> str:
+        now = time.perf_counter()
+        if timings.handler_end is not None:
+            timings.add("serialize", now - timings.handler_end)
+        total = now - timings.start
+        measured = {name: timings.totals[name] for name in PHASES if name in timings.totals}
+        measured["app"] = max(0.0, total - sum(measured.values()))
+
+        route = scope.get("route")
+        route_label = f"{scope['method']} {getattr(route, 'path', 'unmatched')}"
+        entries = []
+        for name, seconds in measured.items():
+            request_phase_seconds.labels(route=route_label, phase=name).observe(seconds)
+            entry = f"{name};dur={seconds * 1000:.2f}"
+            if name == "db":
+                entry += f';desc="{timings.counts["db"]} statements"'
+            entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
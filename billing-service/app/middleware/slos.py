@@ -1,16 +1,29 @@
 """
 SLOs (Service Level Objectives) e Health Checks Avançados
+
+SLIs medidos no próprio processo (por worker) pelo SloMiddleware:
+- disponibilidade: respostas não-5xx / total (alvo SLO_AVAILABILITY_TARGET, 99.9%);
+- latência: respostas abaixo do limite da rota / total (alvo SLO_LATENCY_TARGET; limite
+  SLO_LATENCY_THRESHOLD_MS, ou por rota em SLO_LATENCY_ROUTES).
+
+Os contadores ficam num anel de 360 slots de 1 minuto (6h, memória fixa) e os histogramas de
+latência (log-linear, estilo HDR, mescláveis) num anel de 60 slots (1h). Burn rate =
+taxa de erro na janela / (1 - alvo), nas janelas de 5m, 1h e 6h; 1.0 consome exatamente o
+orçamento de erro no ritmo do período do SLO. /health, /metrics e /debug ficam de fora.
 """
 from fastapi import APIRouter, Depends, status
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import time
 import json
+import threading
+from app.config import settings
 from app.database import get_db, engine
 from app.redis_client import get_redis
 from app.kafka_producer import kafka_producer
-from prometheus_client import Gauge
+from prometheus_client import Gauge, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
 import logging
 
 logger = logging.getLogger(__name__)
@@ -39,6 +52,283 @@ kafka_connection_status = Gauge(
 )
 
 
+# SLIs e burn rate -------------------------------------------------------------
+
+# Janelas de burn rate (minutos) e limites de alerta multi-janela (SRE workbook):
+# page quando 1h e 5m queimam > 14.4x (2% do orçamento de 30 dias em 1h); ticket quando 6h e 1h > 6x
+WINDOWS = {"5m": 5, "1h": 60, "6h": 360}
+PAGE_BURN_RATE = 14.4
+TICKET_BURN_RATE = 6.0
+SLO_EXCLUDED_PREFIXES = ("/health", "/metrics", "/debug")
+
+
+class LatencyHistogram:
+    """Histograma log-linear de latências (µs), estilo HDR: erro relativo <= 1/32 por bucket
+
+    Os buckets são fixos, então dois histogramas se somam bucket a bucket (merge) sem perda.
+    """
+
+    SUB_BITS = 6
+    HALF = 1 << (SUB_BITS - 1)
+    MAX_MICROS = (1 << 27) - 1  # ~134s; acima disso entra no último bucket
+
+    __slots__ = ("counts", "count")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+
+    @classmethod
+    def bucket(cls, micros: int) -> int:
+        micros = min(max(micros, 0), cls.MAX_MICROS)
+        shift = max(0, micros.bit_length() - cls.SUB_BITS)
+        return (shift << (cls.SUB_BITS - 1)) + (micros >> shift)
+
+    @classmethod
+    def bucket_upper(cls, index: int) -> int:
+        """Maior valor (µs) que cai no bucket"""
+        if index < (1 << cls.SUB_BITS):
+            return index
+        shift = (index >> (cls.SUB_BITS - 1)) - 1
+        mantissa = index - (shift << (cls.SUB_BITS - 1))
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        index = self.bucket(int(seconds * 1_000_000))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        return self
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Latência (segundos) do percentil q (0-100), pelo limite superior do bucket"""
+        if not self.count:
+            return None
+        rank = max(1, int(round(q / 100 * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.bucket_upper(index) / 1_000_000
+        return self.bucket_upper(max(self.counts)) / 1_000_000
+
+
+class _Slot:
+    """Um minuto: contadores [total, erros, lentas] por rota (+ histogramas, no anel de latência)"""
+
+    __slots__ = ("minute", "routes")
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.routes: Dict[str, Any] = {}
+
+
+def parse_latency_thresholds(value: str) -> Dict[str, float]:
+    """"POST /claims/=500, GET /claims/{claim_id}=200" -> {"POST /claims/": 0.5, ...} (segundos)"""
+    thresholds = {}
+    for entry in value.split(","):
+        route, _, millis = entry.strip().rpartition("=")
+        if route:
+            thresholds[route.strip()] = float(millis) / 1000
+    return thresholds
+
+
+class SloTracker:
+    """Anéis por minuto com memória fixa: 360 slots de contadores e 60 de histogramas"""
+
+    def __init__(self, availability_target: float = 0.999, latency_target: float = 0.99,
+                 latency_threshold_seconds: float = 0.3, route_thresholds: Optional[Dict[str, float]] = None,
+                 clock=time.monotonic):
+        self.availability_target = availability_target
+        self.latency_target = latency_target
+        self.latency_threshold_seconds = latency_threshold_seconds
+        self.route_thresholds = dict(route_thresholds or {})
+        self.clock = clock
+        self._counters: List[Optional[_Slot]] = [None] * max(WINDOWS.values())
+        self._histograms: List[Optional[_Slot]] = [None] * WINDOWS["1h"]
+        self._lock = threading.Lock()
+
+    def threshold(self, route: str) -> float:
+        return self.route_thresholds.get(route, self.latency_threshold_seconds)
+
+    @staticmethod
+    def _slot(ring: List[Optional[_Slot]], minute: int) -> _Slot:
+        slot = ring[minute % len(ring)]
+        if slot is None or slot.minute != minute:
+            slot = ring[minute % len(ring)] = _Slot(minute)
+        return slot
+
+    def record(self, route: str, status_code: int, seconds: float):
+        minute = int(self.clock() // 60)
+        slow = seconds > self.threshold(route)
+        with self._lock:
+            routes = self._slot(self._counters, minute).routes
+            counters = routes.get(route)
+            if counters is None:
+                counters = routes[route] = [0, 0, 0]
+            counters[0] += 1
+            counters[1] += status_code >= 500
+            counters[2] += slow
+            histograms = self._slot(self._histograms, minute).routes
+            histogram = histograms.get(route)
+            if histogram is None:
+                histogram = histograms[route] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def _recent(self, ring: List[Optional[_Slot]], minutes: int) -> List[_Slot]:
+        now = int(self.clock() // 60)
+        return [slot for slot in ring if slot is not None and now - slot.minute < minutes]
+
+    def totals(self, minutes: int) -> Dict[str, List[int]]:
+        """[total, erros, lentas] por rota na janela"""
+        routes: Dict[str, List[int]] = {}
+        with self._lock:
+            for slot in self._recent(self._counters, minutes):
+                for route, counters in slot.routes.items():
+                    total = routes.setdefault(route, [0, 0, 0])
+                    for i in range(3):
+                        total[i] += counters[i]
+        return routes
+
+    def histograms(self, minutes: int) -> Dict[str, LatencyHistogram]:
+        merged: Dict[str, LatencyHistogram] = {}
+        with self._lock:
+            for slot in self._recent(self._histograms, min(minutes, len(self._histograms))):
+                for route, histogram in slot.routes.items():
+                    merged.setdefault(route, LatencyHistogram()).merge(histogram)
+        return merged
+
+    def burn_rates(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """{slo: {janela: {total, bad, sli, burn_rate}}} para availability e latency"""
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {"availability": {}, "latency": {}}
+        for window, minutes in WINDOWS.items():
+            routes = self.totals(minutes)
+            total = sum(counters[0] for counters in routes.values())
+            for slo, bad_index, target in (("availability", 1, self.availability_target),
+                                           ("latency", 2, self.latency_target)):
+                bad = sum(counters[bad_index] for counters in routes.values())
+                error_rate = bad / total if total else 0.0
+                result[slo][window] = {
+                    "total": total,
+                    "bad": bad,
+                    "sli": round(1 - error_rate, 6) if total else None,
+                    "burn_rate": round(error_rate / (1 - target), 3),
+                }
+        return result
+
+    def report(self) -> Dict[str, Any]:
+        burn = self.burn_rates()
+        slos = {}
+        for slo, target in (("availability", self.availability_target), ("latency", self.latency_target)):
+            windows = burn[slo]
+            slos[slo] = {
+                "target": target,
+                "windows": windows,
+                # Fração do orçamento de erro da janela de 6h já consumida
+                "error_budget_consumed_6h": windows["6h"]["burn_rate"],
+                "alerts": {
+                    "page": windows["1h"]["burn_rate"] > PAGE_BURN_RATE and windows["5m"]["burn_rate"] > PAGE_BURN_RATE,
+                    "ticket": windows["6h"]["burn_rate"] > TICKET_BURN_RATE and windows["1h"]["burn_rate"] > TICKET_BURN_RATE,
+                },
+            }
+        routes = {}
+        histograms = self.histograms(WINDOWS["1h"])
+        for route, (total, errors, slow) in sorted(self.totals(WINDOWS["1h"]).items()):
+            histogram = histograms.get(route, LatencyHistogram())
+            routes[route] = {
+                "requests_1h": total,
+                "errors_1h": errors,
+                "slow_1h": slow,
+                "threshold_ms": self.threshold(route) * 1000,
+                "p50_ms": _millis(histogram.percentile(50)),
+                "p95_ms": _millis(histogram.percentile(95)),
+                "p99_ms": _millis(histogram.percentile(99)),
+            }
+        return {"slos": slos, "routes": routes}
+
+
+def _millis(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+slo_tracker = SloTracker(
+    availability_target=settings.SLO_AVAILABILITY_TARGET,
+    latency_target=settings.SLO_LATENCY_TARGET,
+    latency_threshold_seconds=settings.SLO_LATENCY_THRESHOLD_MS / 1000,
+    route_thresholds=parse_latency_thresholds(settings.SLO_LATENCY_ROUTES),
+)
+
+
+class SloCollector:
+    """Gauges de burn rate e SLI calculados na hora do scrape (por worker)"""
+
+    def __init__(self, tracker: SloTracker):
+        self.tracker = tracker
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        burn_rate = GaugeMetricFamily(
+            'billing_slo_burn_rate', 'Error budget burn rate per SLO and window (1 = on budget)',
+            labels=['slo', 'window']
+        )
+        sli = GaugeMetricFamily(
+            'billing_slo_sli', 'Good events ratio per SLO and window', labels=['slo', 'window']
+        )
+        budget_consumed = GaugeMetricFamily(
+            'billing_slo_error_budget_consumed', 'Fraction of the 6h window error budget already consumed',
+            labels=['slo']
+        )
+        for slo, windows in self.tracker.burn_rates().items():
+            for window, values in windows.items():
+                burn_rate.add_metric([slo, window], values["burn_rate"])
+                if values["sli"] is not None:
+                    sli.add_metric([slo, window], values["sli"])
+            budget_consumed.add_metric([slo], windows["6h"]["burn_rate"])
+        yield burn_rate
+        yield sli
+        yield budget_consumed
+
+
+REGISTRY.register(SloCollector(slo_tracker))
+
+
+class SloMiddleware:
+    """Middleware ASGI: registra status e latência de cada requisição no SloTracker
+
+    Fica por fora da admissão e do deadline, então 503 de descarte e 504 de prazo contam como erro.
+    """
+
+    def __init__(self, app, tracker: Optional[SloTracker] = None):
+        self.app = app
+        self.tracker = tracker or slo_tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(SLO_EXCLUDED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.tracker.record(f"{scope['method']} {route}", status_code, time.perf_counter() - start)
+
+
 def check_database() -> Dict[str, Any]:
     """Verifica conexão com banco de dados"""
     try:
@@ -123,6 +413,15 @@ def readiness_check():
     return response_data
 
 
+@router.get("/slo")
+def slo_status():
+    """
+    SLIs de disponibilidade e latência, burn rate (5m/1h/6h) e latência por rota na última hora
+    Valores deste worker; o agregado da frota vem das métricas http_requests_* no Prometheus.
+    """
+    return slo_tracker.report()
+
+
 @router.get("/live")
 def liveness_check():
     """
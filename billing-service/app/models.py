@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Numeric, DateTime, Integer, Text, Enum as SQLEnum
+from sqlalchemy import Column, String, Numeric, DateTime, Integer, Text, Index, Enum as SQLEnum
 from sqlalchemy.sql import func
 from datetime import datetime
 import enum
@@ -20,8 +20,12 @@ class InvoiceStatus(str, enum.Enum):
 
 class ClaimItem(Base):
     __tablename__ = "claim_items"
+    # Busca textual (SEARCH_BACKEND=mysql, migração 0006); só existe no MySQL
+    __table_args__ = (
+        Index("ix_claim_items_fulltext", "description", "code", mysql_prefix="FULLTEXT").ddl_if(dialect="mysql"),
+    )
     
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     claim_id = Column(String(50), nullable=False, index=True)
     description = Column(String(255), nullable=False)
     code = Column(String(50), nullable=True)  # Código TUSS
@@ -32,27 +36,42 @@ class ClaimItem(Base):
 
 class Claim(Base):
     __tablename__ = "claims"
+    # Padrões de acesso: listagem por paciente (+ status) e fila por status
+    __table_args__ = (
+        Index("ix_claims_patient_id_status", "patient_id", "status"),
+        Index("ix_claims_status", "status"),
+    )
     
-    id = Column(String(50), primary_key=True, index=True)
-    patient_id = Column(String(50), nullable=False, index=True)
+    id = Column(String(50), primary_key=True)
+    patient_id = Column(String(50), nullable=False)
     insurance_id = Column(String(100), nullable=True, index=True)
     amount = Column(Numeric(10, 2), nullable=False)
     currency = Column(String(3), nullable=False, default="BRL")
     status = Column(SQLEnum(ClaimStatus), nullable=False, default=ClaimStatus.PENDING)
+    # Controle de concorrência otimista: todo UPDATE incrementa a versão
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    __table_args__ = (
+        Index("ix_invoices_patient_id_status", "patient_id", "status"),
+    )
     
-    id = Column(String(50), primary_key=True, index=True)
+    id = Column(String(50), primary_key=True)
     claim_id = Column(String(50), nullable=True, index=True)
-    patient_id = Column(String(50), nullable=False, index=True)
+    patient_id = Column(String(50), nullable=False)
     amount = Column(Numeric(10, 2), nullable=False)
     currency = Column(String(3), nullable=False, default="BRL")
     status = Column(SQLEnum(InvoiceStatus), nullable=False, default=InvoiceStatus.PENDING)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     settled_at = Column(DateTime, nullable=True)
+    # Remessa de pagamento do convênio (migração 0007): valor pago e glosa (negado) na liquidação
+    paid_amount = Column(Numeric(10, 2), nullable=True)
+    glosa_amount = Column(Numeric(10, 2), nullable=True)
+    glosa_code = Column(String(10), nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
@@ -60,16 +79,33 @@ class Invoice(Base):
 class EligibilityCheck(Base):
     __tablename__ = "eligibility_checks"
     
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    patient_id = Column(String(50), nullable=False, index=True)
-    insurance_id = Column(String(100), nullable=False, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    patient_id = Column(String(50), nullable=False)
+    insurance_id = Column(String(100), nullable=False)
     is_eligible = Column(Integer, nullable=False, default=0)  # 0 = false, 1 = true
     message = Column(Text, nullable=True)
-    checked_at = Column(DateTime, server_default=func.now())
-
-
-
-
-
-
-
+    # Coluna de particionamento (RANGE mensal no MySQL, ver migração 0003)
+    checked_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    # get_eligibility_history filtra por paciente/convênio e ordena por checked_at DESC
+    __table_args__ = (
+        Index(
+            "ix_eligibility_checks_patient_insurance_checked",
+            "patient_id", "insurance_id", checked_at.desc()
+        ),
+        Index("ix_eligibility_checks_insurance_checked", "insurance_id", checked_at.desc()),
+        Index("ix_eligibility_checks_checked_at", "checked_at"),
+    )
+
+
+class PatientBillingSummary(Base):
+    """Read model por paciente, mantido na mesma transação das escritas em claims/invoices"""
+    __tablename__ = "patient_billing_summary"
+    
+    patient_id = Column(String(50), primary_key=True)
+    outstanding_balance = Column(Numeric(14, 2), nullable=False, default=0, server_default="0")
+    pending_invoices = Column(Integer, nullable=False, default=0, server_default="0")
+    open_claims = Column(Integer, nullable=False, default=0, server_default="0")  # pending + processing
+    total_claims = Column(Integer, nullable=False, default=0, server_default="0")
+    last_settlement_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,187 @@
+"""
+Profiler de CPU por amostragem (todas as threads), para uso em produção
+
+A thread da requisição amostra `sys._current_frames()` a cada intervalo e conta as
+pilhas (raiz -> folha, uma "frame" por função). Threads ociosas (esperando em locks, filas, sockets ou
+no select do event loop) ficam de fora por padrão, então o resultado mostra onde a CPU
+realmente vai: validação pydantic, montagem de dicts, logging JSON, SQLAlchemy...
+
+Segurança em réplica com carga:
+- um profile por vez (lock; concorrente recebe 409);
+- duração limitada a PROFILE_MAX_SECONDS;
+- o intervalo se ajusta para que o custo da amostragem fique abaixo de
+  PROFILE_MAX_OVERHEAD (fração de um core; o GIL fica com o sampler durante a coleta).
+
+Saídas: collapsed (`thread;f1;f2 N`, para flamegraph.pl / speedscope) e speedscope (JSON).
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Funções-folha que indicam thread bloqueada/ociosa (módulo, função)
+IDLE_FRAMES = {
+    ("threading", "wait"),
+    ("threading", "_wait_for_tstate_lock"),
+    ("threading", "join"),
+    ("queue", "get"),
+    ("selectors", "select"),
+    ("socket", "accept"),
+    ("socket", "recv_into"),
+    ("socket", "readinto"),
+    ("ssl", "read"),
+    ("concurrent.futures.thread", "_worker"),
+    ("asyncio.base_events", "_run_once"),
+}
+IDLE_FUNCTIONS = {"sleep", "wait", "select", "poll", "epoll", "accept", "recv", "recv_into", "acquire"}
+
+MAX_STACK_DEPTH = 128
+
+
+def module_of(code) -> str:
+    """Nome do módulo (pacote.modulo) de um code object, pelo caminho relativo ao sys.path"""
+    return module_for_file(code.co_filename)
+
+
+@lru_cache(maxsize=4096)
+def module_for_file(filename: str) -> str:
+    for path in sorted(sys.path, key=len, reverse=True):
+        if path and filename.startswith(path + os.sep):
+            relative = filename[len(path) + 1:]
+            return relative[:-3].replace(os.sep, ".") if relative.endswith(".py") else relative
+    return os.path.basename(filename)
+
+
+class SamplingProfiler:
+    """Amostrador estatístico de pilhas de todas as threads do processo"""
+
+    def __init__(self, interval_seconds: float = 0.01, max_overhead: float = 0.02,
+                 include_idle: bool = False):
+        self.interval_seconds = interval_seconds
+        self.max_overhead = max_overhead
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self.wall_seconds = 0.0
+        self._labels: Dict[object, Tuple[str, str]] = {}
+
+    def _label(self, code) -> Tuple[str, str]:
+        """(módulo, "módulo.função") de um code object (cache por code)"""
+        label = self._labels.get(code)
+        if label is None:
+            module = module_of(code)
+            qualname = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = (module, f"{module}.{qualname}")
+        return label
+
+    def _is_idle(self, frame) -> bool:
+        module, _ = self._label(frame.f_code)
+        name = frame.f_code.co_name
+        return (module, name) in IDLE_FRAMES or (name in IDLE_FUNCTIONS and not module.startswith("app."))
+
+    def sample_once(self, exclude_threads=()):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in exclude_threads:
+                continue
+            if not self.include_idle and self._is_idle(frame):
+                continue
+            stack: List[str] = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._label(frame.f_code)[1])
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def run(self, seconds: float):
+        """Amostra por `seconds` a partir da thread corrente (bloqueia)"""
+        exclude = {threading.get_ident()}
+        interval = self.interval_seconds
+        start = time.perf_counter()
+        deadline = start + seconds
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            self.sample_once(exclude)
+            cost = time.perf_counter() - now
+            self.sampling_seconds += cost
+            # Custo da amostra / intervalo <= max_overhead
+            interval = max(self.interval_seconds, cost / self.max_overhead)
+            time.sleep(max(0.0, min(interval - cost, deadline - time.perf_counter())))
+        self.wall_seconds = time.perf_counter() - start
+        return self
+
+    @property
+    def overhead(self) -> float:
+        return self.sampling_seconds / self.wall_seconds if self.wall_seconds else 0.0
+
+    def summary(self) -> Dict:
+        return {
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "overhead": round(self.overhead, 4),
+        }
+
+    # Saídas -----------------------------------------------------------------
+
+    def collapsed(self) -> str:
+        """Formato collapsed/folded: "thread;raiz;...;folha contagem" por linha"""
+        return "".join(
+            f"{';'.join(stack)} {count}\n"
+            for stack, count in sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        )
+
+    def speedscope(self, name: str = "billing-service") -> Dict:
+        """Formato de arquivo do speedscope (perfil "sampled", peso = número de amostras)"""
+        frame_index: Dict[str, int] = {}
+        frames: List[Dict] = []
+        samples: List[List[int]] = []
+        weights: List[int] = []
+        for stack, count in self.stacks.items():
+            indexes = []
+            for label in stack:
+                index = frame_index.get(label)
+                if index is None:
+                    index = frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indexes.append(index)
+            samples.append(indexes)
+            weights.append(count)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{name} ({self.samples} amostras, {self.wall_seconds:.1f}s)",
+                "unit": "none",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "billing-service app.profiling",
+        }
+
+
+# Um profile por vez no processo
+_profile_lock = threading.Lock()
+
+
+def run_profile(seconds: float, interval_seconds: float, max_overhead: float,
+                include_idle: bool = False) -> Optional[SamplingProfiler]:
+    """Executa um profile; None se já há outro em andamento"""
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        return SamplingProfiler(interval_seconds, max_overhead, include_idle).run(seconds)
+    finally:
+        _profile_lock.release()
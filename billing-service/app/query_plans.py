@@ -0,0 +1,217 @@
+"""
+Regressão de planos de execução das queries dos serviços
+
+Executa cada método de leitura/atualização dos serviços contra um SQLite em memória
+(com o esquema dos modelos), captura os statements emitidos e roda EXPLAIN QUERY PLAN
+em cada um. Falha se uma query marcada como "hot" fizer full scan de tabela.
+
+Uso (CI ou local, não precisa de MySQL):
+    python -m app.query_plans
+"""
+import sys
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, List, Tuple, Any
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app import models  # noqa: F401 - registra os modelos no metadata
+from app.models import Claim, ClaimStatus, InvoiceStatus
+from app.schemas import ClaimUpdate, InvoiceUpdate
+from app.services.claim_service import ClaimService
+from app.services.invoice_service import InvoiceService
+from app.services.eligibility_service import EligibilityService
+from app.services.adjudication_service import ClaimAdjudicationWorker
+from app.services.patient_summary import PatientSummaryService
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryCase:
+    name: str
+    run: Callable[[Any], Any]
+    hot: bool = True
+
+
+@dataclass
+class PlanResult:
+    case: str
+    statement: str
+    plan: List[str]
+    full_scans: List[str] = field(default_factory=list)
+    hot: bool = True
+
+
+# Casos cobrindo as queries dos serviços. Queries "hot" não podem fazer full scan.
+QUERY_CASES: List[QueryCase] = [
+    QueryCase("ClaimService.get_claim", lambda db: ClaimService.get_claim(db, "CLM000001")),
+    QueryCase("ClaimService.get_claim_items", lambda db: ClaimService.get_claim_items(db, "CLM000001")),
+    QueryCase(
+        "ClaimService.get_claims(patient_id)",
+        lambda db: ClaimService.get_claims(db, patient_id="P1")
+    ),
+    QueryCase(
+        "ClaimService.get_claims(patient_id, status)",
+        lambda db: ClaimService.get_claims(db, patient_id="P1", status=ClaimStatus.PENDING)
+    ),
+    QueryCase(
+        "ClaimService.get_claims(status)",
+        lambda db: ClaimService.get_claims(db, status=ClaimStatus.PENDING)
+    ),
+    QueryCase("ClaimService.get_claims()", lambda db: ClaimService.get_claims(db), hot=False),
+    QueryCase("ClaimService.get_claims(after_id)", lambda db: ClaimService.get_claims(db, after_id="CLM000001")),
+    QueryCase(
+        "ClaimService.get_items_by_claim",
+        lambda db: ClaimService.get_items_by_claim(db, ["CLM000001", "CLM000002"])
+    ),
+    QueryCase(
+        "ClaimService.get_claims(patient_id, columns)",
+        lambda db: ClaimService.get_claims(db, patient_id="P1", columns=[Claim.id, Claim.status])
+    ),
+    QueryCase(
+        "ClaimService.update_claim",
+        lambda db: ClaimService.update_claim(db, "CLM000001", ClaimUpdate(status=ClaimStatus.APPROVED))
+    ),
+    QueryCase(
+        "ClaimAdjudicationWorker.claim_batch",
+        lambda db: ClaimAdjudicationWorker(None, {}).claim_batch(db)
+    ),
+    QueryCase(
+        "ClaimAdjudicationWorker.requeue_stale",
+        lambda db: ClaimAdjudicationWorker(None, {}).requeue_stale(db)
+    ),
+    QueryCase("InvoiceService.get_invoice", lambda db: InvoiceService.get_invoice(db, "INV000001")),
+    QueryCase(
+        "InvoiceService.get_invoices(patient_id)",
+        lambda db: InvoiceService.get_invoices(db, patient_id="P1")
+    ),
+    QueryCase(
+        "InvoiceService.get_invoices(patient_id, status)",
+        lambda db: InvoiceService.get_invoices(db, patient_id="P1", status=InvoiceStatus.PENDING)
+    ),
+    QueryCase("InvoiceService.get_invoices()", lambda db: InvoiceService.get_invoices(db), hot=False),
+    QueryCase(
+        "InvoiceService.update_invoice",
+        lambda db: InvoiceService.update_invoice(db, "INV000001", InvoiceUpdate(status=InvoiceStatus.CANCELLED))
+    ),
+    QueryCase(
+        "EligibilityService.get_eligibility_history(patient_id, insurance_id)",
+        lambda db: EligibilityService.get_eligibility_history(db, patient_id="P1", insurance_id="I1")
+    ),
+    QueryCase(
+        "EligibilityService.get_eligibility_history(patient_id)",
+        lambda db: EligibilityService.get_eligibility_history(db, patient_id="P1")
+    ),
+    QueryCase(
+        "EligibilityService.get_eligibility_history(insurance_id)",
+        lambda db: EligibilityService.get_eligibility_history(db, insurance_id="I1")
+    ),
+    QueryCase(
+        "EligibilityService.get_eligibility_history()",
+        lambda db: EligibilityService.get_eligibility_history(db)
+    ),
+    QueryCase(
+        "PatientSummaryService.recompute",
+        lambda db: PatientSummaryService.recompute(db, ["P1", "P2"])
+    ),
+    QueryCase(
+        "PatientSummaryService.get_summary",
+        lambda db: PatientSummaryService.get_summary(db, "P1")
+    ),
+]
+
+
+def _seed(db):
+    """Insere uma linha por tabela para que os métodos percorram seus caminhos de update"""
+    db.add(models.Claim(
+        id="CLM000001", patient_id="P1", insurance_id="I1", amount=10, currency="BRL",
+        status=ClaimStatus.PENDING
+    ))
+    db.add(models.Invoice(
+        id="INV000001", claim_id="CLM000001", patient_id="P1", amount=10, currency="BRL",
+        status=InvoiceStatus.PENDING
+    ))
+    db.commit()
+
+
+def _full_scans(plan: List[str]) -> List[str]:
+    """Linhas do plano que varrem a tabela inteira ("SCAN tabela" sem índice)"""
+    scans = []
+    for line in plan:
+        detail = line.strip()
+        if detail.startswith("SCAN ") and " USING " not in detail:
+            scans.append(detail)
+    return scans
+
+
+def collect_plans(cases: List[QueryCase] = None) -> List[PlanResult]:
+    """Executa os casos contra SQLite em memória e retorna o plano de cada statement"""
+    cases = cases if cases is not None else QUERY_CASES
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    captured: List[Tuple[str, Any]] = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        keyword = statement.lstrip().split(" ", 1)[0].upper()
+        if keyword in ("SELECT", "UPDATE", "DELETE") and not statement.lstrip().upper().startswith("SELECT 1"):
+            captured.append((statement, parameters))
+
+    with Session() as db:
+        _seed(db)
+
+    results: List[PlanResult] = []
+    for case in cases:
+        captured.clear()
+        with Session() as db:
+            case.run(db)
+            db.rollback()
+        statements = list(captured)
+
+        with engine.connect() as conn:
+            for statement, parameters in statements:
+                rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+                plan = [row[-1] for row in rows]
+                results.append(PlanResult(
+                    case=case.name,
+                    statement=statement,
+                    plan=plan,
+                    full_scans=_full_scans(plan),
+                    hot=case.hot,
+                ))
+
+    engine.dispose()
+    return results
+
+
+def find_regressions(results: List[PlanResult]) -> List[PlanResult]:
+    """Queries hot que caíram em full scan"""
+    return [result for result in results if result.hot and result.full_scans]
+
+
+def main() -> int:
+    results = collect_plans()
+    regressions = find_regressions(results)
+
+    for result in results:
+        status = "FULL SCAN" if result.full_scans else "ok"
+        marker = "" if result.hot else " (cold)"
+        print(f"[{status}] {result.case}{marker}")
+        for line in result.plan:
+            print(f"    {line}")
+
+    if regressions:
+        print(f"\n{len(regressions)} query(s) hot com full scan:")
+        for result in regressions:
+            print(f"  - {result.case}: {', '.join(result.full_scans)}")
+        return 1
+
+    print(f"\n{len(results)} statements verificados, nenhum full scan em queries hot")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,48 @@
 import redis
-from redis.exceptions import ConnectionError, RedisError
+from redis.exceptions import ConnectionError, RedisError, TimeoutError
 from app.config import settings
+from app import deadline
+from app.middleware import server_timing
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+class DeadlineConnection(redis.Connection):
+    """Conexão que respeita o deadline da requisição (app.deadline)
+
+    Não envia comandos após o prazo e limita a espera pela resposta ao tempo restante.
+    """
+
+    def send_command(self, *args, **kwargs):
+        deadline.check("redis")
+        with server_timing.phase("redis"):
+            return super().send_command(*args, **kwargs)
+
+    def read_response(self, *args, **kwargs):
+        budget = deadline.timeout_for(self.socket_timeout)
+        if budget is not None and budget != self.socket_timeout and "timeout" not in kwargs:
+            kwargs["timeout"] = budget
+        try:
+            with server_timing.phase("redis"):
+                return super().read_response(*args, **kwargs)
+        except TimeoutError:
+            remaining = deadline.remaining()
+            if remaining is not None and remaining <= 0:
+                deadline.deadline_exceeded_total.labels(stage="redis").inc()
+            raise
+
+
 redis_client = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-    decode_responses=True,
-    socket_connect_timeout=2,
-    socket_timeout=2
+    connection_pool=redis.ConnectionPool(
+        connection_class=DeadlineConnection,
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        decode_responses=True,
+        socket_connect_timeout=2,
+        socket_timeout=2
+    )
 )
 
 
@@ -0,0 +1,111 @@
+"""
+Verificação do roteamento de leituras para réplicas (app.database) com dois SQLite locais
+
+Primário e réplica recebem o mesmo claim com patient_id diferente ("primary"/"replica"),
+então a linha devolvida por ClaimService.get_claim (método @read_only) mostra para onde a
+leitura foi. Confere:
+- leitura sem escrita recente vai para a réplica;
+- read-your-writes: na mesma sessão após o flush e entre sessões do mesmo cliente, até
+  a janela expirar; outro cliente continua na réplica;
+- fallback para o primário com lag acima do limite e com replicação parada (lag None).
+
+Uso (CI ou local, não precisa de MySQL):
+    python -m app.replica_check [--dir /tmp/billing-replica]
+"""
+import os
+import time
+import logging
+from decimal import Decimal
+from typing import Dict, Optional
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.database import Base, ReplicaRouter, RoutingSession
+from app.models import Claim, ClaimStatus
+from app.services.claim_service import ClaimService
+from app.sharding import shards
+
+logger = logging.getLogger(__name__)
+
+CLAIM_ID = "CLM000001"
+
+
+def run_check(directory: str) -> Dict:
+    os.makedirs(directory, exist_ok=True)
+    engines = {}
+    for name in ("primary", "replica"):
+        path = os.path.join(directory, f"{name}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        engines[name] = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engines[name])
+        with Session(engines[name]) as db:
+            db.add(Claim(id=CLAIM_ID, patient_id=name, insurance_id="INS1", amount=Decimal("10.00"),
+                         status=ClaimStatus.PENDING))
+            db.commit()
+
+    lag: Dict[str, Optional[float]] = {"value": 0.0}
+    router = ReplicaRouter(
+        {"replica-0": engines["replica"]}, max_lag_seconds=5.0, lag_check_seconds=0.0,
+        read_your_writes_seconds=0.5, lag_probe=lambda replica: lag["value"]
+    )
+    factory = sessionmaker(
+        class_=RoutingSession, autocommit=False, autoflush=False, bind=engines["primary"],
+        info={"replica_router": router}
+    )
+    previous_factories = shards.session_factories
+    shards.configure([factory])
+
+    def read_from(client: str) -> str:
+        with factory() as db:
+            db.info["client_key"] = client
+            return ClaimService.get_claim(db, CLAIM_ID).patient_id
+
+    checks = []
+
+    def expect(step: str, actual: str, expected: str):
+        checks.append({"check": step, "target": actual, "ok": actual == expected})
+
+    try:
+        expect("leitura sem escrita", read_from("a"), "replica")
+
+        with factory() as db:
+            db.info["client_key"] = "a"
+            db.add(Claim(id="CLM000002", patient_id="primary", insurance_id="INS1", amount=Decimal("10.00"),
+                         status=ClaimStatus.PENDING))
+            db.flush()
+            expect("mesma sessão após escrita", ClaimService.get_claim(db, CLAIM_ID).patient_id, "primary")
+            db.commit()
+        expect("read-your-writes do cliente", read_from("a"), "primary")
+        expect("outro cliente", read_from("b"), "replica")
+        time.sleep(router.read_your_writes_seconds + 0.1)
+        expect("janela de read-your-writes expirada", read_from("a"), "replica")
+
+        lag["value"] = 10.0
+        expect("lag acima do limite", read_from("b"), "primary")
+        lag["value"] = None
+        expect("replicação parada (lag desconhecido)", read_from("b"), "primary")
+        lag["value"] = 1.0
+        expect("lag normalizado", read_from("b"), "replica")
+    finally:
+        shards.configure(previous_factories)
+        for engine in engines.values():
+            engine.dispose()
+
+    return {
+        "checks": checks,
+        "errors": [f"{check['check']}: leitura foi para {check['target']}" for check in checks if not check["ok"]],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Roteamento de leituras para réplicas com dois SQLite")
+    parser.add_argument("--dir", default="/tmp/billing-replica")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    result = run_check(args.dir)
+    for check in result["checks"]:
+        print(f"[{'ok' if check['ok'] else 'FALHA'}] {check['check']} -> {check['target']}")
+    raise SystemExit(1 if result["errors"] else 0)
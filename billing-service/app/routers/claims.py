@@ -1,16 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import Optional, List
+from datetime import date
 import logging
 from app.database import get_db
-from app.schemas import ClaimCreate, ClaimUpdate, ClaimResponse, ClaimItemResponse
-from app.services.claim_service import ClaimService
+from app.schemas import (
+    ClaimCreate, ClaimUpdate, ClaimResponse, ClaimItemResponse, ClaimListItemResponse, ClaimSearchResponse
+)
+from app.services.claim_service import ClaimService, CLAIM_LIST_COLUMNS
+from app.services.claim_search import ClaimSearchService
+from app.fieldsets import parse_fields, parse_include
 from app.models import ClaimStatus
 from app.middleware.auth import require_permission
 from app.middleware.observability import claims_created_total
+from app.middleware.server_timing import TimedRoute
 
 logger = logging.getLogger(__name__)
-router = APIRouter(prefix="/claims", tags=["Claims"])
+router = APIRouter(prefix="/claims", tags=["Claims"], route_class=TimedRoute)
 
 
 @router.post("/", response_model=ClaimResponse, status_code=201)
@@ -47,6 +53,7 @@ def create_claim(
         "amount": float(created_claim.amount),
         "currency": created_claim.currency,
         "status": created_claim.status,
+        "version": created_claim.version,
         "items": [
             ClaimItemResponse(
                 description=item.description,
@@ -61,6 +68,48 @@ def create_claim(
     return claim_dict
 
 
+@router.get("/search", response_model=ClaimSearchResponse, response_model_exclude_unset=True)
+def search_claims(
+    q: Optional[str] = Query(None, description="Termos da descrição ou código dos itens (todos obrigatórios)"),
+    code: Optional[str] = Query(None, description="Código TUSS exato de algum item"),
+    insurance_id: Optional[str] = Query(None, description="Filtrar por insurance_id"),
+    date_from: Optional[date] = Query(None, description="Claims criados a partir de (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Claims criados até (inclusive)"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """Busca claims por código TUSS ou descrição dos itens"""
+    if not (q and q.strip()) and not code:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Missing search terms", "message": "Informe `q` ou `code`"}
+        )
+    
+    total, total_exact, claims, backend = ClaimSearchService.search(
+        db, q=q, code=code, insurance_id=insurance_id,
+        date_from=date_from, date_to=date_to, limit=limit, offset=skip
+    )
+    return {
+        "total": total,
+        "total_exact": total_exact,
+        "backend": backend,
+        "results": [
+            {
+                "id": claim.id,
+                "patient_id": claim.patient_id,
+                "insurance_id": claim.insurance_id,
+                "amount": float(claim.amount),
+                "currency": claim.currency,
+                "status": claim.status,
+                "version": claim.version,
+                "created_at": claim.created_at
+            }
+            for claim in claims
+        ]
+    }
+
+
 @router.get("/{claim_id}", response_model=ClaimResponse)
 def get_claim(claim_id: str, db: Session = Depends(get_db)):
     """Busca um claim por ID"""
@@ -76,6 +125,7 @@ def get_claim(claim_id: str, db: Session = Depends(get_db)):
         "amount": float(claim.amount),
         "currency": claim.currency,
         "status": claim.status,
+        "version": claim.version,
         "items": [
             ClaimItemResponse(
                 description=item.description,
@@ -90,45 +140,57 @@ def get_claim(claim_id: str, db: Session = Depends(get_db)):
     return claim_dict
 
 
-@router.get("/", response_model=List[ClaimResponse])
+@router.get("/", response_model=List[ClaimListItemResponse], response_model_exclude_unset=True)
 def list_claims(
     patient_id: Optional[str] = Query(None, description="Filtrar por patient_id"),
     status: Optional[ClaimStatus] = Query(None, description="Filtrar por status"),
+    fields: Optional[str] = Query(None, description="Campos a retornar, separados por vírgula (ex.: id,status)"),
+    include: Optional[str] = Query(None, description="Relações a incluir: items"),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[str] = Query(None, description="Cursor: id do último item da página anterior"),
     db: Session = Depends(get_db)
 ):
-    """Lista claims com filtros opcionais"""
-    claims = ClaimService.get_claims(db, patient_id=patient_id, status=status, skip=skip, limit=limit)
+    """Lista claims com filtros opcionais
+
+    Sem `fields`, retorna todos os campos e os itens. Com `fields`, seleciona só essas
+    colunas e os itens só são carregados com `include=items`.
+    """
+    columns = parse_fields(fields, CLAIM_LIST_COLUMNS)
+    include_items = "items" in parse_include(include, ("items",)) or not fields
+    
+    rows = ClaimService.get_claims(
+        db, patient_id=patient_id, status=status, skip=skip, limit=limit, columns=columns,
+        after_id=after_id
+    )
+    items_by_claim = ClaimService.get_items_by_claim(db, [row.id for row in rows]) if include_items else {}
     
     result = []
-    for claim in claims:
-        items = ClaimService.get_claim_items(db, claim.id)
-        result.append({
-            "id": claim.id,
-            "patient_id": claim.patient_id,
-            "insurance_id": claim.insurance_id,
-            "amount": float(claim.amount),
-            "currency": claim.currency,
-            "status": claim.status,
-            "items": [
+    for row in rows:
+        claim_dict = dict(row._mapping)
+        if claim_dict.get("amount") is not None:
+            claim_dict["amount"] = float(claim_dict["amount"])
+        if include_items:
+            claim_dict["items"] = [
                 ClaimItemResponse(
                     description=item.description,
                     code=item.code,
                     value=float(item.value),
                     quantity=item.quantity
                 )
-                for item in items
-            ],
-            "created_at": claim.created_at
-        })
+                for item in items_by_claim[row.id]
+            ]
+        result.append(claim_dict)
     
     return result
 
 
 @router.patch("/{claim_id}", response_model=ClaimResponse)
 def update_claim(claim_id: str, claim_update: ClaimUpdate, db: Session = Depends(get_db)):
-    """Atualiza um claim"""
+    """Atualiza um claim
+
+    Se `version` for informada, retorna 409 caso o claim tenha sido alterado desde a leitura.
+    """
     claim = ClaimService.update_claim(db, claim_id, claim_update)
     if not claim:
         raise HTTPException(status_code=404, detail="Claim não encontrado")
@@ -141,6 +203,7 @@ def update_claim(claim_id: str, claim_update: ClaimUpdate, db: Session = Depends
         "amount": float(claim.amount),
         "currency": claim.currency,
         "status": claim.status,
+        "version": claim.version,
         "items": [
             ClaimItemResponse(
                 description=item.description,
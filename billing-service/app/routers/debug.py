@@ -0,0 +1,118 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+import logging
+from app.config import settings
+from app.db_instrumentation import query_stats
+from app.middleware.auth import require_role
+from app.profiling import run_profile
+from app.memory_diagnostics import GROUP_BY, memory_tracker
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/debug", tags=["Debug"])
+
+
+@router.get("/queries")
+def list_top_queries(
+    limit: int = Query(20, ge=1, le=200, description="Número de fingerprints retornados"),
+    reset: bool = Query(False, description="Zera as estatísticas após a leitura"),
+    claims: dict = Depends(require_role("billing:admin"))
+):
+    """Lista as queries (por fingerprint) que mais consomem tempo de banco"""
+    top = query_stats.top(limit)
+    if reset:
+        query_stats.reset()
+    return {
+        "queries": [
+            {
+                "query_id": entry["query_id"],
+                "fingerprint": entry["fingerprint"],
+                "calls": entry["calls"],
+                "total_ms": round(entry["total_seconds"] * 1000, 2),
+                "mean_ms": round(entry["mean_seconds"] * 1000, 3),
+                "max_ms": round(entry["max_seconds"] * 1000, 2),
+            }
+            for entry in top
+        ]
+    }
+
+
+@router.get("/profile")
+def profile_cpu(
+    seconds: float = Query(10, gt=0, le=settings.PROFILE_MAX_SECONDS, description="Duração da amostragem"),
+    interval_ms: float = Query(10, ge=1, le=1000, description="Intervalo entre amostras (mínimo)"),
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$", description="collapsed ou speedscope"),
+    idle: bool = Query(False, description="Inclui threads ociosas (locks, filas, sockets)"),
+    claims: dict = Depends(require_role("billing:admin"))
+):
+    """Profile de CPU por amostragem de todas as threads (um por vez por processo)"""
+    profiler = run_profile(seconds, interval_ms / 1000, settings.PROFILE_MAX_OVERHEAD, include_idle=idle)
+    if profiler is None:
+        raise HTTPException(
+            status_code=409,
+            detail={"error": "Profile in progress", "message": "Já existe um profile em andamento neste processo."}
+        )
+    summary = profiler.summary()
+    logger.info(f"Profile de CPU executado por {claims.get('sub')}: {summary}")
+    headers = {
+        "X-Profile-Samples": str(summary["samples"]),
+        "X-Profile-Overhead": str(summary["overhead"]),
+    }
+    if format == "speedscope":
+        headers["Content-Disposition"] = 'attachment; filename="profile.speedscope.json"'
+        return JSONResponse(profiler.speedscope(), headers=headers)
+    return PlainTextResponse(profiler.collapsed(), headers=headers)
+
+
+@router.get("/memory")
+def memory_status(claims: dict = Depends(require_role("billing:admin"))):
+    """RSS, contadores do GC, estado do tracemalloc e métricas com mais séries"""
+    return memory_tracker.status()
+
+
+@router.post("/memory/tracemalloc/start")
+def start_tracemalloc(
+    frames: int = Query(1, ge=1, le=25, description="Frames guardados por alocação"),
+    claims: dict = Depends(require_role("billing:admin"))
+):
+    """Liga o tracemalloc e tira o snapshot base (desliga sozinho após MEMORY_TRACEMALLOC_MAX_SECONDS)"""
+    if not memory_tracker.start(frames, settings.MEMORY_TRACEMALLOC_MAX_SECONDS):
+        raise HTTPException(
+            status_code=409,
+            detail={"error": "Tracemalloc already running", "message": "O tracemalloc já está ligado."}
+        )
+    logger.warning(f"tracemalloc ligado por {claims.get('sub')}")
+    return memory_tracker.status()["tracemalloc"]
+
+
+@router.post("/memory/tracemalloc/stop")
+def stop_tracemalloc(claims: dict = Depends(require_role("billing:admin"))):
+    """Desliga o tracemalloc e descarta os snapshots"""
+    return {"stopped": memory_tracker.stop()}
+
+
+@router.post("/memory/snapshot")
+def take_memory_snapshot(claims: dict = Depends(require_role("billing:admin"))):
+    """Tira um snapshot que vira o ponto de comparação `last`"""
+    if not memory_tracker.snapshot():
+        raise HTTPException(
+            status_code=409,
+            detail={"error": "Tracemalloc not running", "message": "Ligue o tracemalloc antes (tracemalloc/start)."}
+        )
+    return memory_tracker.status()["tracemalloc"]
+
+
+@router.get("/memory/allocations")
+def memory_allocations(
+    group_by: str = Query("module", pattern=f"^({'|'.join(GROUP_BY)})$", description="module, filename, lineno ou traceback"),
+    compare: str = Query("baseline", pattern="^(baseline|last|none)$", description="Crescimento desde baseline/last, ou none"),
+    limit: int = Query(20, ge=1, le=200),
+    claims: dict = Depends(require_role("billing:admin"))
+):
+    """Top sites de alocação (ou de crescimento) agrupados por módulo, arquivo ou linha"""
+    result = memory_tracker.allocations(group_by, compare, limit)
+    if result is None:
+        raise HTTPException(
+            status_code=409,
+            detail={"error": "Tracemalloc not running", "message": "Ligue o tracemalloc antes (tracemalloc/start)."}
+        )
+    return result
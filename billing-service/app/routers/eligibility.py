@@ -4,13 +4,15 @@ from typing import Optional, List
 from datetime import datetime
 import logging
 from app.database import get_db
-from app.schemas import EligibilityCheckRequest, EligibilityCheckResponse
-from app.services.eligibility_service import EligibilityService
+from app.schemas import EligibilityCheckRequest, EligibilityCheckResponse, EligibilityHistoryItemResponse
+from app.services.eligibility_service import EligibilityService, ELIGIBILITY_HISTORY_COLUMNS
+from app.fieldsets import parse_fields
 from app.middleware.auth import require_permission
 from app.middleware.observability import eligibility_checks_total
+from app.middleware.server_timing import TimedRoute
 
 logger = logging.getLogger(__name__)
-router = APIRouter(prefix="/eligibility", tags=["Eligibility"])
+router = APIRouter(prefix="/eligibility", tags=["Eligibility"], route_class=TimedRoute)
 
 
 @router.post("/check", response_model=EligibilityCheckResponse)
@@ -48,29 +50,32 @@ def check_eligibility(
         )
 
 
-@router.get("/history", response_model=List[EligibilityCheckResponse])
+@router.get("/history", response_model=List[EligibilityHistoryItemResponse], response_model_exclude_unset=True)
 def get_eligibility_history(
     patient_id: Optional[str] = Query(None, description="Filtrar por patient_id"),
     insurance_id: Optional[str] = Query(None, description="Filtrar por insurance_id"),
+    since: Optional[datetime] = Query(None, description="Verificações a partir de (inclusive)"),
+    until: Optional[datetime] = Query(None, description="Verificações anteriores a"),
+    fields: Optional[str] = Query(None, description="Campos a retornar, separados por vírgula (ex.: is_eligible,checked_at)"),
     limit: int = Query(10, ge=1, le=100),
     db: Session = Depends(get_db)
 ):
     """Busca histórico de verificações de elegibilidade"""
+    columns = parse_fields(fields, ELIGIBILITY_HISTORY_COLUMNS, always=())
     history = EligibilityService.get_eligibility_history(
         db,
         patient_id=patient_id,
         insurance_id=insurance_id,
-        limit=limit
+        limit=limit,
+        since=since,
+        until=until,
+        columns=columns
     )
     
-    return [
-        EligibilityCheckResponse(
-            patient_id=item.patient_id,
-            insurance_id=item.insurance_id,
-            is_eligible=bool(item.is_eligible),
-            message=item.message,
-            checked_at=item.checked_at
-        )
-        for item in history
-    ]
-
+    result = []
+    for row in history:
+        item = dict(row._mapping)
+        if "is_eligible" in item:
+            item["is_eligible"] = bool(item["is_eligible"])
+        result.append(item)
+    return result
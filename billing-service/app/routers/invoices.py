@@ -1,16 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import io
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import logging
 from app.database import get_db
-from app.schemas import InvoiceCreate, InvoiceUpdate, InvoiceResponse
-from app.services.invoice_service import InvoiceService
+from app.schemas import (
+    InvoiceCreate, InvoiceUpdate, InvoiceResponse, InvoiceListItemResponse,
+    InvoiceSettleBatchRequest, InvoiceSettleBatchResponse, RemittanceImportResponse
+)
+from app.services.invoice_service import InvoiceService, INVOICE_LIST_COLUMNS
+from app.services.remittance_import import import_remittance
+from app.fieldsets import parse_fields
 from app.models import InvoiceStatus
 from app.middleware.auth import require_permission
 from app.middleware.observability import invoices_settled_total
+from app.middleware.server_timing import TimedRoute
 
 logger = logging.getLogger(__name__)
-router = APIRouter(prefix="/invoices", tags=["Invoices"])
+router = APIRouter(prefix="/invoices", tags=["Invoices"], route_class=TimedRoute)
 
 
 @router.post("/", response_model=InvoiceResponse, status_code=201)
@@ -32,6 +39,63 @@ def create_invoice(invoice: InvoiceCreate, db: Session = Depends(get_db)):
         )
 
 
+@router.post("/settle-batch", response_model=InvoiceSettleBatchResponse)
+def settle_invoices_batch(
+    batch: InvoiceSettleBatchRequest,
+    db: Session = Depends(get_db),
+    # Autenticação/Authorização (comentado para desenvolvimento)
+    # user_claims: dict = Depends(require_permission("invoices:settle"))
+):
+    """Liquida um lote de invoices (remessa de pagamento) com UPDATE set-based"""
+    try:
+        result = InvoiceService.settle_invoices(db, batch.invoice_ids)
+        # Métrica de negócio
+        invoices_settled_total.inc(len(result["settled"]))
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao liquidar lote de invoices: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": "Failed to settle invoice batch",
+                "message": "Erro ao liquidar lote de invoices. Verifique os logs para mais detalhes."
+            }
+        )
+
+
+@router.post("/remittances", response_model=RemittanceImportResponse)
+def import_remittance_file(
+    file: UploadFile = File(..., description="CSV da remessa: guia;invoice_id;valor_pago;valor_glosa;codigo_glosa"),
+    insurance_id: Optional[str] = Query(None, description="Convênio da remessa (restringe o casamento às suas guias)"),
+    encoding: str = Query("utf-8", description="Encoding do arquivo (ex.: iso-8859-1)"),
+    # Autenticação/Authorização (comentado para desenvolvimento)
+    # user_claims: dict = Depends(require_permission("invoices:settle"))
+):
+    """Importa a remessa de pagamento do convênio: liquida as invoices e grava pagos/glosas em lote"""
+    try:
+        # Leitura incremental do upload (spool em disco), sem carregar o arquivo inteiro
+        stream = io.TextIOWrapper(file.file, encoding=encoding, newline="")
+        return import_remittance(stream, insurance_id)
+    except HTTPException:
+        raise
+    except (UnicodeDecodeError, LookupError) as e:
+        raise HTTPException(
+            status_code=422,
+            detail={"error": "Invalid remittance file", "message": f"Arquivo não pôde ser lido: {e}"}
+        )
+    except Exception as e:
+        logger.error(f"Erro ao importar remessa: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": "Failed to import remittance",
+                "message": "Erro ao importar remessa. Verifique os logs para mais detalhes."
+            }
+        )
+
+
 @router.get("/{invoice_id}", response_model=InvoiceResponse)
 def get_invoice(invoice_id: str, db: Session = Depends(get_db)):
     """Busca uma invoice por ID"""
@@ -41,17 +105,31 @@ def get_invoice(invoice_id: str, db: Session = Depends(get_db)):
     return invoice
 
 
-@router.get("/", response_model=List[InvoiceResponse])
+@router.get("/", response_model=List[InvoiceListItemResponse], response_model_exclude_unset=True)
 def list_invoices(
     patient_id: Optional[str] = Query(None, description="Filtrar por patient_id"),
     status: Optional[InvoiceStatus] = Query(None, description="Filtrar por status"),
+    fields: Optional[str] = Query(None, description="Campos a retornar, separados por vírgula (ex.: id,status)"),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[str] = Query(None, description="Cursor: id do último item da página anterior"),
     db: Session = Depends(get_db)
 ):
-    """Lista invoices com filtros opcionais"""
-    invoices = InvoiceService.get_invoices(db, patient_id=patient_id, status=status, skip=skip, limit=limit)
-    return invoices
+    """Lista invoices com filtros opcionais (`fields` seleciona só as colunas pedidas)"""
+    columns = parse_fields(fields, INVOICE_LIST_COLUMNS)
+    rows = InvoiceService.get_invoices(
+        db, patient_id=patient_id, status=status, skip=skip, limit=limit, columns=columns,
+        after_id=after_id
+    )
+    
+    result = []
+    for row in rows:
+        invoice_dict = dict(row._mapping)
+        for money_field in ("amount", "paid_amount", "glosa_amount"):
+            if invoice_dict.get(money_field) is not None:
+                invoice_dict[money_field] = float(invoice_dict[money_field])
+        result.append(invoice_dict)
+    return result
 
 
 @router.post("/{invoice_id}/settle", response_model=InvoiceResponse)
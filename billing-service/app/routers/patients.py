@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+import logging
+from app.database import get_db
+from app.schemas import PatientBillingSummaryResponse
+from app.services.patient_summary import PatientSummaryService
+from app.middleware.auth import require_permission
+from app.middleware.server_timing import TimedRoute
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/patients", tags=["Patients"], route_class=TimedRoute)
+
+
+@router.get("/{patient_id}/billing-summary", response_model=PatientBillingSummaryResponse)
+def get_billing_summary(
+    patient_id: str,
+    db: Session = Depends(get_db),
+    # Autenticação/Authorização (comentado para desenvolvimento)
+    # user_claims: dict = Depends(require_permission("patients:read"))
+):
+    """Resumo de faturamento do paciente (saldo em aberto, claims abertos, última liquidação)
+
+    Servido do read model patient_billing_summary, com cache Redis por paciente.
+    """
+    return PatientSummaryService.get_summary(db, patient_id)
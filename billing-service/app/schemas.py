@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
-from datetime import datetime
+from typing import Dict, Optional, List
+from datetime import date, datetime
 from app.models import ClaimStatus, InvoiceStatus
 
 
@@ -33,6 +33,8 @@ class ClaimCreate(BaseModel):
 class ClaimUpdate(BaseModel):
     status: Optional[ClaimStatus] = None
     insurance_id: Optional[str] = None
+    # Versão lida pelo cliente; se informada, o update só é aplicado se ainda for a atual
+    version: Optional[int] = None
 
 
 class ClaimResponse(BaseModel):
@@ -42,6 +44,7 @@ class ClaimResponse(BaseModel):
     amount: float
     currency: str
     status: ClaimStatus
+    version: int = 1
     items: List[ClaimItemResponse]
     created_at: datetime
 
@@ -49,6 +52,26 @@ class ClaimResponse(BaseModel):
         from_attributes = True
 
 
+class ClaimListItemResponse(BaseModel):
+    """Claim na listagem; com ?fields= só os campos pedidos são retornados"""
+    id: str
+    patient_id: Optional[str] = None
+    insurance_id: Optional[str] = None
+    amount: Optional[float] = None
+    currency: Optional[str] = None
+    status: Optional[ClaimStatus] = None
+    version: Optional[int] = None
+    items: Optional[List[ClaimItemResponse]] = None
+    created_at: Optional[datetime] = None
+
+
+class ClaimSearchResponse(BaseModel):
+    total: int
+    total_exact: bool = True  # False: contagem interrompida, `total` é um piso
+    backend: str
+    results: List[ClaimListItemResponse]
+
+
 # Invoice Schemas
 class InvoiceCreate(BaseModel):
     claim_id: Optional[str] = None
@@ -59,6 +82,7 @@ class InvoiceCreate(BaseModel):
 
 class InvoiceUpdate(BaseModel):
     status: Optional[InvoiceStatus] = None
+    version: Optional[int] = None
 
 
 class InvoiceResponse(BaseModel):
@@ -68,17 +92,84 @@ class InvoiceResponse(BaseModel):
     amount: float
     currency: str
     status: InvoiceStatus
+    version: int = 1
     settled_at: Optional[datetime] = None
+    paid_amount: Optional[float] = None
+    glosa_amount: Optional[float] = None
+    glosa_code: Optional[str] = None
     created_at: datetime
 
     class Config:
         from_attributes = True
 
 
+class InvoiceListItemResponse(BaseModel):
+    """Invoice na listagem; com ?fields= só os campos pedidos são retornados"""
+    id: str
+    claim_id: Optional[str] = None
+    patient_id: Optional[str] = None
+    amount: Optional[float] = None
+    currency: Optional[str] = None
+    status: Optional[InvoiceStatus] = None
+    version: Optional[int] = None
+    settled_at: Optional[datetime] = None
+    paid_amount: Optional[float] = None
+    glosa_amount: Optional[float] = None
+    glosa_code: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+class InvoiceSettleBatchRequest(BaseModel):
+    invoice_ids: List[str] = Field(..., min_length=1, max_length=10000)
+
+
+class InvoiceSettleBatchResponse(BaseModel):
+    settled: List[str]
+    already_settled: List[str]
+    not_settleable: List[str]  # ex.: invoices canceladas
+    missing: List[str]
+    events_published: int
+
+
+class RemittanceRejectedLine(BaseModel):
+    line: int
+    guia: Optional[str] = None
+    invoice_id: Optional[str] = None
+    reason: str  # unmatched, mismatch, duplicate, already_settled, not_settleable, invalid
+
+
+class RemittanceImportResponse(BaseModel):
+    lines: int
+    settled: int
+    glosa_lines: int
+    paid_amount: float
+    glosa_amount: float
+    rejected: Dict[str, int]
+    rejected_lines: List[RemittanceRejectedLine]
+    events_published: int
+    index_size: int
+    seconds: float
+    lines_per_minute: float
+
+
+# Patient Schemas
+class PatientBillingSummaryResponse(BaseModel):
+    patient_id: str
+    outstanding_balance: float
+    pending_invoices: int
+    open_claims: int
+    total_claims: int
+    last_settlement_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
 # Eligibility Schemas
 class EligibilityCheckRequest(BaseModel):
     patient_id: str
     insurance_id: str
+    plan_code: Optional[str] = None
+    procedure_code: Optional[str] = None
+    enrolled_at: Optional[date] = None
 
 
 class EligibilityCheckResponse(BaseModel):
@@ -92,6 +183,15 @@ class EligibilityCheckResponse(BaseModel):
         from_attributes = True
 
 
+class EligibilityHistoryItemResponse(BaseModel):
+    """Verificação no histórico; com ?fields= só os campos pedidos são retornados"""
+    patient_id: Optional[str] = None
+    insurance_id: Optional[str] = None
+    is_eligible: Optional[bool] = None
+    message: Optional[str] = None
+    checked_at: Optional[datetime] = None
+
+
 
 
 
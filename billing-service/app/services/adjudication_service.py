@@ -0,0 +1,399 @@
+"""
+Adjudicação de claims em background (pending -> processing -> approved/rejected)
+
+As regras por convênio (códigos permitidos, limites de quantidade e valor por item,
+teto do claim) são compiladas uma vez em estruturas de lookup (dict/frozenset, valores
+em centavos) e avaliadas em lote, opcionalmente em um pool de processos. As transições
+de status são aplicadas com UPDATEs em lote, em cada shard (app.sharding).
+
+Uso via CLI:
+    python -m app.services.adjudication_service            # drena os claims pendentes do banco
+    python -m app.services.adjudication_service --events eventos.jsonl  # consome ClaimSubmitted
+"""
+import json
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from prometheus_client import Counter, Gauge, Histogram
+from app.config import settings
+from app.models import Claim, ClaimItem, ClaimStatus
+from app.services.patient_summary import PatientSummaryService
+from app.sharding import shard_of_id, shards
+
+logger = logging.getLogger(__name__)
+
+claims_adjudicated_total = Counter(
+    'billing_claims_adjudicated_total',
+    'Claims adjudicated by the background pipeline',
+    ['result']
+)
+
+adjudication_batch_duration_seconds = Histogram(
+    'billing_adjudication_batch_duration_seconds',
+    'Time to claim, evaluate and update one adjudication batch',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+adjudication_throughput = Gauge(
+    'billing_adjudication_claims_per_second',
+    'Claims per second in the last adjudication run'
+)
+
+# Chave de regras padrão, aplicada a convênios sem regras próprias
+DEFAULT_RULESET_KEY = "*"
+
+# (claim_id, insurance_id, amount_cents, ((code, unit_value_cents, quantity), ...))
+ClaimTuple = Tuple[str, Optional[str], int, Tuple[Tuple[Optional[str], int, int], ...]]
+# (claim_id, approved, reason)
+Decision = Tuple[str, bool, Optional[str]]
+
+
+def to_cents(value) -> int:
+    return int((Decimal(str(value)) * 100).to_integral_value())
+
+
+@dataclass(frozen=True)
+class CompiledRuleSet:
+    """Regras de um convênio pré-compiladas para lookups O(1) por item"""
+    amount_ceiling_cents: Optional[int] = None
+    allowed_codes: Optional[FrozenSet[str]] = None  # None = qualquer código
+    require_code: bool = False
+    # código -> (quantidade máxima, valor unitário máximo em centavos); None = sem limite
+    item_limits: Dict[str, Tuple[Optional[int], Optional[int]]] = field(default_factory=dict)
+
+
+def compile_ruleset(raw: dict) -> CompiledRuleSet:
+    """Converte a definição JSON de um convênio em CompiledRuleSet"""
+    item_limits = {}
+    for code, limits in (raw.get("items") or {}).items():
+        max_unit_value = limits.get("max_unit_value")
+        item_limits[code] = (
+            limits.get("max_quantity"),
+            to_cents(max_unit_value) if max_unit_value is not None else None
+        )
+
+    allowed = raw.get("allowed_codes")
+    ceiling = raw.get("amount_ceiling")
+    return CompiledRuleSet(
+        amount_ceiling_cents=to_cents(ceiling) if ceiling is not None else None,
+        allowed_codes=frozenset(allowed) if allowed is not None else None,
+        require_code=bool(raw.get("require_code", False)),
+        item_limits=item_limits,
+    )
+
+
+def load_rules(path: Optional[str]) -> Dict[str, CompiledRuleSet]:
+    """Carrega e compila as regras por insurance_id a partir de um arquivo JSON"""
+    if not path:
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            raw_rules = json.load(f)
+    except FileNotFoundError:
+        logger.warning(f"Arquivo de regras de adjudicação não encontrado: {path}")
+        return {}
+    return {insurance_id: compile_ruleset(raw) for insurance_id, raw in raw_rules.items()}
+
+
+def evaluate_claim(rules: Dict[str, CompiledRuleSet], claim: ClaimTuple) -> Decision:
+    """Avalia um claim contra as regras do seu convênio"""
+    claim_id, insurance_id, amount_cents, items = claim
+    ruleset = rules.get(insurance_id) or rules.get(DEFAULT_RULESET_KEY)
+    if ruleset is None:
+        return claim_id, True, None
+
+    if ruleset.amount_ceiling_cents is not None and amount_cents > ruleset.amount_ceiling_cents:
+        return claim_id, False, "amount_ceiling_exceeded"
+
+    allowed_codes = ruleset.allowed_codes
+    item_limits = ruleset.item_limits
+    for code, unit_cents, quantity in items:
+        if code is None:
+            if ruleset.require_code:
+                return claim_id, False, "item_code_missing"
+            continue
+        if allowed_codes is not None and code not in allowed_codes:
+            return claim_id, False, f"code_not_covered:{code}"
+        limits = item_limits.get(code)
+        if limits is not None:
+            max_quantity, max_unit_cents = limits
+            if max_quantity is not None and quantity > max_quantity:
+                return claim_id, False, f"quantity_limit_exceeded:{code}"
+            if max_unit_cents is not None and unit_cents > max_unit_cents:
+                return claim_id, False, f"unit_value_exceeded:{code}"
+
+    return claim_id, True, None
+
+
+def evaluate_claims(rules: Dict[str, CompiledRuleSet], claims: List[ClaimTuple]) -> List[Decision]:
+    return [evaluate_claim(rules, claim) for claim in claims]
+
+
+# Regras do processo filho (enviadas uma única vez pelo initializer do pool)
+_worker_rules: Dict[str, CompiledRuleSet] = {}
+
+
+def _init_worker(rules: Dict[str, CompiledRuleSet]):
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _evaluate_chunk(claims: List[ClaimTuple]) -> List[Decision]:
+    return evaluate_claims(_worker_rules, claims)
+
+
+def claim_tuple_from_event(data: dict) -> ClaimTuple:
+    """Converte o payload de um evento ClaimSubmitted em ClaimTuple"""
+    return (
+        data["id"],
+        data.get("insuranceId"),
+        to_cents(data["amount"]),
+        tuple(
+            (item.get("code"), to_cents(item["value"]), int(item.get("quantity", 1)))
+            for item in data.get("items", [])
+        ),
+    )
+
+
+class ClaimAdjudicationWorker:
+    """Puxa claims pendentes em lotes, avalia as regras e aplica as transições em massa"""
+
+    def __init__(self, session_factories: Optional[Sequence[Callable[[], Session]]],
+                 rules: Dict[str, CompiledRuleSet],
+                 batch_size: int = 500, processes: int = 1,
+                 parallel_threshold: int = 2000, stale_after_seconds: int = 600):
+        # Uma fábrica de sessão por shard (índice = shard)
+        self.session_factories = list(session_factories or [])
+        self.rules = rules
+        self.batch_size = batch_size
+        self.processes = processes
+        self.parallel_threshold = parallel_threshold
+        self.stale_after_seconds = stale_after_seconds
+        self._pool = None
+
+    # Pool de processos ------------------------------------------------------
+
+    @property
+    def pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.processes <= 1:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                initializer=_init_worker,
+                initargs=(self.rules,)
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def evaluate(self, claims: List[ClaimTuple]) -> List[Decision]:
+        pool = self.pool
+        if pool is None or len(claims) < self.parallel_threshold:
+            return evaluate_claims(self.rules, claims)
+        chunk_size = max(1, len(claims) // (self.processes * 4))
+        chunks = [claims[i:i + chunk_size] for i in range(0, len(claims), chunk_size)]
+        decisions: List[Decision] = []
+        for result in pool.map(_evaluate_chunk, chunks):
+            decisions.extend(result)
+        return decisions
+
+    # Acesso ao banco ----------------------------------------------------------
+
+    def requeue_stale(self, db: Session) -> int:
+        """Devolve para pending claims presos em processing (worker que caiu no meio do lote)"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after_seconds)
+        result = db.execute(
+            update(Claim)
+            .where(Claim.status == ClaimStatus.PROCESSING, Claim.updated_at < cutoff)
+            .values(status=ClaimStatus.PENDING, version=Claim.version + 1),
+            execution_options={"synchronize_session": False}
+        )
+        db.commit()
+        if result.rowcount:
+            logger.warning(f"{result.rowcount} claims presos em processing devolvidos para pending")
+        return result.rowcount
+
+    def claim_batch(self, db: Session) -> List[str]:
+        """Reserva um lote de claims pendentes (SKIP LOCKED) movendo-os para processing"""
+        claim_ids = db.execute(
+            select(Claim.id)
+            .where(Claim.status == ClaimStatus.PENDING)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if claim_ids:
+            db.execute(
+                update(Claim)
+                .where(Claim.id.in_(claim_ids), Claim.status == ClaimStatus.PENDING)
+                .values(status=ClaimStatus.PROCESSING, version=Claim.version + 1),
+                execution_options={"synchronize_session": False}
+            )
+        db.commit()
+        return list(claim_ids)
+
+    def load_claims(self, db: Session, claim_ids: List[str]) -> List[ClaimTuple]:
+        """Carrega claims e itens do lote com duas queries (sem N+1)"""
+        items_by_claim: Dict[str, list] = {claim_id: [] for claim_id in claim_ids}
+        for claim_id, code, value, quantity in db.execute(
+            select(ClaimItem.claim_id, ClaimItem.code, ClaimItem.value, ClaimItem.quantity)
+            .where(ClaimItem.claim_id.in_(claim_ids))
+        ):
+            items_by_claim[claim_id].append((code, to_cents(value), quantity))
+
+        return [
+            (claim_id, insurance_id, to_cents(amount), tuple(items_by_claim[claim_id]))
+            for claim_id, insurance_id, amount in db.execute(
+                select(Claim.id, Claim.insurance_id, Claim.amount).where(Claim.id.in_(claim_ids))
+            )
+        ]
+
+    def apply_decisions(self, db: Session, decisions: List[Decision],
+                        from_status: ClaimStatus) -> Dict[str, int]:
+        """Aplica as decisões com um UPDATE por status de destino"""
+        approved = [claim_id for claim_id, ok, _ in decisions if ok]
+        rejected = [claim_id for claim_id, ok, _ in decisions if not ok]
+        counts = {"approved": 0, "rejected": 0}
+
+        for target, claim_ids in ((ClaimStatus.APPROVED, approved), (ClaimStatus.REJECTED, rejected)):
+            if not claim_ids:
+                continue
+            result = db.execute(
+                update(Claim)
+                .where(Claim.id.in_(claim_ids), Claim.status == from_status)
+                .values(status=target, version=Claim.version + 1),
+                execution_options={"synchronize_session": False}
+            )
+            counts[target.value] = result.rowcount
+        
+        patient_ids = []
+        if counts["approved"] or counts["rejected"]:
+            patient_ids = db.execute(
+                select(Claim.patient_id).where(Claim.id.in_([claim_id for claim_id, _, _ in decisions])).distinct()
+            ).scalars().all()
+            PatientSummaryService.recompute(db, patient_ids)
+        db.commit()
+        PatientSummaryService.invalidate(patient_ids)
+
+        for claim_id, ok, reason in decisions:
+            if not ok:
+                logger.info(f"Claim {claim_id} rejeitado na adjudicação: {reason}")
+        claims_adjudicated_total.labels(result="approved").inc(counts["approved"])
+        claims_adjudicated_total.labels(result="rejected").inc(counts["rejected"])
+        return counts
+
+    # Execução -------------------------------------------------------------------
+
+    def run_batch(self, db: Session) -> Dict[str, int]:
+        with adjudication_batch_duration_seconds.time():
+            claim_ids = self.claim_batch(db)
+            if not claim_ids:
+                return {"claimed": 0, "approved": 0, "rejected": 0}
+            decisions = self.evaluate(self.load_claims(db, claim_ids))
+            counts = self.apply_decisions(db, decisions, from_status=ClaimStatus.PROCESSING)
+            return {"claimed": len(claim_ids), **counts}
+
+    def run_once(self, max_batches: int = 100) -> Dict[str, float]:
+        """Drena claims pendentes de cada shard (até `max_batches` lotes por shard) e mede o throughput"""
+        totals = {"claimed": 0, "approved": 0, "rejected": 0}
+        start = time.perf_counter()
+        for session_factory in self.session_factories:
+            with session_factory() as db:
+                self.requeue_stale(db)
+                for _ in range(max_batches):
+                    stats = self.run_batch(db)
+                    for key in totals:
+                        totals[key] += stats[key]
+                    if stats["claimed"] < self.batch_size:
+                        break
+        return self._finish(totals, start)
+
+    def run_events(self, events: Iterable[List[dict]]) -> Dict[str, float]:
+        """Adjudica a partir de lotes de eventos ClaimSubmitted (dados já no payload)
+
+        A transição é condicionada a status = pending, então claims já reservados pelo
+        caminho do banco não são adjudicados duas vezes. As decisões de cada lote são
+        aplicadas no shard embutido no ID de cada claim.
+        """
+        totals = {"claimed": 0, "approved": 0, "rejected": 0}
+        start = time.perf_counter()
+        sessions: Dict[int, Session] = {}
+        try:
+            for batch in events:
+                claims = [
+                    claim_tuple_from_event(event["data"])
+                    for event in batch if event.get("eventType") == "ClaimSubmitted"
+                ]
+                if not claims:
+                    continue
+                by_shard: Dict[int, List[Decision]] = {}
+                for decision in self.evaluate(claims):
+                    by_shard.setdefault(shard_of_id(decision[0]), []).append(decision)
+                for shard, decisions in by_shard.items():
+                    if shard >= len(self.session_factories):
+                        logger.warning(f"{len(decisions)} claims de shard inexistente ({shard}) ignorados")
+                        continue
+                    if shard not in sessions:
+                        sessions[shard] = self.session_factories[shard]()
+                    counts = self.apply_decisions(sessions[shard], decisions, from_status=ClaimStatus.PENDING)
+                    totals["approved"] += counts["approved"]
+                    totals["rejected"] += counts["rejected"]
+                totals["claimed"] += len(claims)
+        finally:
+            for session in sessions.values():
+                session.close()
+        return self._finish(totals, start)
+
+    def _finish(self, totals: Dict[str, int], start: float) -> Dict[str, float]:
+        elapsed = time.perf_counter() - start
+        throughput = totals["claimed"] / elapsed if elapsed > 0 else 0.0
+        if totals["claimed"]:
+            adjudication_throughput.set(throughput)
+            logger.info(
+                f"Adjudicação: {totals['claimed']} claims em {elapsed:.2f}s "
+                f"({throughput:.0f} claims/s, {totals['approved']} aprovados, {totals['rejected']} rejeitados)"
+            )
+        return {**totals, "seconds": round(elapsed, 3), "claims_per_second": round(throughput, 1)}
+
+
+def build_worker(session_factories=None) -> ClaimAdjudicationWorker:
+    """Cria o worker a partir das Settings (um session factory por shard)"""
+    if session_factories is None:
+        session_factories = shards.session_factories
+    return ClaimAdjudicationWorker(
+        session_factories,
+        rules=load_rules(settings.ADJUDICATION_RULES_FILE),
+        batch_size=settings.ADJUDICATION_BATCH_SIZE,
+        processes=settings.ADJUDICATION_PROCESSES,
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.event_consumer import LocalEventConsumer
+
+    parser = argparse.ArgumentParser(description="Adjudicação de claims em lote")
+    parser.add_argument("--events", help="Arquivo JSON Lines com eventos ClaimSubmitted (stand-in do Kafka)")
+    parser.add_argument("--max-batches", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    worker = build_worker()
+    try:
+        if args.events:
+            consumer = LocalEventConsumer(args.events, batch_size=settings.ADJUDICATION_BATCH_SIZE)
+            print(worker.run_events(consumer.batches()))
+            consumer.commit()
+        else:
+            print(worker.run_once(max_batches=args.max_batches))
+    finally:
+        worker.close()
@@ -0,0 +1,439 @@
+"""
+Busca de claims por código TUSS e descrição dos itens
+
+Backends (SEARCH_BACKEND):
+    memory  - índice invertido em memória (padrão). Cada termo normalizado aponta para uma
+              lista ordenada de documentos (claims); filtros por convênio e data usam arrays
+              paralelos por documento. O índice acompanha a tabela claim_items de forma
+              incremental pela marca d'água ClaimItem.id de cada shard, relendo uma janela
+              abaixo da marca (SEARCH_INDEX_OVERLAP_IDS) para itens com commit fora de ordem.
+              O convênio também é um termo (@insurance_id), então o filtro é uma interseção;
+              para a data, cada bloco de BLOCK_SIZE documentos guarda o menor e o maior dia,
+              e blocos fora do intervalo são pulados sem examinar os documentos.
+    mysql   - índice FULLTEXT em claim_items(description, code) (migração 0006) consultado
+              com MATCH ... AGAINST em cada shard. Em outros bancos cai para o índice em memória.
+
+Cada worker mantém o seu índice em memória; o job claim_search_index faz a carga inicial
+(até lá a busca responde 503) e o catch-up periódico (SEARCH_INDEX_REFRESH_SECONDS), nunca
+a requisição. A atualização monta um estado novo e troca a referência: as buscas não
+esperam por ela. Com filtros ou vários termos, a contagem do total para depois de
+SEARCH_MAX_SCAN_DOCS documentos examinados (total_exact=false: o total é um piso).
+"""
+import re
+import heapq
+import bisect
+import logging
+import threading
+import unicodedata
+from array import array
+from itertools import islice
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from prometheus_client import Gauge, Histogram
+from app.config import settings
+from app.models import Claim, ClaimItem
+from app.sharding import shards
+from app.tracing import traced_service
+
+logger = logging.getLogger(__name__)
+
+claim_search_duration_seconds = Histogram(
+    'billing_claim_search_duration_seconds',
+    'Claim search latency (excluding result hydration)',
+    ['backend'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+)
+
+claim_search_index_items = Gauge(
+    'billing_claim_search_index_items',
+    'Claim items indexed by the in-memory search index'
+)
+
+claim_search_index_terms = Gauge(
+    'billing_claim_search_index_terms',
+    'Distinct terms in the in-memory search index'
+)
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset({"a", "o", "e", "de", "da", "do", "das", "dos", "em", "na", "no", "para", "com", "por"})
+# Prefixo dos termos de código exato (filtro `code`)
+CODE_PREFIX = "#"
+# Prefixo dos termos de convênio (filtro `insurance_id`)
+INSURER_PREFIX = "@"
+# Documentos por bloco no resumo de datas (menor/maior dia de cada bloco)
+BLOCK_BITS = 10
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    """Termos normalizados: minúsculas, sem acento, alfanuméricos, sem stopwords"""
+    if not value:
+        return []
+    normalized = unicodedata.normalize("NFKD", value.lower()).encode("ascii", "ignore").decode("ascii")
+    return [token for token in _TOKEN_PATTERN.findall(normalized) if token not in STOPWORDS]
+
+
+def _day(value) -> int:
+    return value.toordinal() if value else 0
+
+
+class _IndexState:
+    """Estado do índice; as buscas leem o estado publicado sem lock
+
+    Uma atualização trabalha sobre `copy()`, que é rasa: só o dicionário de termos é novo, e
+    cada lista de postings só é copiada quando o termo recebe documento novo (copy-on-write).
+    Os dados por documento (claim_id, convênio, dia) são só de acréscimo e compartilhados
+    entre os estados: um estado publicado só referencia, pelos postings, documentos que já
+    existiam quando foi montado, então acréscimos posteriores não mudam o que ele enxerga.
+    """
+
+    def __init__(self):
+        self.items = 0
+        self.postings: Dict[str, array] = {}
+        self.doc_claim_ids: List[str] = []
+        self.doc_by_claim: Dict[str, int] = {}
+        self.doc_day = array("i")
+        self.block_min_day = array("i")
+        self.block_max_day = array("i")
+        self._copied: set = set()
+
+    def copy(self) -> "_IndexState":
+        state = _IndexState()
+        state.items = self.items
+        state.postings = dict(self.postings)
+        state.doc_claim_ids = self.doc_claim_ids
+        state.doc_by_claim = self.doc_by_claim
+        state.doc_day = self.doc_day
+        state.block_min_day = self.block_min_day
+        state.block_max_day = self.block_max_day
+        return state
+
+    def _document(self, claim_id: str, insurance_id: Optional[str], created_at) -> int:
+        doc = self.doc_by_claim.get(claim_id)
+        if doc is None:
+            doc = self.doc_by_claim[claim_id] = len(self.doc_claim_ids)
+            self.doc_claim_ids.append(claim_id)
+            day = _day(created_at)
+            self.doc_day.append(day)
+            block = doc >> BLOCK_BITS
+            if block == len(self.block_min_day):
+                self.block_min_day.append(day)
+                self.block_max_day.append(day)
+            else:
+                # Só alarga o intervalo do bloco: estados publicados continuam corretos
+                self.block_min_day[block] = min(self.block_min_day[block], day)
+                self.block_max_day[block] = max(self.block_max_day[block], day)
+            if insurance_id is not None:
+                self._post(INSURER_PREFIX + insurance_id, doc)
+        return doc
+
+    def _post(self, term: str, doc: int):
+        postings = self.postings.get(term)
+        if postings is None:
+            self.postings[term] = array("i", (doc,))
+            self._copied.add(term)
+            return
+        if term not in self._copied:
+            postings = self.postings[term] = array("i", postings)
+            self._copied.add(term)
+        if postings[-1] < doc:
+            postings.append(doc)
+        elif postings[-1] != doc:
+            # Item novo de um claim antigo: mantém a lista ordenada
+            index = bisect.bisect_left(postings, doc)
+            if index == len(postings) or postings[index] != doc:
+                postings.insert(index, doc)
+
+    def add_item(self, item_id: int, claim_id: str, insurance_id: Optional[str], created_at,
+                 code: Optional[str], description: Optional[str]):
+        doc = self._document(claim_id, insurance_id, created_at)
+        terms = set(tokenize(description)) | set(tokenize(code))
+        if code:
+            terms.add(CODE_PREFIX + code.strip())
+        for term in terms:
+            self._post(term, doc)
+        self.items += 1
+
+
+class ClaimSearchIndex:
+    """Índice invertido em memória de claim_items (termo -> claims)
+
+    A atualização monta um estado novo fora de qualquer lock de leitura e troca a referência
+    no final; as buscas usam o estado publicado no momento e nunca esperam o catch-up.
+    A carga inicial é feita pelo job em background; até lá o índice não está pronto.
+    """
+
+    def __init__(self, batch_size: int = 5000, overlap_ids: int = 1000, max_scan_docs: int = 10000):
+        self.batch_size = batch_size
+        # Depois de montar a página, para de contar o total após examinar esse número de documentos
+        self.max_scan_docs = max_scan_docs
+        # Itens com id abaixo da marca d'água podem ficar visíveis depois (ids alocados no
+        # INSERT, commits fora de ordem): cada catch-up relê essa janela abaixo da marca
+        self.overlap_ids = overlap_ids
+        self.watermarks: Dict[int, int] = {}  # maior ClaimItem.id indexado, por shard
+        self._recent: Dict[int, set] = {}  # ids já indexados dentro da janela, por shard
+        self._state = _IndexState()
+        self._ready = False
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    @property
+    def items(self) -> int:
+        return self._state.items
+
+    # Escrita ----------------------------------------------------------------
+
+    def add_items(self, rows) -> int:
+        """Indexa linhas (id, claim_id, insurance_id, created_at, code, description) e publica"""
+        with self._refresh_lock:
+            state = self._state.copy()
+            for row in rows:
+                state.add_item(*row)
+            self._publish(state)
+            return state.items
+
+    def _publish(self, state: _IndexState):
+        state._copied = set()
+        self._state = state
+        claim_search_index_items.set(state.items)
+        claim_search_index_terms.set(len(state.postings))
+
+    def refresh(self, db: Session) -> int:
+        """Indexa os itens novos de cada shard (catch-up incremental) e publica o estado novo
+
+        Relê `overlap_ids` abaixo da marca d'água; ids já indexados na janela são ignorados.
+        """
+        with self._refresh_lock:
+            return self._refresh(db)
+
+    def _refresh(self, db: Session) -> int:
+        state: Optional[_IndexState] = None
+        watermarks = dict(self.watermarks)
+        recent = {shard: set(ids) for shard, ids in self._recent.items()}
+        indexed = 0
+        for shard in range(shards.count):
+            session = shards.session_for_shard(db, shard, mode="scatter")
+            seen = recent.setdefault(shard, set())
+            cursor = max(0, watermarks.get(shard, 0) - self.overlap_ids)
+            while True:
+                rows = self._fetch_batch(session, cursor)
+                for row in rows:
+                    if row.id in seen:
+                        continue
+                    if state is None:
+                        state = self._state.copy()
+                    state.add_item(*row)
+                    seen.add(row.id)
+                    indexed += 1
+                if rows:
+                    cursor = rows[-1].id
+                    watermarks[shard] = max(watermarks.get(shard, 0), cursor)
+                    floor = watermarks[shard] - self.overlap_ids
+                    seen = recent[shard] = {item_id for item_id in seen if item_id > floor}
+                if len(rows) < self.batch_size:
+                    break
+
+        if state is not None:
+            self._publish(state)
+        self.watermarks, self._recent = watermarks, recent
+        self._ready = True
+        if indexed:
+            logger.info(f"Índice de busca de claims: {indexed} itens novos (watermarks {watermarks})")
+        return indexed
+
+    def _fetch_batch(self, db: Session, after_id: int):
+        return db.execute(
+            select(
+                ClaimItem.id, ClaimItem.claim_id, Claim.insurance_id, Claim.created_at,
+                ClaimItem.code, ClaimItem.description
+            )
+            .join(Claim, Claim.id == ClaimItem.claim_id)
+            .where(ClaimItem.id > after_id)
+            .order_by(ClaimItem.id)
+            .limit(self.batch_size)
+        ).all()
+
+    # Leitura ----------------------------------------------------------------
+
+    def search(self, terms: List[str], code: Optional[str] = None, insurance_id: Optional[str] = None,
+               date_from: Optional[date] = None, date_to: Optional[date] = None,
+               limit: int = 50, offset: int = 0) -> Tuple[int, bool, List[str]]:
+        """Claims que contêm todos os termos (AND), do mais recente para o mais antigo
+
+        A ordem é a de indexação: com vários shards, aproximadamente a de criação.
+        Um único termo sem filtro de data é respondido direto da lista de postings. Nos
+        demais casos a lista mais curta é percorrida (pulando blocos fora das datas) até
+        preencher a página e, depois disso, até `max_scan_docs` documentos examinados; se
+        parar antes do fim, o total é um piso.
+
+        Retorna (total de claims encontrados, se o total é exato, página de claim_ids).
+        """
+        terms = list(dict.fromkeys(terms))
+        if code:
+            terms.append(CODE_PREFIX + code.strip())
+        if not terms:
+            return 0, True, []
+        if insurance_id is not None:
+            terms.append(INSURER_PREFIX + insurance_id)
+
+        state = self._state
+        postings = [state.postings.get(term) for term in terms]
+        if any(p is None for p in postings):
+            return 0, True, []
+        postings.sort(key=len)
+        shortest, others = postings[0], postings[1:]
+
+        day_from = date_from.toordinal() if date_from else None
+        day_to = date_to.toordinal() if date_to else None
+        doc_claim_ids = state.doc_claim_ids
+
+        if not others and day_from is None and day_to is None:
+            end = max(0, len(shortest) - offset)
+            docs = shortest[max(0, end - limit):end]
+            return len(shortest), True, [doc_claim_ids[doc] for doc in reversed(docs)]
+
+        dated = day_from is not None or day_to is not None
+        low = day_from if day_from is not None else 0
+        high = day_to if day_to is not None else 2 ** 31 - 1
+        doc_day, block_min_day, block_max_day = state.doc_day, state.block_min_day, state.block_max_day
+        total = 0
+        scanned = 0
+        page_end = offset + limit
+        page: List[str] = []
+        position = len(shortest) - 1
+        while position >= 0:
+            if total >= page_end and scanned >= self.max_scan_docs:
+                return total, False, page
+            doc = shortest[position]
+            if dated:
+                block = doc >> BLOCK_BITS
+                if block_max_day[block] < low or block_min_day[block] > high:
+                    # Bloco inteiro fora do intervalo: volta para o posting anterior ao bloco
+                    position = bisect.bisect_left(shortest, block << BLOCK_BITS, 0, position) - 1
+                    continue
+            position -= 1
+            scanned += 1
+            if dated and not low <= doc_day[doc] <= high:
+                continue
+            matched = True
+            for other in others:
+                index = bisect.bisect_left(other, doc)
+                if index == len(other) or other[index] != doc:
+                    matched = False
+                    break
+            if not matched:
+                continue
+            if offset <= total < page_end:
+                page.append(doc_claim_ids[doc])
+            total += 1
+        return total, True, page
+
+
+def _search_fulltext(db: Session, terms: List[str], code: Optional[str], insurance_id: Optional[str],
+                     date_from: Optional[date], date_to: Optional[date],
+                     limit: int, offset: int) -> Tuple[int, List[str]]:
+    """Busca via índice FULLTEXT do MySQL
+
+    Como no índice em memória, cada termo pode estar em qualquer item do claim: um
+    semi-join (claim_id IN ...) por termo, cada um resolvido pelo FULLTEXT. Cada shard
+    devolve os offset+limit mais recentes e a página sai do merge por created_at.
+    """
+    conditions = [
+        Claim.id.in_(
+            select(ClaimItem.claim_id).where(
+                text(f"MATCH (claim_items.description, claim_items.code) AGAINST (:term_{i} IN BOOLEAN MODE)")
+                .bindparams(**{f"term_{i}": f"+{term}"})
+            )
+        )
+        for i, term in enumerate(terms)
+    ]
+    if code:
+        conditions.append(Claim.id.in_(select(ClaimItem.claim_id).where(ClaimItem.code == code.strip())))
+    if insurance_id is not None:
+        conditions.append(Claim.insurance_id == insurance_id)
+    if date_from:
+        conditions.append(Claim.created_at >= date_from)
+    if date_to:
+        conditions.append(Claim.created_at < date.fromordinal(date_to.toordinal() + 1))
+
+    def query(session: Session, shard: int):
+        total = session.execute(select(func.count()).select_from(Claim).where(*conditions)).scalar()
+        rows = session.execute(
+            select(Claim.created_at, Claim.id)
+            .where(*conditions)
+            .order_by(Claim.created_at.desc(), Claim.id.desc())
+            .limit(offset + limit)
+        ).all()
+        return total, [tuple(row) for row in rows]
+
+    results = shards.scatter(db, query, operation="claim_search")
+    total = sum(shard_total for shard_total, _ in results)
+    merged = heapq.merge(*(rows for _, rows in results), reverse=True)
+    return total, [claim_id for _, claim_id in islice(merged, offset, offset + limit)]
+
+
+@traced_service
+class ClaimSearchService:
+    @staticmethod
+    def backend(db: Session) -> str:
+        if settings.SEARCH_BACKEND == "mysql" and db.get_bind().dialect.name == "mysql":
+            return "mysql"
+        return "memory"
+
+    @staticmethod
+    def search(db: Session, q: Optional[str] = None, code: Optional[str] = None,
+               insurance_id: Optional[str] = None, date_from: Optional[date] = None,
+               date_to: Optional[date] = None, limit: int = 50,
+               offset: int = 0) -> Tuple[int, bool, List[Claim], str]:
+        """Busca claims por termos da descrição/código dos itens, com filtros por convênio e data
+
+        Retorna (total, se o total é exato, claims da página, backend).
+        """
+        terms = tokenize(q)
+        backend = ClaimSearchService.backend(db)
+        with claim_search_duration_seconds.labels(backend=backend).time():
+            if backend == "mysql":
+                total, claim_ids = _search_fulltext(db, terms, code, insurance_id, date_from, date_to, limit, offset)
+                exact = True
+            else:
+                if not claim_search_index.ready:
+                    # Carga inicial só no job em background, nunca dentro da requisição
+                    raise HTTPException(
+                        status_code=503,
+                        detail={"error": "Search index not ready", "message": "Índice de busca em construção"},
+                        headers={"Retry-After": str(settings.SEARCH_INDEX_REFRESH_SECONDS)}
+                    )
+                total, exact, claim_ids = claim_search_index.search(
+                    terms, code, insurance_id, date_from, date_to, limit, offset
+                )
+
+        if not claim_ids:
+            return total, exact, [], backend
+        groups = shards.group_ids(claim_ids)
+        claims = {}
+        for rows in shards.scatter(
+            db,
+            lambda session, shard: session.query(Claim).filter(Claim.id.in_(groups[shard])).all(),
+            operation="claim_search_hydrate",
+            shards=groups
+        ):
+            claims.update((claim.id, claim) for claim in rows)
+        return total, exact, [claims[claim_id] for claim_id in claim_ids if claim_id in claims], backend
+
+    @staticmethod
+    def refresh_index():
+        """Catch-up periódico do índice em memória (job em background)"""
+        from app.database import SessionLocal
+        with SessionLocal() as db:
+            return claim_search_index.refresh(db)
+
+
+# Instância global
+claim_search_index = ClaimSearchIndex(
+    overlap_ids=settings.SEARCH_INDEX_OVERLAP_IDS, max_scan_docs=settings.SEARCH_MAX_SCAN_DOCS
+)
@@ -1,18 +1,42 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from typing import Optional, List
+from sqlalchemy import and_, select, update
+from fastapi import HTTPException
+from typing import Optional, List, Dict, Sequence
 from datetime import datetime
 import uuid
 from app.models import Claim, ClaimItem, ClaimStatus
 from app.schemas import ClaimCreate, ClaimUpdate, ClaimItemCreate
+from app import deadline
 from app.kafka_producer import kafka_producer
+from app.services.patient_summary import PatientSummaryService, SummaryDelta
+from app.database import read_only
+from app.sharding import shards
+from app.tracing import traced_service
 
 
+# Campos selecionáveis na listagem (?fields=)
+CLAIM_LIST_COLUMNS = {
+    "id": Claim.id,
+    "patient_id": Claim.patient_id,
+    "insurance_id": Claim.insurance_id,
+    "amount": Claim.amount,
+    "currency": Claim.currency,
+    "status": Claim.status,
+    "version": Claim.version,
+    "created_at": Claim.created_at,
+}
+
+CLAIM_ITEM_COLUMNS = (ClaimItem.claim_id, ClaimItem.description, ClaimItem.code, ClaimItem.value, ClaimItem.quantity)
+
+
+@traced_service
 class ClaimService:
     @staticmethod
     def create_claim(db: Session, claim_data: ClaimCreate) -> Claim:
-        """Cria um novo claim"""
-        claim_id = f"CLM{uuid.uuid4().hex[:6].upper()}"
+        """Cria um novo claim no shard do paciente (o shard vai embutido no ID)"""
+        shard = shards.shard_for_patient(claim_data.patient_id)
+        claim_id = shards.new_id("CLM", shard, uuid.uuid4().hex)
+        db = shards.session_for_shard(db, shard, mode="patient")
         
         # Criar claim
         claim = Claim(
@@ -37,11 +61,17 @@ class ClaimService:
             )
             db.add(item)
         
+        PatientSummaryService.apply_deltas(
+            db, {claim.patient_id: SummaryDelta(open_claims=1, total_claims=1)}
+        )
         db.commit()
-        db.refresh(claim)
+        PatientSummaryService.invalidate([claim_data.patient_id])
+        # Claim confirmado: as releituras para o evento não são interrompidas pelo deadline
+        with deadline.suspended():
+            db.refresh(claim)
+            claim_items = db.query(ClaimItem).filter(ClaimItem.claim_id == claim_id).all()
         
         # Publicar evento ClaimSubmitted
-        claim_items = db.query(ClaimItem).filter(ClaimItem.claim_id == claim_id).all()
         event_data = {
             "id": claim_id,
             "patientId": claim.patient_id,
@@ -65,48 +95,126 @@ class ClaimService:
         return claim
     
     @staticmethod
+    @read_only
     def get_claim(db: Session, claim_id: str) -> Optional[Claim]:
         """Busca um claim por ID"""
+        db = shards.session_for_id(db, claim_id)
+        if db is None:
+            return None
         return db.query(Claim).filter(Claim.id == claim_id).first()
     
     @staticmethod
+    @read_only
     def get_claims(
         db: Session,
         patient_id: Optional[str] = None,
         status: Optional[ClaimStatus] = None,
         skip: int = 0,
-        limit: int = 100
+        limit: int = 100,
+        columns: Optional[Sequence] = None,
+        after_id: Optional[str] = None
     ) -> List[Claim]:
-        """Lista claims com filtros opcionais"""
-        query = db.query(Claim)
+        """Lista claims com filtros opcionais, ordenados por id
+
+        Com `columns`, seleciona só essas colunas e retorna Rows em vez de entidades.
+        Com patient_id a consulta vai ao shard do paciente; sem, é feita em todos os
+        shards e os resultados são intercalados por id. `after_id` pagina por cursor
+        (id > after_id), sem OFFSET em cada shard.
+        """
+        def query(session: Session, cursor: Optional[str], offset: int, count: int):
+            query = session.query(*columns) if columns else session.query(Claim)
+            if cursor:
+                query = query.filter(Claim.id > cursor)
+            if patient_id:
+                query = query.filter(Claim.patient_id == patient_id)
+            if status:
+                query = query.filter(Claim.status == status)
+            return query.order_by(Claim.id).offset(offset).limit(count).all()
         
         if patient_id:
-            query = query.filter(Claim.patient_id == patient_id)
-        if status:
-            query = query.filter(Claim.status == status)
-        
-        return query.offset(skip).limit(limit).all()
+            return query(shards.session_for_patient(db, patient_id), after_id, skip, limit)
+        return shards.scatter_merge(db, query, skip, limit, after_id=after_id, operation="get_claims")
     
     @staticmethod
     def update_claim(db: Session, claim_id: str, claim_update: ClaimUpdate) -> Optional[Claim]:
-        """Atualiza um claim"""
-        claim = db.query(Claim).filter(Claim.id == claim_id).first()
-        if not claim:
+        """Atualiza um claim com um único UPDATE condicional (sem SELECT prévio)
+
+        Com `version` informada, o UPDATE só casa se a versão ainda for a atual
+        (WHERE id = ? AND version = ?); caso contrário responde 409.
+        """
+        db = shards.session_for_id(db, claim_id)
+        if db is None:
             return None
-        
+        values = {}
         if claim_update.status:
-            claim.status = claim_update.status
+            values["status"] = claim_update.status
         if claim_update.insurance_id is not None:
-            claim.insurance_id = claim_update.insurance_id
+            values["insurance_id"] = claim_update.insurance_id
         
-        db.commit()
-        db.refresh(claim)
-        return claim
+        if values:
+            statement = update(Claim).where(Claim.id == claim_id)
+            if claim_update.version is not None:
+                statement = statement.where(Claim.version == claim_update.version)
+            result = db.execute(
+                statement.values(**values, version=Claim.version + 1),
+                execution_options={"synchronize_session": False}
+            )
+            patient_id = None
+            if result.rowcount and "status" in values:
+                # Transição arbitrária: recalcula o resumo do paciente na mesma transação
+                patient_id = db.execute(select(Claim.patient_id).where(Claim.id == claim_id)).scalar()
+                PatientSummaryService.recompute(db, [patient_id])
+            db.commit()
+            if patient_id:
+                PatientSummaryService.invalidate([patient_id])
+            
+            if result.rowcount == 0:
+                current = db.query(Claim).filter(Claim.id == claim_id).first()
+                if current is None:
+                    return None
+                raise HTTPException(
+                    status_code=409,
+                    detail={
+                        "error": "Version conflict",
+                        "message": "Claim foi alterado por outra requisição. Releia e tente novamente.",
+                        "current_version": current.version
+                    }
+                )
+        
+        return db.query(Claim).filter(Claim.id == claim_id).populate_existing().first()
     
     @staticmethod
+    @read_only
     def get_claim_items(db: Session, claim_id: str) -> List[ClaimItem]:
         """Busca itens de um claim"""
+        db = shards.session_for_id(db, claim_id)
+        if db is None:
+            return []
         return db.query(ClaimItem).filter(ClaimItem.claim_id == claim_id).all()
+    
+    @staticmethod
+    @read_only
+    def get_items_by_claim(db: Session, claim_ids: Sequence[str]) -> Dict[str, list]:
+        """Itens de vários claims com uma consulta (IN) por shard, agrupados por claim_id"""
+        items = {claim_id: [] for claim_id in claim_ids}
+        if not items:
+            return items
+        groups = shards.group_ids(items)
+        results = shards.scatter(
+            db,
+            lambda session, shard: (
+                session.query(*CLAIM_ITEM_COLUMNS)
+                .filter(ClaimItem.claim_id.in_(groups[shard]))
+                .order_by(ClaimItem.claim_id, ClaimItem.id)
+                .all()
+            ),
+            operation="get_items_by_claim",
+            shards=groups
+        )
+        for rows in results:
+            for row in rows:
+                items[row.claim_id].append(row)
+        return items
 
 
 
@@ -0,0 +1,276 @@
+"""
+Regras de cobertura por convênio para verificação de elegibilidade
+
+As regras de cada insurance_id (planos, carências por procedimento, exclusões) são
+compiladas em tabelas de decisão: dicts e frozensets consultados em tempo constante,
+com as mensagens de resposta pré-montadas. Uma verificação faz no máximo quatro
+lookups, independente do tamanho das regras.
+
+Formato do arquivo (COVERAGE_RULES_FILE):
+    {
+      "UNIMED-001": {
+        "default_plan": "BASICO",
+        "plans": {
+          "BASICO": {
+            "active": true,
+            "waiting_period_days": {"*": 30, "40301630": 180},
+            "excluded_codes": ["30602017"]
+          }
+        }
+      }
+    }
+
+Benchmark:
+    python -m app.services.coverage_rules --benchmark 1000000
+"""
+import os
+import json
+import time
+import random
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Chave de carência padrão dentro de waiting_period_days
+DEFAULT_WAITING_KEY = "*"
+
+# Decisões pré-montadas (evita alocar strings por verificação)
+ELIGIBLE = (True, "Paciente elegível para o procedimento")
+NO_RULES = ELIGIBLE
+UNKNOWN_PLAN = (False, "Plano não reconhecido pelo convênio")
+INACTIVE_PLAN = (False, "Plano inativo")
+EXCLUDED_PROCEDURE = (False, "Procedimento excluído da cobertura do plano")
+WAITING_PERIOD = (False, "Procedimento em período de carência")
+
+Decision = Tuple[bool, str]
+# (insurance_id, plan_code, procedure_code, enrolled_at, check_date)
+CoverageQuery = Tuple[str, Optional[str], Optional[str], Optional[date], Optional[date]]
+
+
+@dataclass(frozen=True)
+class CompiledPlan:
+    active: bool
+    default_waiting_days: int
+    waiting_days_by_code: Dict[str, int]
+    excluded_codes: FrozenSet[str]
+
+
+@dataclass(frozen=True)
+class CompiledCoverage:
+    default_plan: Optional[str]
+    plans: Dict[str, CompiledPlan]
+
+
+def _expect(value, kind, where: str):
+    """Valida o tipo de um trecho do arquivo de regras (ValueError com o caminho do erro)"""
+    if not isinstance(value, kind):
+        raise ValueError(f"{where}: esperado {getattr(kind, '__name__', kind)}, recebido {type(value).__name__}")
+    return value
+
+
+def _days(value, where: str) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"{where}: carência deve ser um inteiro >= 0, recebido {value!r}")
+    return value
+
+
+def compile_coverage(raw: dict, where: str = "") -> CompiledCoverage:
+    _expect(raw, dict, where or "convênio")
+    plans = {}
+    for plan_code, plan in _expect(raw.get("plans") or {}, dict, f"{where}.plans").items():
+        plan_where = f"{where}.plans.{plan_code}"
+        _expect(plan, dict, plan_where)
+        waiting = dict(_expect(plan.get("waiting_period_days") or {}, dict, f"{plan_where}.waiting_period_days"))
+        default_waiting = _days(waiting.pop(DEFAULT_WAITING_KEY, 0), f"{plan_where}.waiting_period_days.*")
+        excluded = _expect(plan.get("excluded_codes") or [], list, f"{plan_where}.excluded_codes")
+        plans[plan_code] = CompiledPlan(
+            active=bool(plan.get("active", True)),
+            default_waiting_days=default_waiting,
+            waiting_days_by_code={
+                code: _days(days, f"{plan_where}.waiting_period_days.{code}") for code, days in waiting.items()
+            },
+            excluded_codes=frozenset(str(code) for code in excluded),
+        )
+    default_plan = raw.get("default_plan")
+    if default_plan is not None:
+        _expect(default_plan, str, f"{where}.default_plan")
+    return CompiledCoverage(default_plan=default_plan, plans=plans)
+
+
+def compile_rules(raw_rules: dict) -> Dict[str, CompiledCoverage]:
+    """Compila o arquivo inteiro; ValueError (com o caminho) se a estrutura for inválida"""
+    _expect(raw_rules, dict, "regras")
+    return {insurance_id: compile_coverage(raw, insurance_id) for insurance_id, raw in raw_rules.items()}
+
+
+def evaluate(rules: Dict[str, CompiledCoverage], insurance_id: str,
+             plan_code: Optional[str] = None, procedure_code: Optional[str] = None,
+             enrolled_at: Optional[date] = None, check_date: Optional[date] = None) -> Decision:
+    """Avalia uma verificação de cobertura em tempo constante"""
+    coverage = rules.get(insurance_id)
+    if coverage is None:
+        return NO_RULES
+
+    plan = coverage.plans.get(plan_code or coverage.default_plan)
+    if plan is None:
+        return UNKNOWN_PLAN
+    if not plan.active:
+        return INACTIVE_PLAN
+
+    if procedure_code is not None:
+        if procedure_code in plan.excluded_codes:
+            return EXCLUDED_PROCEDURE
+        waiting_days = plan.waiting_days_by_code.get(procedure_code, plan.default_waiting_days)
+    else:
+        waiting_days = plan.default_waiting_days
+
+    if waiting_days and enrolled_at is not None:
+        check_date = check_date or date.today()
+        if (check_date - enrolled_at).days < waiting_days:
+            return WAITING_PERIOD
+
+    return ELIGIBLE
+
+
+def evaluate_batch(rules: Dict[str, CompiledCoverage], queries: Iterable[CoverageQuery]) -> List[Decision]:
+    """Avalia várias verificações contra o mesmo snapshot de regras"""
+    today = date.today()
+    return [
+        evaluate(rules, insurance_id, plan_code, procedure_code, enrolled_at, check_date or today)
+        for insurance_id, plan_code, procedure_code, enrolled_at, check_date in queries
+    ]
+
+
+class CoverageRulesRegistry:
+    """Mantém as regras compiladas e recarrega o arquivo quando ele muda (hot reload)
+
+    A troca é atômica: o dict compilado inteiro é substituído de uma vez, então
+    verificações em andamento continuam usando o snapshot que já tinham.
+    """
+
+    def __init__(self, path: Optional[str], check_interval_seconds: float = 5.0):
+        self.path = path
+        self.check_interval_seconds = check_interval_seconds
+        self._rules: Dict[str, CompiledCoverage] = {}
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rules(self) -> Dict[str, CompiledCoverage]:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._maybe_reload(now)
+        return self._rules
+
+    def _maybe_reload(self, now: float):
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.check_interval_seconds
+            if not self.path:
+                return
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                return
+            if mtime != self._mtime:
+                self.reload()
+                self._mtime = mtime
+        finally:
+            self._lock.release()
+
+    def reload(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                compiled = compile_rules(json.load(f))
+        except (OSError, ValueError, TypeError, AttributeError, KeyError) as e:
+            # Mantém as regras anteriores se o arquivo novo estiver inválido
+            logger.error(f"Erro ao carregar regras de cobertura de {self.path}: {e}")
+            return
+        self._rules = compiled
+        logger.info(f"Regras de cobertura carregadas: {len(compiled)} convênios")
+
+    def load(self, raw_rules: dict):
+        """Substitui as regras a partir de um dict (ex.: vindo de outra fonte)"""
+        self._rules = compile_rules(raw_rules)
+
+    def evaluate(self, insurance_id: str, plan_code: Optional[str] = None,
+                 procedure_code: Optional[str] = None, enrolled_at: Optional[date] = None,
+                 check_date: Optional[date] = None) -> Decision:
+        return evaluate(self.rules, insurance_id, plan_code, procedure_code, enrolled_at, check_date)
+
+    def evaluate_batch(self, queries: Iterable[CoverageQuery]) -> List[Decision]:
+        return evaluate_batch(self.rules, queries)
+
+
+# Instância global
+coverage_rules = CoverageRulesRegistry(settings.COVERAGE_RULES_FILE, settings.COVERAGE_RULES_RELOAD_SECONDS)
+
+
+def benchmark(evaluations: int = 1_000_000, insurers: int = 50, plans: int = 5,
+              codes: int = 2000, seed: int = 42) -> dict:
+    """Mede o throughput de avaliação com regras sintéticas"""
+    rng = random.Random(seed)
+    code_pool = [f"{40000000 + i}" for i in range(codes)]
+    raw_rules = {
+        f"INS{i:03d}": {
+            "default_plan": "P0",
+            "plans": {
+                f"P{p}": {
+                    "active": p != plans - 1,
+                    "waiting_period_days": {
+                        "*": 30, **{code: 180 for code in rng.sample(code_pool, codes // 10)}
+                    },
+                    "excluded_codes": rng.sample(code_pool, codes // 20),
+                }
+                for p in range(plans)
+            },
+        }
+        for i in range(insurers)
+    }
+    rules = compile_rules(raw_rules)
+    today = date.today()
+    queries = [
+        (
+            f"INS{rng.randrange(insurers + 5):03d}",
+            f"P{rng.randrange(plans + 1)}",
+            rng.choice(code_pool),
+            date.fromordinal(today.toordinal() - rng.randrange(400)),
+            today,
+        )
+        for _ in range(min(evaluations, 100_000))
+    ]
+
+    start = time.perf_counter()
+    done = 0
+    while done < evaluations:
+        chunk = queries[:evaluations - done]
+        evaluate_batch(rules, chunk)
+        done += len(chunk)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "evaluations": evaluations,
+        "seconds": round(elapsed, 3),
+        "evaluations_per_second": round(evaluations / elapsed),
+        "ns_per_evaluation": round(elapsed / evaluations * 1e9),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Regras de cobertura de elegibilidade")
+    parser.add_argument("--benchmark", type=int, nargs="?", const=1_000_000,
+                        help="Executa N avaliações sintéticas (padrão: 1.000.000)")
+    args = parser.parse_args()
+    if args.benchmark:
+        print(benchmark(args.benchmark))
+    else:
+        parser.print_help()
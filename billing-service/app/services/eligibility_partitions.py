@@ -0,0 +1,268 @@
+"""
+Particionamento mensal de eligibility_checks (RANGE por checked_at) e job de retenção
+
+No MySQL a tabela é particionada por RANGE (TO_DAYS(checked_at)), uma partição por mês
+(pYYYYMM) mais a partição pmax. Em outros bancos (SQLite em desenvolvimento/testes) o
+layout é emulado: cada mês com dados é tratado como uma partição lógica, e dropar a
+partição equivale a apagar o intervalo de datas.
+"""
+import os
+import gzip
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import text, select
+from sqlalchemy.engine import Connection, Engine
+from prometheus_client import Counter, Gauge
+from app.models import EligibilityCheck
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = EligibilityCheck.__tablename__
+RETENTION_LOCK_NAME = "billing:eligibility_checks:retention"
+
+eligibility_partitions_total = Gauge(
+    'billing_eligibility_partitions',
+    'Monthly partitions currently present in eligibility_checks'
+)
+
+eligibility_partitions_archived_total = Counter(
+    'billing_eligibility_partitions_archived_total',
+    'Eligibility partitions archived and dropped by the retention job'
+)
+
+eligibility_rows_archived_total = Counter(
+    'billing_eligibility_rows_archived_total',
+    'Eligibility check rows written to archive files'
+)
+
+
+def month_start(value: datetime) -> datetime:
+    """Primeiro instante do mês de `value`"""
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    """Soma meses a um início de mês"""
+    index = value.year * 12 + (value.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"p{start.year:04d}{start.month:02d}"
+
+
+def parse_partition_name(name: str) -> Optional[datetime]:
+    if len(name) != 7 or not name.startswith("p") or not name[1:].isdigit():
+        return None
+    return datetime(int(name[1:5]), int(name[5:7]), 1)
+
+
+def history_windows(now: datetime, recent_months: int) -> List[Tuple[Optional[datetime], Optional[datetime]]]:
+    """Janelas [início, fim) consultadas pelo histórico, da mais recente para a mais antiga
+
+    A primeira janela cobre o mês corrente e os `recent_months` anteriores (poda para
+    poucas partições); a segunda, tudo o que for mais antigo e só é lida se a primeira
+    não preencher o limite pedido.
+    """
+    recent_start = add_months(month_start(now), -recent_months)
+    return [(recent_start, None), (None, recent_start)]
+
+
+@dataclass
+class PartitionInfo:
+    name: str
+    start: datetime
+    end: datetime  # exclusivo
+
+
+class EligibilityPartitionManager:
+    """Cria, arquiva e remove partições mensais de eligibility_checks"""
+
+    def __init__(self, engine: Engine, archive_dir: str, retention_months: int,
+                 partitions_ahead: int = 2, chunk_size: int = 5000):
+        self.engine = engine
+        self.archive_dir = archive_dir
+        self.retention_months = retention_months
+        self.partitions_ahead = partitions_ahead
+        self.chunk_size = chunk_size
+        self._warned_unpartitioned = False
+
+    @property
+    def native(self) -> bool:
+        """True quando o banco suporta particionamento nativo (MySQL)"""
+        return self.engine.dialect.name == "mysql"
+
+    # Listagem ---------------------------------------------------------------
+
+    def _native_partition_names(self, conn: Connection) -> List[str]:
+        return conn.execute(text(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+            "AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION"
+        ), {"table": TABLE_NAME}).scalars().all()
+
+    def is_partitioned(self, conn: Connection) -> bool:
+        """No MySQL, True só se a migração 0003 já particionou a tabela (com a partição pmax)
+
+        A tabela criada pelo create_all da aplicação não é particionada; o particionamento
+        vem de `alembic upgrade head`.
+        """
+        if not self.native:
+            return True
+        return "pmax" in self._native_partition_names(conn)
+
+    def list_partitions(self, conn: Connection) -> List[PartitionInfo]:
+        if self.native:
+            starts = [parse_partition_name(name) for name in self._native_partition_names(conn)]
+        else:
+            months = conn.execute(text(
+                f"SELECT DISTINCT strftime('%Y%m', checked_at) FROM {TABLE_NAME} "
+                "WHERE checked_at IS NOT NULL ORDER BY 1"
+            )).scalars().all()
+            starts = [parse_partition_name(f"p{month}") for month in months]
+
+        partitions = [
+            PartitionInfo(name=partition_name(start), start=start, end=add_months(start, 1))
+            for start in starts if start is not None
+        ]
+        eligibility_partitions_total.set(len(partitions))
+        return partitions
+
+    # Criação ----------------------------------------------------------------
+
+    def ensure_future_partitions(self, conn: Connection, now: datetime) -> List[str]:
+        """Garante partições mensais até `partitions_ahead` meses à frente do mês corrente
+
+        Cria, em ordem, todos os meses que faltam depois da última partição mensal: com o job
+        parado por meses, cada mês ganha a sua partição em vez de um único mês corrente
+        acumulando os anteriores (que a retenção depois apagaria sem ter arquivado).
+        """
+        if not self.native:
+            return []
+
+        existing = self.list_partitions(conn)
+        created = []
+        current = month_start(now)
+        start = add_months(existing[-1].start, 1) if existing else current
+        last = add_months(current, self.partitions_ahead)
+        while start <= last:
+            name = partition_name(start)
+            end = add_months(start, 1)
+            # Divide a pmax: a nova partição fica imediatamente antes dela
+            conn.execute(text(
+                f"ALTER TABLE {TABLE_NAME} REORGANIZE PARTITION pmax INTO ("
+                f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{end:%Y-%m-%d}')), "
+                "PARTITION pmax VALUES LESS THAN MAXVALUE)"
+            ))
+            created.append(name)
+            logger.info(f"Partição {name} criada em {TABLE_NAME}")
+            start = end
+        return created
+
+    # Arquivamento -----------------------------------------------------------
+
+    def archive_partition(self, conn: Connection, partition: PartitionInfo) -> Tuple[str, int]:
+        """Grava as linhas da partição em JSON Lines comprimido (gzip)
+
+        O arquivo é escrito em .tmp e renomeado só após o fsync, então um arquivo
+        final sempre contém a partição completa. No MySQL a leitura é pela própria partição
+        (PARTITION (nome)), exatamente as linhas que o DROP PARTITION remove, mesmo que o
+        intervalo real dela seja maior que o mês do nome.
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{TABLE_NAME}_{partition.name}.jsonl.gz")
+        tmp_path = f"{path}.tmp"
+
+        table = EligibilityCheck.__table__
+        query = (
+            select(table)
+            .order_by(table.c.checked_at, table.c.id)
+        )
+        if self.native:
+            query = query.with_hint(table, f"PARTITION ({partition.name})", "mysql")
+        else:
+            query = query.where(table.c.checked_at >= partition.start, table.c.checked_at < partition.end)
+        rows = 0
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+                result = conn.execution_options(stream_results=True, yield_per=self.chunk_size).execute(query)
+                for row in result.mappings():
+                    record = dict(row)
+                    record["checked_at"] = record["checked_at"].isoformat() if record["checked_at"] else None
+                    archive.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                    rows += 1
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+
+        eligibility_rows_archived_total.inc(rows)
+        logger.info(f"Partição {partition.name} arquivada em {path} ({rows} linhas)")
+        return path, rows
+
+    def drop_partition(self, conn: Connection, partition: PartitionInfo):
+        if self.native:
+            conn.execute(text(f"ALTER TABLE {TABLE_NAME} DROP PARTITION {partition.name}"))
+        else:
+            table = EligibilityCheck.__table__
+            conn.execute(
+                table.delete().where(
+                    table.c.checked_at >= partition.start,
+                    table.c.checked_at < partition.end
+                )
+            )
+        logger.info(f"Partição {partition.name} removida de {TABLE_NAME}")
+
+    # Retenção ---------------------------------------------------------------
+
+    def _acquire_lock(self, conn: Connection) -> bool:
+        """Evita que vários workers rodem a retenção ao mesmo tempo (MySQL GET_LOCK)"""
+        if not self.native:
+            return True
+        return bool(conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": RETENTION_LOCK_NAME}).scalar())
+
+    def _release_lock(self, conn: Connection):
+        if self.native:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": RETENTION_LOCK_NAME})
+
+    def run_retention(self, now: Optional[datetime] = None) -> dict:
+        """Cria partições futuras e arquiva/remove as mais antigas que a retenção"""
+        now = now or datetime.utcnow()
+        cutoff = add_months(month_start(now), -self.retention_months)
+        summary = {"created": [], "archived": [], "cutoff": cutoff.isoformat()}
+
+        with self.engine.connect() as conn:
+            if not self._acquire_lock(conn):
+                logger.info("Retenção de elegibilidade já em execução em outro worker")
+                summary["skipped"] = True
+                return summary
+            try:
+                if not self.is_partitioned(conn):
+                    # Sem a migração 0003 não há partições a criar nem a remover
+                    if not self._warned_unpartitioned:
+                        logger.warning(
+                            f"{TABLE_NAME} não está particionada; retenção desativada até "
+                            "rodar `alembic upgrade head`"
+                        )
+                        self._warned_unpartitioned = True
+                    summary["skipped"] = True
+                    return summary
+                self._warned_unpartitioned = False
+                summary["created"] = self.ensure_future_partitions(conn, now)
+                conn.commit()
+
+                for partition in self.list_partitions(conn):
+                    if partition.end > cutoff:
+                        continue
+                    path, rows = self.archive_partition(conn, partition)
+                    self.drop_partition(conn, partition)
+                    conn.commit()
+                    eligibility_partitions_archived_total.inc()
+                    summary["archived"].append({"partition": partition.name, "path": path, "rows": rows})
+            finally:
+                self._release_lock(conn)
+                conn.commit()
+
+        return summary
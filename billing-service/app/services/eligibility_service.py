@@ -1,21 +1,47 @@
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Optional, Sequence
 from datetime import datetime
 from app.models import EligibilityCheck
 from app.redis_client import get_redis
 from app.schemas import EligibilityCheckRequest
+from app.config import settings
+from app.services.eligibility_partitions import history_windows
+from app.services.coverage_rules import coverage_rules
+from app.services.member_roster import member_roster, RosterMatch
+from app.database import read_only
+from app.tracing import traced_service
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Campos selecionáveis no histórico (?fields=)
+ELIGIBILITY_HISTORY_COLUMNS = {
+    "patient_id": EligibilityCheck.patient_id,
+    "insurance_id": EligibilityCheck.insurance_id,
+    "is_eligible": EligibilityCheck.is_eligible,
+    "message": EligibilityCheck.message,
+    "checked_at": EligibilityCheck.checked_at,
+}
 
+
+@traced_service
 class EligibilityService:
     @staticmethod
     def check_eligibility(db: Session, request: EligibilityCheckRequest) -> EligibilityCheck:
         """Verifica elegibilidade do paciente com convênio"""
+        # Carteira do convênio carregada localmente: a verificação é uma busca no
+        # snapshot em memória, sem round-trip ao Redis
+        roster_match = member_roster.lookup(request.insurance_id, request.patient_id)
+        if roster_match is not None:
+            is_eligible, message = EligibilityService._evaluate_roster_match(request, roster_match)
+            return EligibilityService._save_check(db, request, is_eligible, message)
+        
         redis = get_redis()
         cache_key = f"eligibility:{request.patient_id}:{request.insurance_id}"
+        if request.plan_code or request.procedure_code or request.enrolled_at:
+            # O veredito depende do plano/procedimento/adesão consultados
+            cache_key += f":{request.plan_code or ''}:{request.procedure_code or ''}:{request.enrolled_at or ''}"
         
         # Tentar buscar do cache Redis (se disponível)
         if redis:
@@ -38,10 +64,14 @@ class EligibilityService:
             except Exception as e:
                 logger.warning(f"Erro ao acessar cache Redis: {e}")
         
-        # Simular verificação de elegibilidade (aqui seria integração TISS/ANS)
-        # Por padrão, assumimos elegível se não houver restrições
-        is_eligible = True
-        message = "Paciente elegível para o procedimento"
+        # Regras de cobertura compiladas por convênio (plano, carência, exclusões)
+        # Sem regras cadastradas para o convênio, o paciente é considerado elegível
+        is_eligible, message = coverage_rules.evaluate(
+            request.insurance_id,
+            plan_code=request.plan_code,
+            procedure_code=request.procedure_code,
+            enrolled_at=request.enrolled_at
+        )
         
         # Verificar tabelas TUSS no Redis (cache) - se disponível
         if redis:
@@ -55,15 +85,7 @@ class EligibilityService:
                 logger.warning(f"Erro ao acessar cache TUSS: {e}")
         
         # Criar registro de verificação
-        eligibility = EligibilityCheck(
-            patient_id=request.patient_id,
-            insurance_id=request.insurance_id,
-            is_eligible=1 if is_eligible else 0,
-            message=message
-        )
-        db.add(eligibility)
-        db.commit()
-        db.refresh(eligibility)
+        eligibility = EligibilityService._save_check(db, request, is_eligible, message)
         
         # Cachear resultado (TTL de 1 hora) - se Redis estiver disponível
         if redis:
@@ -79,22 +101,73 @@ class EligibilityService:
         return eligibility
     
     @staticmethod
+    def _evaluate_roster_match(request: EligibilityCheckRequest, match: RosterMatch):
+        """Veredito a partir da carteira; o plano e o início da vigência alimentam as regras de cobertura"""
+        if not match.found:
+            return False, "Beneficiário não encontrado na carteira do convênio"
+        if not match.active:
+            return False, "Beneficiário fora da vigência do plano"
+        return coverage_rules.evaluate(
+            request.insurance_id,
+            plan_code=request.plan_code or match.plan_code,
+            procedure_code=request.procedure_code,
+            enrolled_at=request.enrolled_at or match.valid_from
+        )
+    
+    @staticmethod
+    def _save_check(db: Session, request: EligibilityCheckRequest, is_eligible: bool, message: str) -> EligibilityCheck:
+        eligibility = EligibilityCheck(
+            patient_id=request.patient_id,
+            insurance_id=request.insurance_id,
+            is_eligible=1 if is_eligible else 0,
+            message=message
+        )
+        db.add(eligibility)
+        db.commit()
+        db.refresh(eligibility)
+        return eligibility
+    
+    @staticmethod
+    @read_only
     def get_eligibility_history(
         db: Session,
         patient_id: Optional[str] = None,
         insurance_id: Optional[str] = None,
-        limit: int = 10
+        limit: int = 10,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        columns: Optional[Sequence] = None
     ):
-        """Busca histórico de verificações de elegibilidade"""
-        query = db.query(EligibilityCheck)
+        """Busca histórico de verificações de elegibilidade
+
+        Consulta primeiro apenas as partições recentes e só desce para as mais
+        antigas se o limite não for atingido (poda de partições por checked_at).
+        Com `columns`, seleciona só essas colunas e retorna Rows.
+        """
+        query = db.query(*columns) if columns else db.query(EligibilityCheck)
         
         if patient_id:
             query = query.filter(EligibilityCheck.patient_id == patient_id)
         if insurance_id:
             query = query.filter(EligibilityCheck.insurance_id == insurance_id)
+        if since:
+            query = query.filter(EligibilityCheck.checked_at >= since)
+        if until:
+            query = query.filter(EligibilityCheck.checked_at < until)
         
-        return query.order_by(EligibilityCheck.checked_at.desc()).limit(limit).all()
-
-
-
-
+        results = []
+        for start, end in history_windows(until or datetime.utcnow(), settings.ELIGIBILITY_HISTORY_RECENT_MONTHS):
+            if since and end and end <= since:
+                break
+            window = query
+            if start:
+                window = window.filter(EligibilityCheck.checked_at >= start)
+            if end:
+                window = window.filter(EligibilityCheck.checked_at < end)
+            results.extend(
+                window.order_by(EligibilityCheck.checked_at.desc()).limit(limit - len(results)).all()
+            )
+            if len(results) >= limit:
+                break
+        
+        return results
@@ -1,17 +1,66 @@
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from sqlalchemy import select, update
+from fastapi import HTTPException
+from typing import Optional, List, Dict, Sequence
 from datetime import datetime
+from decimal import Decimal
 import uuid
 from app.models import Invoice, InvoiceStatus
 from app.schemas import InvoiceCreate, InvoiceUpdate
+from app import deadline
 from app.kafka_producer import kafka_producer
+from app.services.patient_summary import PatientSummaryService, SummaryDelta
+from app.database import read_only
+from app.sharding import shards
+from app.tracing import traced_service
 
 
+# Campos selecionáveis na listagem (?fields=)
+INVOICE_LIST_COLUMNS = {
+    "id": Invoice.id,
+    "claim_id": Invoice.claim_id,
+    "patient_id": Invoice.patient_id,
+    "amount": Invoice.amount,
+    "currency": Invoice.currency,
+    "status": Invoice.status,
+    "version": Invoice.version,
+    "settled_at": Invoice.settled_at,
+    "paid_amount": Invoice.paid_amount,
+    "glosa_amount": Invoice.glosa_amount,
+    "glosa_code": Invoice.glosa_code,
+    "created_at": Invoice.created_at,
+}
+
+# Tamanho máximo da lista IN (...) por statement na liquidação em lote
+SETTLE_BATCH_CHUNK_SIZE = 1000
+
+
+def _invoice_settled_event(invoice, settled_at: Optional[datetime]) -> dict:
+    """Payload do evento InvoiceSettled a partir de uma invoice (ORM ou Row)"""
+    return {
+        "id": invoice.id,
+        "claimId": invoice.claim_id,
+        "patientId": invoice.patient_id,
+        "amount": float(invoice.amount),
+        "currency": invoice.currency,
+        "status": InvoiceStatus.SETTLED.value,
+        "settledAt": settled_at.isoformat() + "Z" if settled_at else None,
+        "createdAt": invoice.created_at.isoformat() + "Z"
+    }
+
+
+def _settlement_delta(amount, settled_at: datetime) -> SummaryDelta:
+    return SummaryDelta(outstanding_balance=-amount, pending_invoices=-1, last_settlement_at=settled_at)
+
+
+@traced_service
 class InvoiceService:
     @staticmethod
     def create_invoice(db: Session, invoice_data: InvoiceCreate) -> Invoice:
-        """Cria uma nova invoice"""
-        invoice_id = f"INV{uuid.uuid4().hex[:6].upper()}"
+        """Cria uma nova invoice no shard do paciente (o shard vai embutido no ID)"""
+        shard = shards.shard_for_patient(invoice_data.patient_id)
+        invoice_id = shards.new_id("INV", shard, uuid.uuid4().hex)
+        db = shards.session_for_shard(db, shard, mode="patient")
         
         invoice = Invoice(
             id=invoice_id,
@@ -22,82 +71,218 @@ class InvoiceService:
             status=InvoiceStatus.PENDING
         )
         db.add(invoice)
+        PatientSummaryService.apply_deltas(
+            db,
+            {invoice.patient_id: SummaryDelta(outstanding_balance=Decimal(str(invoice.amount)), pending_invoices=1)}
+        )
         db.commit()
-        db.refresh(invoice)
+        PatientSummaryService.invalidate([invoice_data.patient_id])
+        with deadline.suspended():
+            db.refresh(invoice)
         
         return invoice
     
     @staticmethod
+    @read_only
     def get_invoice(db: Session, invoice_id: str) -> Optional[Invoice]:
         """Busca uma invoice por ID"""
+        db = shards.session_for_id(db, invoice_id)
+        if db is None:
+            return None
         return db.query(Invoice).filter(Invoice.id == invoice_id).first()
     
     @staticmethod
+    @read_only
     def get_invoices(
         db: Session,
         patient_id: Optional[str] = None,
         status: Optional[InvoiceStatus] = None,
         skip: int = 0,
-        limit: int = 100
+        limit: int = 100,
+        columns: Optional[Sequence] = None,
+        after_id: Optional[str] = None
     ) -> List[Invoice]:
-        """Lista invoices com filtros opcionais"""
-        query = db.query(Invoice)
+        """Lista invoices com filtros opcionais, ordenadas por id
+
+        Com `columns`, seleciona só essas colunas e retorna Rows em vez de entidades.
+        Sem patient_id, a consulta é feita em todos os shards (scatter-gather por id);
+        `after_id` pagina por cursor (id > after_id), sem OFFSET em cada shard.
+        """
+        def query(session: Session, cursor: Optional[str], offset: int, count: int):
+            query = session.query(*columns) if columns else session.query(Invoice)
+            if cursor:
+                query = query.filter(Invoice.id > cursor)
+            if patient_id:
+                query = query.filter(Invoice.patient_id == patient_id)
+            if status:
+                query = query.filter(Invoice.status == status)
+            return query.order_by(Invoice.id).offset(offset).limit(count).all()
         
         if patient_id:
-            query = query.filter(Invoice.patient_id == patient_id)
-        if status:
-            query = query.filter(Invoice.status == status)
-        
-        return query.offset(skip).limit(limit).all()
+            return query(shards.session_for_patient(db, patient_id), after_id, skip, limit)
+        return shards.scatter_merge(db, query, skip, limit, after_id=after_id, operation="get_invoices")
     
     @staticmethod
     def settle_invoice(db: Session, invoice_id: str) -> Optional[Invoice]:
-        """Settles (liquida) uma invoice e publica evento"""
-        invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
-        if not invoice:
+        """Settles (liquida) uma invoice e publica evento
+
+        A transição pending -> settled é um único UPDATE condicional; só a requisição
+        cujo UPDATE afetou a linha publica o evento InvoiceSettled, então liquidações
+        concorrentes da mesma invoice geram exatamente um evento.
+        """
+        db = shards.session_for_id(db, invoice_id)
+        if db is None:
             return None
+        settled_at = datetime.utcnow().replace(microsecond=0)
+        result = db.execute(
+            update(Invoice)
+            .where(Invoice.id == invoice_id, Invoice.status == InvoiceStatus.PENDING)
+            .values(status=InvoiceStatus.SETTLED, settled_at=settled_at, version=Invoice.version + 1),
+            execution_options={"synchronize_session": False}
+        )
+        if result.rowcount:
+            settled = db.execute(
+                select(Invoice.patient_id, Invoice.amount).where(Invoice.id == invoice_id)
+            ).one()
+            PatientSummaryService.apply_deltas(db, {settled.patient_id: _settlement_delta(settled.amount, settled_at)})
+        db.commit()
+        if result.rowcount:
+            PatientSummaryService.invalidate([settled.patient_id])
         
-        if invoice.status == InvoiceStatus.SETTLED:
-            return invoice
-        
-        invoice.status = InvoiceStatus.SETTLED
-        invoice.settled_at = datetime.utcnow()
+        # Liquidação confirmada: a releitura não pode dar 504, senão o evento se perde
+        # (o retry cai no caminho "já liquidada", que não publica)
+        with deadline.suspended():
+            invoice = db.query(Invoice).filter(Invoice.id == invoice_id).populate_existing().first()
+        if not invoice:
+            return None
         
-        db.commit()
-        db.refresh(invoice)
+        if result.rowcount == 0:
+            # Já liquidada (idempotente, sem novo evento) ou em status que não permite liquidação
+            if invoice.status == InvoiceStatus.SETTLED:
+                return invoice
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "error": "Invalid state transition",
+                    "message": f"Invoice no status {invoice.status.value} não pode ser liquidada",
+                    "current_version": invoice.version
+                }
+            )
         
         # Publicar evento InvoiceSettled
-        event_data = {
-            "id": invoice.id,
-            "claimId": invoice.claim_id,
-            "patientId": invoice.patient_id,
-            "amount": float(invoice.amount),
-            "currency": invoice.currency,
-            "status": invoice.status.value,
-            "settledAt": invoice.settled_at.isoformat() + "Z" if invoice.settled_at else None,
-            "createdAt": invoice.created_at.isoformat() + "Z"
-        }
-        kafka_producer.publish_invoice_settled(event_data)
+        kafka_producer.publish_invoice_settled(_invoice_settled_event(invoice, invoice.settled_at))
         
         return invoice
     
+    @staticmethod
+    def settle_invoices(db: Session, invoice_ids: List[str]) -> Dict[str, object]:
+        """Liquida invoices em lote (remessa de pagamento do convênio)
+
+        Por bloco de IDs: um SELECT ... FOR UPDATE classifica as invoices e um único
+        UPDATE ... WHERE id IN (...) AND status = 'pending' liquida as pendentes.
+        Os eventos InvoiceSettled são publicados em lote após os commits.
+        Cada shard liquida as suas invoices em transações próprias.
+        """
+        unique_ids = list(dict.fromkeys(invoice_ids))
+        settled_at = datetime.utcnow().replace(microsecond=0)
+        result = {"settled": [], "already_settled": [], "not_settleable": [], "missing": []}
+        events = []
+        
+        groups = shards.group_ids(unique_ids)
+        # IDs apontando para shards inexistentes
+        grouped = {invoice_id for ids in groups.values() for invoice_id in ids}
+        result["missing"].extend(invoice_id for invoice_id in unique_ids if invoice_id not in grouped)
+        
+        try:
+            for shard, shard_ids in groups.items():
+                InvoiceService._settle_shard(
+                    shards.session_for_shard(db, shard), shard_ids, settled_at, result, events
+                )
+        finally:
+            # Chunks já confirmados publicam mesmo se um shard seguinte falhar
+            result["events_published"] = kafka_producer.publish_invoices_settled(events)
+        return result
+    
+    @staticmethod
+    def _settle_shard(db: Session, invoice_ids: List[str], settled_at: datetime,
+                      result: Dict[str, list], events: List[dict]):
+        for start in range(0, len(invoice_ids), SETTLE_BATCH_CHUNK_SIZE):
+            chunk = invoice_ids[start:start + SETTLE_BATCH_CHUNK_SIZE]
+            rows = db.execute(
+                select(
+                    Invoice.id, Invoice.claim_id, Invoice.patient_id, Invoice.amount,
+                    Invoice.currency, Invoice.status, Invoice.created_at
+                )
+                .where(Invoice.id.in_(chunk))
+                .with_for_update()
+            ).all()
+            found = {row.id: row for row in rows}
+            pending = [row for row in rows if row.status == InvoiceStatus.PENDING]
+            deltas: Dict[str, SummaryDelta] = {}
+            
+            if pending:
+                db.execute(
+                    update(Invoice)
+                    .where(Invoice.id.in_([row.id for row in pending]), Invoice.status == InvoiceStatus.PENDING)
+                    .values(status=InvoiceStatus.SETTLED, settled_at=settled_at, version=Invoice.version + 1),
+                    execution_options={"synchronize_session": False}
+                )
+                for row in pending:
+                    deltas.setdefault(row.patient_id, SummaryDelta()).add(_settlement_delta(row.amount, settled_at))
+                PatientSummaryService.apply_deltas(db, deltas)
+            db.commit()
+            PatientSummaryService.invalidate(deltas)
+            
+            for invoice_id in chunk:
+                row = found.get(invoice_id)
+                if row is None:
+                    result["missing"].append(invoice_id)
+                elif row.status == InvoiceStatus.PENDING:
+                    result["settled"].append(invoice_id)
+                    events.append(_invoice_settled_event(row, settled_at))
+                elif row.status == InvoiceStatus.SETTLED:
+                    result["already_settled"].append(invoice_id)
+                else:
+                    result["not_settleable"].append(invoice_id)
+    
     @staticmethod
     def update_invoice(db: Session, invoice_id: str, invoice_update: InvoiceUpdate) -> Optional[Invoice]:
-        """Atualiza uma invoice"""
-        invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
-        if not invoice:
+        """Atualiza uma invoice com um único UPDATE condicional (sem SELECT prévio)
+
+        Com `version` informada, o UPDATE só casa se a versão ainda for a atual
+        (WHERE id = ? AND version = ?); caso contrário responde 409.
+        """
+        db = shards.session_for_id(db, invoice_id)
+        if db is None:
             return None
-        
         if invoice_update.status:
-            invoice.status = invoice_update.status
+            statement = update(Invoice).where(Invoice.id == invoice_id)
+            if invoice_update.version is not None:
+                statement = statement.where(Invoice.version == invoice_update.version)
+            result = db.execute(
+                statement.values(status=invoice_update.status, version=Invoice.version + 1),
+                execution_options={"synchronize_session": False}
+            )
+            patient_id = None
+            if result.rowcount:
+                # Transição arbitrária: recalcula o resumo do paciente na mesma transação
+                patient_id = db.execute(select(Invoice.patient_id).where(Invoice.id == invoice_id)).scalar()
+                PatientSummaryService.recompute(db, [patient_id])
+            db.commit()
+            if patient_id:
+                PatientSummaryService.invalidate([patient_id])
+            
+            if result.rowcount == 0:
+                current = db.query(Invoice).filter(Invoice.id == invoice_id).first()
+                if current is None:
+                    return None
+                raise HTTPException(
+                    status_code=409,
+                    detail={
+                        "error": "Version conflict",
+                        "message": "Invoice foi alterada por outra requisição. Releia e tente novamente.",
+                        "current_version": current.version
+                    }
+                )
         
-        db.commit()
-        db.refresh(invoice)
-        return invoice
-
-
-
-
-
-
-
+        return db.query(Invoice).filter(Invoice.id == invoice_id).populate_existing().first()
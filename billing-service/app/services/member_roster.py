@@ -0,0 +1,392 @@
+"""
+Carteira de beneficiários por convênio (roster) para verificação de elegibilidade local
+
+Os convênios enviam arquivos completos de beneficiários (CSV ou largura fixa). A ingestão
+lê o arquivo em streaming e monta um índice compacto por convênio:
+
+- chaves: hash blake2b de 64 bits do member_id, ordenadas (array 'Q')
+- vigência: valid_from/valid_to como ordinal de data (array 'i'), em paralelo às chaves
+- plano: índice na tabela de planos do snapshot (array 'H')
+
+O índice é gravado como snapshot binário (.tmp + fsync + os.replace) e lido via mmap, de
+modo que todos os workers compartilham as mesmas páginas do page cache. Uma busca é uma
+busca binária nas chaves; o snapshot é recarregado quando o arquivo muda.
+
+Uso via CLI:
+    python -m app.services.member_roster ingest --insurance-id UNIMED-001 carteira.csv
+    python -m app.services.member_roster ingest --insurance-id UNIMED-001 --format fixed carteira.txt
+    python -m app.services.member_roster lookup --insurance-id UNIMED-001 P12345
+"""
+import os
+import re
+import csv
+import json
+import mmap
+import time
+import struct
+import bisect
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from prometheus_client import Counter, Gauge
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+roster_members = Gauge(
+    'billing_roster_members',
+    'Member entries in the loaded roster snapshot',
+    ['insurance_id']
+)
+
+roster_lookups_total = Counter(
+    'billing_roster_lookups_total',
+    'Roster membership lookups',
+    ['result']
+)
+
+SNAPSHOT_MAGIC = b"BRST"
+SNAPSHOT_VERSION = 1
+# magic, versão, reservado, quantidade de entradas, tamanho da tabela de planos (JSON)
+SNAPSHOT_HEADER = struct.Struct("<4sHHQI")
+SNAPSHOT_SUFFIX = ".roster"
+
+# valid_to vazio = vigência sem data de término
+OPEN_ENDED = date.max.toordinal()
+
+# Layout padrão de arquivos de largura fixa: campo -> (início, fim) em colunas (base 0)
+DEFAULT_FIXED_LAYOUT = {
+    "member_id": (0, 20),
+    "plan_code": (20, 30),
+    "valid_from": (30, 38),
+    "valid_to": (38, 46),
+}
+
+_INSURANCE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# (member_id, plan_code, valid_from, valid_to)
+RosterRecord = Tuple[str, str, int, int]
+
+
+def member_key(member_id: str) -> int:
+    """Hash de 64 bits do member_id (chave do índice)"""
+    return int.from_bytes(hashlib.blake2b(member_id.strip().encode("utf-8"), digest_size=8).digest(), "little")
+
+
+@lru_cache(maxsize=65536)
+def _date_ordinal(value: str) -> int:
+    # Carteiras repetem poucas datas distintas (início de mês, término de contrato)
+    fmt = "%Y%m%d" if len(value) == 8 and value.isdigit() else "%Y-%m-%d"
+    return datetime.strptime(value, fmt).date().toordinal()
+
+
+def parse_roster_date(value: Optional[str], default: int) -> int:
+    """Converte YYYY-MM-DD ou YYYYMMDD em ordinal; vazio retorna `default`"""
+    value = (value or "").strip()
+    if not value:
+        return default
+    return _date_ordinal(value)
+
+
+def snapshot_path(directory: str, insurance_id: str) -> str:
+    if not _INSURANCE_ID_PATTERN.match(insurance_id):
+        raise ValueError(f"insurance_id inválido para snapshot de carteira: {insurance_id!r}")
+    return os.path.join(directory, f"{insurance_id}{SNAPSHOT_SUFFIX}")
+
+
+# Parsing ---------------------------------------------------------------------
+
+def iter_csv_records(lines: Iterable[str], delimiter: str = ",") -> Iterator[RosterRecord]:
+    """Lê um CSV com cabeçalho member_id, plan_code, valid_from, valid_to"""
+    reader = csv.DictReader(lines, delimiter=delimiter)
+    missing = {"member_id"} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"Colunas obrigatórias ausentes no CSV: {sorted(missing)}")
+    for line_number, row in enumerate(reader, start=2):
+        member_id = (row.get("member_id") or "").strip()
+        if not member_id:
+            logger.warning(f"Linha {line_number} da carteira sem member_id ignorada")
+            continue
+        yield (
+            member_id,
+            (row.get("plan_code") or "").strip(),
+            parse_roster_date(row.get("valid_from"), 1),
+            parse_roster_date(row.get("valid_to"), OPEN_ENDED),
+        )
+
+
+def iter_fixed_width_records(lines: Iterable[str],
+                             layout: Optional[Dict[str, Tuple[int, int]]] = None) -> Iterator[RosterRecord]:
+    """Lê um arquivo de largura fixa conforme `layout` (campo -> (início, fim))"""
+    layout = layout or DEFAULT_FIXED_LAYOUT
+
+    def field(line: str, name: str) -> str:
+        if name not in layout:
+            return ""
+        start, end = layout[name]
+        return line[start:end].strip()
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        member_id = field(line, "member_id")
+        if not member_id:
+            continue
+        yield (
+            member_id,
+            field(line, "plan_code"),
+            parse_roster_date(field(line, "valid_from"), 1),
+            parse_roster_date(field(line, "valid_to"), OPEN_ENDED),
+        )
+
+
+def parse_fixed_layout(spec: str) -> Dict[str, Tuple[int, int]]:
+    """Converte "member_id:0:20,plan_code:20:30" em layout"""
+    layout = {}
+    for item in spec.split(","):
+        name, start, end = item.split(":")
+        layout[name.strip()] = (int(start), int(end))
+    return layout
+
+
+# Snapshot ----------------------------------------------------------------------
+
+def _pad(length: int) -> int:
+    return (-length) % 8
+
+
+def build_snapshot(records: Iterable[RosterRecord], path: str) -> int:
+    """Monta o índice ordenado a partir dos registros e grava o snapshot atomicamente"""
+    keys = array("Q")
+    valid_from = array("i")
+    valid_to = array("i")
+    plans = array("H")
+    plan_codes: List[str] = []
+    plan_index: Dict[str, int] = {}
+
+    for member_id, plan_code, start, end in records:
+        index = plan_index.get(plan_code)
+        if index is None:
+            index = plan_index[plan_code] = len(plan_codes)
+            plan_codes.append(plan_code)
+        keys.append(member_key(member_id))
+        valid_from.append(start)
+        valid_to.append(end)
+        plans.append(index)
+
+    count = len(keys)
+    order = sorted(range(count), key=keys.__getitem__)
+    plan_table = json.dumps(plan_codes, ensure_ascii=False).encode("utf-8")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, count, len(plan_table)))
+        f.write(plan_table)
+        f.write(b"\0" * _pad(SNAPSHOT_HEADER.size + len(plan_table)))
+        for column in (keys, valid_from, valid_to, plans):
+            data = array(column.typecode, (column[i] for i in order)).tobytes()
+            f.write(data)
+            f.write(b"\0" * _pad(len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+@dataclass(frozen=True)
+class RosterMatch:
+    """Resultado de uma busca na carteira"""
+    found: bool
+    active: bool
+    plan_code: Optional[str] = None
+    valid_from: Optional[date] = None
+    valid_to: Optional[date] = None
+
+
+NOT_FOUND = RosterMatch(found=False, active=False)
+
+
+class RosterSnapshot:
+    """Snapshot de um convênio mapeado em memória (somente leitura)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, version, _, count, plan_table_size = SNAPSHOT_HEADER.unpack_from(view, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot de carteira inválido: {path}")
+
+        offset = SNAPSHOT_HEADER.size
+        self.plan_codes: List[str] = json.loads(bytes(view[offset:offset + plan_table_size]))
+        offset += plan_table_size
+        offset += _pad(offset)
+
+        columns = []
+        for typecode in ("Q", "i", "i", "H"):
+            size = array(typecode).itemsize * count
+            columns.append(view[offset:offset + size].cast(typecode))
+            offset += size + _pad(size)
+        self.keys, self.valid_from, self.valid_to, self.plans = columns
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lookup(self, member_id: str, on_date: Optional[date] = None) -> RosterMatch:
+        """Busca o beneficiário; entre várias vigências, prefere a ativa em `on_date`"""
+        key = member_key(member_id)
+        index = bisect.bisect_left(self.keys, key)
+        if index >= self.count or self.keys[index] != key:
+            return NOT_FOUND
+
+        day = (on_date or date.today()).toordinal()
+        best = index
+        while index < self.count and self.keys[index] == key:
+            if self.valid_from[index] <= day <= self.valid_to[index]:
+                best = index
+                break
+            if self.valid_to[index] > self.valid_to[best]:
+                best = index
+            index += 1
+
+        start, end = self.valid_from[best], self.valid_to[best]
+        return RosterMatch(
+            found=True,
+            active=start <= day <= end,
+            plan_code=self.plan_codes[self.plans[best]] or None,
+            valid_from=date.fromordinal(start),
+            valid_to=None if end == OPEN_ENDED else date.fromordinal(end),
+        )
+
+
+class RosterRegistry:
+    """Snapshots carregados por convênio, recarregados quando o arquivo muda
+
+    A troca é atômica: o snapshot novo substitui a referência no dict, e buscas em
+    andamento continuam no mmap antigo até terminarem. Só convênios com arquivo de carteira
+    ganham entrada (e série no gauge); os sem arquivo, vindos da requisição, ficam num
+    cache negativo limitado a MISSING_CACHE_SIZE.
+    """
+
+    MISSING_CACHE_SIZE = 1024
+
+    def __init__(self, directory: str, check_interval_seconds: float = 5.0):
+        self.directory = directory
+        self.check_interval_seconds = check_interval_seconds
+        # insurance_id -> (mtime, snapshot ou None, próxima verificação)
+        self._entries: Dict[str, Tuple[Optional[float], Optional[RosterSnapshot], float]] = {}
+        # insurance_id sem arquivo -> próxima verificação (LRU)
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, insurance_id: str) -> Optional[RosterSnapshot]:
+        entry = self._entries.get(insurance_id)
+        now = time.monotonic()
+        if entry is not None and now < entry[2]:
+            return entry[1]
+        if entry is None and now < self._missing.get(insurance_id, 0.0):
+            return None
+        with self._lock:
+            return self._refresh(insurance_id, entry, now)
+
+    def _refresh(self, insurance_id: str, entry, now: float) -> Optional[RosterSnapshot]:
+        try:
+            path = snapshot_path(self.directory, insurance_id)
+            mtime = os.stat(path).st_mtime
+        except (ValueError, FileNotFoundError):
+            path, mtime = None, None
+
+        if mtime is None:
+            if self._entries.pop(insurance_id, None) is not None:
+                try:
+                    roster_members.remove(insurance_id)
+                except KeyError:
+                    pass
+            self._missing[insurance_id] = now + self.check_interval_seconds
+            self._missing.move_to_end(insurance_id)
+            while len(self._missing) > self.MISSING_CACHE_SIZE:
+                self._missing.popitem(last=False)
+            return None
+
+        self._missing.pop(insurance_id, None)
+        snapshot = entry[1] if entry is not None else None
+        if entry is None or entry[0] != mtime:
+            try:
+                snapshot = RosterSnapshot(path)
+                logger.info(f"Carteira de {insurance_id} carregada: {len(snapshot)} beneficiários")
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Erro ao carregar carteira de {insurance_id}: {e}")
+
+        roster_members.labels(insurance_id=insurance_id).set(len(snapshot) if snapshot else 0)
+        self._entries[insurance_id] = (mtime, snapshot, now + self.check_interval_seconds)
+        return snapshot
+
+    def lookup(self, insurance_id: str, member_id: str, on_date: Optional[date] = None) -> Optional[RosterMatch]:
+        """Retorna None quando o convênio não tem carteira carregada"""
+        snapshot = self.get(insurance_id)
+        if snapshot is None:
+            return None
+        match = snapshot.lookup(member_id, on_date)
+        if not match.found:
+            result = "not_found"
+        else:
+            result = "active" if match.active else "inactive"
+        roster_lookups_total.labels(result=result).inc()
+        return match
+
+    def ingest(self, insurance_id: str, records: Iterable[RosterRecord]) -> int:
+        """Grava um novo snapshot; os workers o carregam na próxima verificação"""
+        path = snapshot_path(self.directory, insurance_id)
+        count = build_snapshot(records, path)
+        with self._lock:
+            self._entries.pop(insurance_id, None)
+            self._missing.pop(insurance_id, None)
+        logger.info(f"Carteira de {insurance_id} ingerida: {count} registros em {path}")
+        return count
+
+
+# Instância global
+member_roster = RosterRegistry(settings.ROSTER_DIR, settings.ROSTER_RELOAD_SECONDS)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Carteira de beneficiários por convênio")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Ingere um arquivo de carteira")
+    ingest_parser.add_argument("file")
+    ingest_parser.add_argument("--insurance-id", required=True)
+    ingest_parser.add_argument("--format", choices=("csv", "fixed"), default="csv")
+    ingest_parser.add_argument("--delimiter", default=",")
+    ingest_parser.add_argument("--layout", help="Layout de largura fixa, ex.: member_id:0:20,plan_code:20:30")
+    ingest_parser.add_argument("--encoding", default="utf-8")
+
+    lookup_parser = subparsers.add_parser("lookup", help="Consulta um beneficiário")
+    lookup_parser.add_argument("member_id")
+    lookup_parser.add_argument("--insurance-id", required=True)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "ingest":
+        started = time.perf_counter()
+        with open(args.file, encoding=args.encoding, newline="") as f:
+            if args.format == "csv":
+                records = iter_csv_records(f, delimiter=args.delimiter)
+            else:
+                records = iter_fixed_width_records(f, parse_fixed_layout(args.layout) if args.layout else None)
+            count = member_roster.ingest(args.insurance_id, records)
+        print({"insurance_id": args.insurance_id, "records": count,
+               "seconds": round(time.perf_counter() - started, 3)})
+    else:
+        print(member_roster.lookup(args.insurance_id, args.member_id))
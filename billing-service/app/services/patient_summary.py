@@ -0,0 +1,287 @@
+"""
+Read model patient_billing_summary (saldo em aberto, claims abertos, última liquidação)
+
+Mantido na mesma transação das escritas em claims/invoices:
+- criação de claim/invoice e liquidação aplicam deltas com um upsert atômico
+  (col = col + delta), seguro sob escritas concorrentes do mesmo paciente;
+- transições arbitrárias (PATCH de status, adjudicação em lote) recalculam o resumo dos
+  pacientes afetados a partir das tabelas base (índices por patient_id, status).
+
+A leitura é servida do Redis (uma chave por paciente), invalidada após o commit.
+
+Cada shard mantém o resumo dos seus pacientes (app.sharding). Reconstrução a partir das
+tabelas base, shard a shard:
+    python -m app.services.patient_summary rebuild [--patient-id P123]
+"""
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import case, func, select, union
+from sqlalchemy.orm import Session
+from app import deadline
+from app.config import settings
+from app.models import Claim, ClaimStatus, Invoice, InvoiceStatus, PatientBillingSummary
+from app.redis_client import get_redis
+from app.sharding import shards
+from app.tracing import traced_service
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "patient_summary"
+OPEN_CLAIM_STATUSES = (ClaimStatus.PENDING, ClaimStatus.PROCESSING)
+SUMMARY_COUNTERS = ("outstanding_balance", "pending_invoices", "open_claims", "total_claims")
+
+
+@dataclass
+class SummaryDelta:
+    outstanding_balance: Decimal = Decimal("0")
+    pending_invoices: int = 0
+    open_claims: int = 0
+    total_claims: int = 0
+    last_settlement_at: Optional[datetime] = None
+
+    def add(self, other: "SummaryDelta") -> "SummaryDelta":
+        for name in SUMMARY_COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        if other.last_settlement_at and (
+            self.last_settlement_at is None or other.last_settlement_at > self.last_settlement_at
+        ):
+            self.last_settlement_at = other.last_settlement_at
+        return self
+
+
+def cache_key(patient_id: str) -> str:
+    return f"{CACHE_KEY_PREFIX}:{patient_id}"
+
+
+def _dialect_insert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return dialect, insert
+
+
+def _upsert(db: Session, rows: List[dict], additive: bool):
+    """INSERT ... ON DUPLICATE KEY UPDATE (MySQL) / ON CONFLICT DO UPDATE (SQLite, PostgreSQL)
+
+    `additive`: soma os valores às colunas existentes (deltas); senão, substitui.
+    """
+    if not rows:
+        return
+    table = PatientBillingSummary.__table__
+    dialect, insert = _dialect_insert(db)
+    statement = insert(table).values(rows)
+    new = statement.inserted if dialect == "mysql" else statement.excluded
+
+    values = {}
+    for name in SUMMARY_COUNTERS:
+        values[name] = table.c[name] + new[name] if additive else new[name]
+    if additive:
+        old_settlement, new_settlement = table.c.last_settlement_at, new.last_settlement_at
+        values["last_settlement_at"] = case(
+            (new_settlement.is_(None), old_settlement),
+            (old_settlement.is_(None), new_settlement),
+            (new_settlement > old_settlement, new_settlement),
+            else_=old_settlement
+        )
+    else:
+        values["last_settlement_at"] = new.last_settlement_at
+    values["updated_at"] = new.updated_at
+
+    if dialect == "mysql":
+        statement = statement.on_duplicate_key_update(**values)
+    else:
+        statement = statement.on_conflict_do_update(index_elements=[table.c.patient_id], set_=values)
+    db.execute(statement)
+
+
+def _row(patient_id: str, summary: SummaryDelta, now: datetime) -> dict:
+    return {
+        "patient_id": patient_id,
+        "outstanding_balance": summary.outstanding_balance,
+        "pending_invoices": summary.pending_invoices,
+        "open_claims": summary.open_claims,
+        "total_claims": summary.total_claims,
+        "last_settlement_at": summary.last_settlement_at,
+        "updated_at": now,
+    }
+
+
+@traced_service
+class PatientSummaryService:
+    @staticmethod
+    def apply_deltas(db: Session, deltas: Dict[str, SummaryDelta]):
+        """Aplica deltas por paciente em um único upsert (sem commit)"""
+        now = datetime.utcnow()
+        _upsert(db, [_row(patient_id, delta, now) for patient_id, delta in sorted(deltas.items())], additive=True)
+
+    @staticmethod
+    def recompute(db: Session, patient_ids: Iterable[str]):
+        """Recalcula o resumo dos pacientes a partir de claims e invoices (sem commit)
+
+        A sobrescrita (additive=False) só é segura se o agregado incluir todo delta já
+        confirmado por apply_deltas concorrentes:
+        - MySQL: os agregados são locking reads (LOCK IN SHARE MODE), que leem a versão mais
+          recente em vez do snapshot da transação (REPEATABLE READ) e bloqueiam novas escritas
+          em claims/invoices desses pacientes até o commit; a escrita que chegar depois soma o
+          seu delta sobre o valor recalculado;
+        - demais bancos: as linhas do resumo são travadas (FOR UPDATE) antes de agregar; em
+          READ COMMITTED cada SELECT seguinte vê o que já foi confirmado.
+        """
+        patient_ids = sorted(set(patient_ids))
+        if not patient_ids:
+            return
+        summaries = {patient_id: SummaryDelta() for patient_id in patient_ids}
+        locking_reads = db.get_bind().dialect.name == "mysql"
+        if not locking_reads:
+            db.execute(
+                select(PatientBillingSummary.patient_id)
+                .where(PatientBillingSummary.patient_id.in_(patient_ids))
+                .with_for_update()
+            )
+
+        def aggregate(query):
+            return db.execute(query.with_for_update(read=True) if locking_reads else query)
+
+        for patient_id, total, open_count in aggregate(
+            select(
+                Claim.patient_id,
+                func.count(),
+                func.sum(case((Claim.status.in_(OPEN_CLAIM_STATUSES), 1), else_=0))
+            )
+            .where(Claim.patient_id.in_(patient_ids))
+            .group_by(Claim.patient_id)
+        ):
+            summaries[patient_id].total_claims = int(total or 0)
+            summaries[patient_id].open_claims = int(open_count or 0)
+
+        pending = Invoice.status == InvoiceStatus.PENDING
+        for patient_id, balance, pending_count, last_settlement in aggregate(
+            select(
+                Invoice.patient_id,
+                func.sum(case((pending, Invoice.amount), else_=0)),
+                func.sum(case((pending, 1), else_=0)),
+                func.max(Invoice.settled_at)
+            )
+            .where(Invoice.patient_id.in_(patient_ids))
+            .group_by(Invoice.patient_id)
+        ):
+            summaries[patient_id].outstanding_balance = Decimal(str(balance or 0))
+            summaries[patient_id].pending_invoices = int(pending_count or 0)
+            summaries[patient_id].last_settlement_at = last_settlement
+
+        now = datetime.utcnow()
+        _upsert(db, [_row(patient_id, summary, now) for patient_id, summary in summaries.items()], additive=False)
+
+    @staticmethod
+    def invalidate(patient_ids: Iterable[str]):
+        """Remove os resumos do cache (chamar após o commit)
+
+        Roda sem deadline: a escrita já foi confirmada, e interromper aqui deixaria o
+        resumo antigo no cache até o TTL.
+        """
+        keys = [cache_key(patient_id) for patient_id in set(patient_ids)]
+        if not keys:
+            return
+        with deadline.suspended():
+            redis = get_redis()
+            if redis:
+                try:
+                    redis.delete(*keys)
+                except Exception as e:
+                    logger.warning(f"Erro ao invalidar cache de resumo de pacientes: {e}")
+
+    @staticmethod
+    def get_summary(db: Session, patient_id: str) -> dict:
+        """Resumo do paciente: uma chave no Redis ou uma leitura por PK"""
+        redis = get_redis()
+        key = cache_key(patient_id)
+        if redis:
+            try:
+                cached = redis.get(key)
+                if cached:
+                    return json.loads(cached)
+            except Exception as e:
+                logger.warning(f"Erro ao acessar cache Redis: {e}")
+
+        summary = shards.session_for_patient(db, patient_id).get(PatientBillingSummary, patient_id)
+        result = {
+            "patient_id": patient_id,
+            "outstanding_balance": float(summary.outstanding_balance) if summary else 0.0,
+            "pending_invoices": summary.pending_invoices if summary else 0,
+            "open_claims": summary.open_claims if summary else 0,
+            "total_claims": summary.total_claims if summary else 0,
+            "last_settlement_at": (
+                summary.last_settlement_at.isoformat() if summary and summary.last_settlement_at else None
+            ),
+            "updated_at": summary.updated_at.isoformat() if summary and summary.updated_at else None,
+        }
+
+        if redis:
+            try:
+                redis.setex(key, settings.PATIENT_SUMMARY_CACHE_TTL_SECONDS, json.dumps(result))
+            except Exception as e:
+                logger.warning(f"Erro ao salvar no cache Redis: {e}")
+        return result
+
+    @staticmethod
+    def rebuild(db: Session, patient_ids: Optional[List[str]] = None, chunk_size: int = 1000) -> int:
+        """Regera o read model a partir das tabelas base, em blocos de pacientes"""
+        if patient_ids:
+            for start in range(0, len(patient_ids), chunk_size):
+                chunk = patient_ids[start:start + chunk_size]
+                PatientSummaryService.recompute(db, chunk)
+                db.commit()
+                PatientSummaryService.invalidate(chunk)
+            return len(patient_ids)
+
+        rebuilt = 0
+        last_patient_id = ""
+        while True:
+            # Keyset pela união dos patient_ids de claims e invoices
+            patients = union(
+                select(Claim.patient_id.label("patient_id")).where(Claim.patient_id > last_patient_id),
+                select(Invoice.patient_id.label("patient_id")).where(Invoice.patient_id > last_patient_id)
+            ).subquery()
+            chunk = db.execute(
+                select(patients.c.patient_id).order_by(patients.c.patient_id).limit(chunk_size)
+            ).scalars().all()
+            if not chunk:
+                break
+            PatientSummaryService.recompute(db, chunk)
+            db.commit()
+            PatientSummaryService.invalidate(chunk)
+            rebuilt += len(chunk)
+            last_patient_id = chunk[-1]
+            logger.info(f"Resumo de pacientes reconstruído: {rebuilt} pacientes")
+        return rebuilt
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Read model patient_billing_summary")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Regera o resumo a partir de claims e invoices")
+    rebuild_parser.add_argument("--patient-id", action="append", help="Reconstrói só esses pacientes")
+    rebuild_parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    rebuilt = 0
+    for shard, session_factory in enumerate(shards.session_factories):
+        patient_ids = args.patient_id
+        if patient_ids:
+            patient_ids = [patient_id for patient_id in patient_ids if shards.shard_for_patient(patient_id) == shard]
+            if not patient_ids:
+                continue
+        with session_factory() as db:
+            rebuilt += PatientSummaryService.rebuild(db, patient_ids, args.chunk_size)
+    print({"rebuilt": rebuilt})
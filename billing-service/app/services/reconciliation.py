@@ -0,0 +1,250 @@
+"""
+Conciliação invoices x claims em lote (relatório de divergências)
+
+Encontra, em cada shard:
+- orphan_invoice: invoice (não cancelada) cujo claim_id não existe em claims;
+- unbilled_claim: claim aprovado sem nenhuma invoice não cancelada;
+- amount_mismatch: claim cuja soma das invoices não canceladas difere do valor do claim.
+
+As duas tabelas são lidas em ordem de chave, em chunks (keyset por claims.id e por
+(invoices.claim_id, invoices.id) dentro do intervalo de IDs do chunk de claims), e cada chunk
+é casado com NumPy (argsort + searchsorted, somas com bincount) em vez de objetos ORM.
+A memória fica limitada ao tamanho do chunk; as divergências vão direto para o CSV.
+Com --processes > 1, cada shard é dividido em faixas de ID e as faixas rodam em um pool
+de processos (um CSV parcial por faixa, concatenados no final na ordem das faixas).
+
+Uso via CLI:
+    python -m app.services.reconciliation --output data/reconciliation/report.csv --processes 4
+"""
+import os
+import csv
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Claim, ClaimStatus, Invoice, InvoiceStatus
+from app.services.adjudication_service import to_cents
+from app.sharding import dispose_inherited_connections, shards
+
+logger = logging.getLogger(__name__)
+
+REPORT_COLUMNS = (
+    "type", "shard", "claim_id", "invoice_id", "claim_status",
+    "claim_amount", "invoiced_amount", "invoice_count", "difference",
+)
+
+# Faixa de claims.id: (início exclusivo, fim inclusivo); None = sem limite
+IdRange = Tuple[Optional[str], Optional[str]]
+
+
+def format_cents(cents) -> str:
+    cents = int(cents)
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}"
+
+
+def cents_array(amounts) -> np.ndarray:
+    return np.fromiter((to_cents(amount) for amount in amounts), dtype=np.int64, count=len(amounts))
+
+
+def match_invoices(claim_ids: np.ndarray, invoice_claim_ids: np.ndarray,
+                   invoice_cents: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Casa invoices com os claims do chunk
+
+    Retorna (soma em centavos por claim, nº de invoices por claim, máscara de invoices órfãs),
+    alinhados com claim_ids / invoice_claim_ids. Não depende da ordenação vinda do banco.
+    """
+    billed = np.zeros(len(claim_ids), dtype=np.int64)
+    counts = np.zeros(len(claim_ids), dtype=np.int64)
+    if not len(invoice_claim_ids):
+        return billed, counts, np.zeros(0, dtype=bool)
+
+    keys, inverse = np.unique(invoice_claim_ids, return_inverse=True)
+    sums = np.rint(np.bincount(inverse, weights=invoice_cents)).astype(np.int64)
+    per_key = np.bincount(inverse)
+    if not len(claim_ids):
+        return billed, counts, np.ones(len(invoice_claim_ids), dtype=bool)
+
+    order = np.argsort(claim_ids, kind="stable")
+    sorted_ids = claim_ids[order]
+    positions = np.searchsorted(sorted_ids, keys)
+    clipped = np.minimum(positions, len(sorted_ids) - 1)
+    found = sorted_ids[clipped] == keys
+
+    # Chaves de `keys` são únicas: atribuição indexada sem colisão
+    targets = order[clipped[found]]
+    billed[targets] += sums[found]
+    counts[targets] += per_key[found]
+    return billed, counts, ~found[inverse]
+
+
+class RangeReconciler:
+    """Concilia uma faixa de claims.id de um shard, escrevendo as divergências no CSV"""
+
+    def __init__(self, db: Session, writer, shard: int, chunk_size: int = 10000):
+        self.db = db
+        self.writer = writer
+        self.shard = shard
+        self.chunk_size = chunk_size
+        self.stats = {
+            "claims": 0, "invoices": 0,
+            "orphan_invoice": 0, "unbilled_claim": 0, "amount_mismatch": 0,
+        }
+
+    def run(self, id_range: IdRange) -> Dict[str, int]:
+        start, end = id_range
+        last_id = start
+        while True:
+            query = select(Claim.id, Claim.amount, Claim.status).order_by(Claim.id).limit(self.chunk_size)
+            if last_id is not None:
+                query = query.where(Claim.id > last_id)
+            if end is not None:
+                query = query.where(Claim.id <= end)
+            rows = self.db.execute(query).all()
+            # Último chunk cobre até o fim da faixa: pega invoices órfãs depois do último claim
+            chunk_end = rows[-1][0] if len(rows) == self.chunk_size else end
+            self._reconcile_chunk(rows, last_id, chunk_end)
+            if len(rows) < self.chunk_size:
+                return self.stats
+            last_id = chunk_end
+
+    def _invoice_chunks(self, start: Optional[str], end: Optional[str]):
+        """Invoices não canceladas com claim_id em (start, end], em chunks por (claim_id, id)"""
+        cursor: Optional[Tuple[str, str]] = None
+        while True:
+            query = (
+                select(Invoice.id, Invoice.claim_id, Invoice.amount)
+                .where(Invoice.claim_id.isnot(None), Invoice.status != InvoiceStatus.CANCELLED)
+                .order_by(Invoice.claim_id, Invoice.id)
+                .limit(self.chunk_size)
+            )
+            if start is not None:
+                query = query.where(Invoice.claim_id > start)
+            if end is not None:
+                query = query.where(Invoice.claim_id <= end)
+            if cursor is not None:
+                query = query.where(or_(
+                    Invoice.claim_id > cursor[0],
+                    and_(Invoice.claim_id == cursor[0], Invoice.id > cursor[1])
+                ))
+            rows = self.db.execute(query).all()
+            if rows:
+                yield rows
+            if len(rows) < self.chunk_size:
+                return
+            cursor = (rows[-1][1], rows[-1][0])
+
+    def _reconcile_chunk(self, claims, start: Optional[str], end: Optional[str]):
+        claim_ids = np.array([row[0] for row in claims], dtype=str)
+        claim_cents = cents_array([row[1] for row in claims])
+        billed = np.zeros(len(claims), dtype=np.int64)
+        counts = np.zeros(len(claims), dtype=np.int64)
+
+        for invoices in self._invoice_chunks(start, end):
+            invoice_claim_ids = np.array([row[1] for row in invoices], dtype=str)
+            invoice_cents = cents_array([row[2] for row in invoices])
+            chunk_billed, chunk_counts, orphans = match_invoices(claim_ids, invoice_claim_ids, invoice_cents)
+            billed += chunk_billed
+            counts += chunk_counts
+            self.stats["invoices"] += len(invoices)
+            for index in np.flatnonzero(orphans):
+                invoice_id, claim_id, _ = invoices[index]
+                self._write("orphan_invoice", claim_id, invoice_id, None, None, invoice_cents[index], 1)
+
+        self.stats["claims"] += len(claims)
+        approved = np.fromiter((row[2] == ClaimStatus.APPROVED for row in claims), dtype=bool, count=len(claims))
+        for index in np.flatnonzero(approved & (counts == 0)):
+            self._write("unbilled_claim", claims[index][0], None, claims[index][2], claim_cents[index], 0, 0)
+        for index in np.flatnonzero((counts > 0) & (billed != claim_cents)):
+            self._write("amount_mismatch", claims[index][0], None, claims[index][2],
+                        claim_cents[index], billed[index], counts[index])
+
+    def _write(self, kind: str, claim_id, invoice_id, status, claim_cents, invoiced_cents, invoice_count):
+        self.stats[kind] += 1
+        difference = int(invoiced_cents) - int(claim_cents) if claim_cents is not None else None
+        self.writer.writerow((
+            kind, self.shard, claim_id or "", invoice_id or "",
+            status.value if status is not None else "",
+            format_cents(claim_cents) if claim_cents is not None else "",
+            format_cents(invoiced_cents), int(invoice_count),
+            format_cents(difference) if difference is not None else "",
+        ))
+
+
+def split_ranges(db: Session, parts: int) -> List[IdRange]:
+    """Divide claims.id em até `parts` faixas de tamanho parecido (limites por OFFSET no índice do PK)"""
+    if parts <= 1:
+        return [(None, None)]
+    total = db.execute(select(func.count()).select_from(Claim)).scalar() or 0
+    boundaries: List[str] = []
+    for part in range(1, parts):
+        boundary = db.execute(
+            select(Claim.id).order_by(Claim.id).offset(total * part // parts).limit(1)
+        ).scalar()
+        if boundary is not None and (not boundaries or boundary > boundaries[-1]):
+            boundaries.append(boundary)
+    edges: List[Optional[str]] = [None, *boundaries, None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def reconcile_range(shard: int, id_range: IdRange, output_path: str, chunk_size: int) -> Dict[str, int]:
+    """Concilia uma faixa de um shard em um CSV parcial (sem cabeçalho); roda no pool de processos"""
+    with shards.session_factories[shard]() as db, open(output_path, "w", newline="", encoding="utf-8") as f:
+        # Leitura pesada: vai para réplica quando houver (RoutingSession)
+        db.info["read_only"] = True
+        return RangeReconciler(db, csv.writer(f), shard, chunk_size).run(id_range)
+
+
+def reconcile(output_path: str, processes: int = 1, chunk_size: int = 10000) -> Dict[str, float]:
+    """Concilia todos os shards e escreve o relatório CSV em output_path"""
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    tasks = []
+    for shard, session_factory in enumerate(shards.session_factories):
+        with session_factory() as db:
+            db.info["read_only"] = True
+            for index, id_range in enumerate(split_ranges(db, processes)):
+                tasks.append((shard, id_range, f"{output_path}.part-{shard}-{index}", chunk_size))
+
+    if processes > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=processes, initializer=dispose_inherited_connections) as pool:
+            results = list(pool.map(reconcile_range, *zip(*tasks)))
+    else:
+        results = [reconcile_range(*task) for task in tasks]
+
+    totals: Dict[str, float] = {}
+    with open(output_path, "w", newline="", encoding="utf-8") as report:
+        csv.writer(report).writerow(REPORT_COLUMNS)
+        for (_, _, part_path, _), stats in zip(tasks, results):
+            with open(part_path, encoding="utf-8") as part:
+                for line in part:
+                    report.write(line)
+            os.remove(part_path)
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Conciliação: {totals.get('claims', 0)} claims e {totals.get('invoices', 0)} invoices em {elapsed:.1f}s "
+        f"({totals.get('orphan_invoice', 0)} órfãs, {totals.get('unbilled_claim', 0)} sem faturamento, "
+        f"{totals.get('amount_mismatch', 0)} com valor divergente)"
+    )
+    return {**totals, "ranges": len(tasks), "seconds": round(elapsed, 3)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Conciliação invoices x claims")
+    parser.add_argument("--output", default=os.path.join(settings.RECONCILIATION_REPORT_DIR, "report.csv"))
+    parser.add_argument("--processes", type=int, default=settings.RECONCILIATION_PROCESSES)
+    parser.add_argument("--chunk-size", type=int, default=settings.RECONCILIATION_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(reconcile(args.output, processes=args.processes, chunk_size=args.chunk_size))
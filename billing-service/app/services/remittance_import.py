@@ -0,0 +1,344 @@
+"""
+Importação da remessa de pagamento do convênio (demonstrativo de pagamento)
+
+O arquivo CSV (cabeçalho obrigatório, separador REMITTANCE_DELIMITER) traz uma linha por guia:
+    guia;invoice_id;valor_pago;valor_glosa;codigo_glosa
+- guia: numeroGuiaPrestador enviado no lote TISS (= claim_id); invoice_id é opcional e tem
+  precedência quando presente;
+- valor_pago obrigatório; valor_glosa, quando ausente, é o valor da invoice menos o pago;
+- valores em reais com no máximo duas casas decimais, separador "." ou "," e sem separador
+  de milhar ("1234.56" ou "1234,56"); qualquer outro formato é rejeitado como invalid.
+
+Fluxo, com memória limitada ao chunk (exceto o índice):
+1. índice em memória claim_id -> invoice_id das invoices não canceladas (opcionalmente só do
+   convênio), montado em uma passada por shard com keyset;
+2. o arquivo é lido linha a linha e processado em chunks de REMITTANCE_CHUNK_SIZE;
+3. por shard e chunk: SELECT ... FOR UPDATE confirma o status atual e um único UPDATE com
+   CASE grava status, paid_amount, glosa_amount e glosa_code de todas as invoices do chunk;
+   invoice_id explícito cuja guia (ou convênio) não confere é rejeitado como mismatch;
+4. os eventos InvoiceSettled de cada shard são publicados em lote logo após o seu commit.
+
+Uso via CLI:
+    python -m app.services.remittance_import remessa.csv [--insurer ANS-123] [--rejects rejeitadas.csv]
+"""
+import re
+import csv
+import time
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, TextIO
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.kafka_producer import kafka_producer
+from app.middleware.observability import invoices_settled_total, remittance_lines_total
+from app.models import Claim, Invoice, InvoiceStatus
+from app.services.invoice_service import _invoice_settled_event, _settlement_delta
+from app.services.patient_summary import PatientSummaryService, SummaryDelta
+from app.sharding import shards
+
+logger = logging.getLogger(__name__)
+
+REJECT_REASONS = ("unmatched", "mismatch", "duplicate", "already_settled", "not_settleable", "invalid")
+
+# Um único formato: inteiro com até duas casas decimais ("1234.56" ou "1234,56"), sem milhar
+_AMOUNT = re.compile(r"^(?P<units>[0-9]+)(?:[.,](?P<fraction>[0-9]{1,2}))?$")
+
+
+@dataclass
+class RemittanceLine:
+    line: int
+    guia: Optional[str]
+    invoice_id: Optional[str]
+    paid_cents: int
+    glosa_cents: Optional[int]
+    glosa_code: Optional[str]
+
+
+def parse_cents(value: str) -> int:
+    """ "1234.56" ou "1234,56" -> centavos; ValueError em qualquer outro formato
+
+    Separador de milhar, frações de centavo, sinal e valores não finitos são recusados:
+    "1.234" ou "1,234.56" seriam ambíguos e liquidariam a invoice com o valor errado.
+    """
+    match = _AMOUNT.match(value.strip())
+    if match is None:
+        raise ValueError(f"Valor inválido: {value!r}")
+    return int(match["units"]) * 100 + int((match["fraction"] or "0").ljust(2, "0"))
+
+
+def _decimal(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def parse_lines(stream: TextIO, delimiter: str = ";", rejects: Optional["RejectLog"] = None) -> Iterator[RemittanceLine]:
+    """Lê o CSV incrementalmente; linhas inválidas vão para `rejects`"""
+    reader = csv.DictReader(stream, delimiter=delimiter)
+    for line_number, row in enumerate(reader, start=2):
+        guia = (row.get("guia") or "").strip() or None
+        invoice_id = (row.get("invoice_id") or "").strip() or None
+        try:
+            paid_cents = parse_cents(row.get("valor_pago") or "")
+            glosa = (row.get("valor_glosa") or "").strip()
+            glosa_cents = parse_cents(glosa) if glosa else None
+        except (ArithmeticError, ValueError):
+            paid_cents = None
+        if (guia is None and invoice_id is None) or paid_cents is None:
+            if rejects is not None:
+                rejects.add(line_number, guia, invoice_id, "invalid")
+            continue
+        yield RemittanceLine(
+            line_number, guia, invoice_id, paid_cents, glosa_cents,
+            (row.get("codigo_glosa") or "").strip()[:10] or None
+        )
+
+
+class RejectLog:
+    """Contagem de linhas rejeitadas por motivo + detalhe das primeiras `max_details`"""
+
+    def __init__(self, max_details: int = 1000, writer=None):
+        self.counts = {reason: 0 for reason in REJECT_REASONS}
+        self.details: List[dict] = []
+        self.max_details = max_details
+        self.writer = writer
+
+    def add(self, line: int, guia: Optional[str], invoice_id: Optional[str], reason: str):
+        self.counts[reason] += 1
+        remittance_lines_total.labels(result=reason).inc()
+        entry = {"line": line, "guia": guia, "invoice_id": invoice_id, "reason": reason}
+        if len(self.details) < self.max_details:
+            self.details.append(entry)
+        if self.writer is not None:
+            self.writer.writerow((line, guia or "", invoice_id or "", reason))
+
+
+def build_index(insurance_id: Optional[str] = None, chunk_size: int = 50000) -> Dict[str, str]:
+    """claim_id -> invoice_id das invoices não canceladas, em uma passada keyset por shard
+
+    A invoice pendente de menor id tem preferência; guias cujas invoices já foram liquidadas
+    continuam no índice para que a reimportação responda already_settled e não unmatched.
+    """
+    index: Dict[str, str] = {}
+    settled_only = set()
+    for session_factory in shards.session_factories:
+        with session_factory() as db:
+            last_id = ""
+            while True:
+                query = (
+                    select(Invoice.id, Invoice.claim_id, Invoice.status)
+                    .where(Invoice.status != InvoiceStatus.CANCELLED, Invoice.claim_id.isnot(None), Invoice.id > last_id)
+                    .order_by(Invoice.id)
+                    .limit(chunk_size)
+                )
+                if insurance_id:
+                    query = query.join(Claim, Claim.id == Invoice.claim_id).where(Claim.insurance_id == insurance_id)
+                rows = db.execute(query).all()
+                for invoice_id, claim_id, status in rows:
+                    pending = status == InvoiceStatus.PENDING
+                    if claim_id not in index:
+                        index[claim_id] = invoice_id
+                        if not pending:
+                            settled_only.add(claim_id)
+                    elif pending and claim_id in settled_only:
+                        index[claim_id] = invoice_id
+                        settled_only.discard(claim_id)
+                if len(rows) < chunk_size:
+                    break
+                last_id = rows[-1][0]
+    return index
+
+
+class RemittanceImporter:
+    """Aplica as linhas da remessa em chunks, com UPDATE ... CASE por shard"""
+
+    def __init__(self, chunk_size: int = 2000, delimiter: str = ";", max_rejected_details: int = 1000,
+                 rejects_writer=None):
+        self.chunk_size = chunk_size
+        self.delimiter = delimiter
+        self.rejects = RejectLog(max_rejected_details, rejects_writer)
+        self.settled = 0
+        self.glosa_lines = 0
+        self.paid_cents = 0
+        self.glosa_cents = 0
+        self.events_published = 0
+        self.insurance_id: Optional[str] = None
+        self._sessions: Dict[int, Session] = {}
+
+    def _session(self, shard: int) -> Session:
+        session = self._sessions.get(shard)
+        if session is None:
+            session = self._sessions[shard] = shards.session_factories[shard]()
+        return session
+
+    def run(self, stream: TextIO, insurance_id: Optional[str] = None) -> Dict:
+        started = time.perf_counter()
+        self.insurance_id = insurance_id
+        index = build_index(insurance_id)
+        index_seconds = time.perf_counter() - started
+        lines = parse_lines(stream, self.delimiter, self.rejects)
+        seen: set = set()
+        total_lines = 0
+        try:
+            while True:
+                chunk = list(islice(lines, self.chunk_size))
+                if not chunk:
+                    break
+                total_lines += len(chunk)
+                self._apply_chunk(chunk, index, seen)
+        finally:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+        total_lines += self.rejects.counts["invalid"]
+        elapsed = time.perf_counter() - started
+        lines_per_minute = total_lines / elapsed * 60 if elapsed else 0.0
+        logger.info(
+            f"Remessa: {total_lines} linhas em {elapsed:.1f}s ({lines_per_minute:.0f} linhas/min, "
+            f"índice {len(index)} guias em {index_seconds:.1f}s), {self.settled} liquidadas, "
+            f"{sum(self.rejects.counts.values())} rejeitadas"
+        )
+        return {
+            "lines": total_lines,
+            "settled": self.settled,
+            "glosa_lines": self.glosa_lines,
+            "paid_amount": float(_decimal(self.paid_cents)),
+            "glosa_amount": float(_decimal(self.glosa_cents)),
+            "rejected": dict(self.rejects.counts),
+            "rejected_lines": self.rejects.details,
+            "events_published": self.events_published,
+            "index_size": len(index),
+            "seconds": round(elapsed, 3),
+            "lines_per_minute": round(lines_per_minute, 1),
+        }
+
+    def _apply_chunk(self, chunk: List[RemittanceLine], index: Dict[str, str], seen: set):
+        by_shard: Dict[int, Dict[str, RemittanceLine]] = {}
+        for line in chunk:
+            invoice_id = line.invoice_id or index.get(line.guia)
+            shard = shards.shard_for_id(invoice_id) if invoice_id else None
+            if shard is None:
+                self.rejects.add(line.line, line.guia, line.invoice_id, "unmatched")
+                continue
+            if invoice_id in seen:
+                self.rejects.add(line.line, line.guia, invoice_id, "duplicate")
+                continue
+            seen.add(invoice_id)
+            by_shard.setdefault(shard, {})[invoice_id] = line
+
+        for shard, lines in by_shard.items():
+            events: List[dict] = []
+            try:
+                self._apply_shard(self._session(shard), lines, events)
+            finally:
+                # Publica o que o shard já confirmou, mesmo se um shard seguinte falhar
+                self.events_published += kafka_producer.publish_invoices_settled(events)
+                invoices_settled_total.inc(len(events))
+
+    def _apply_shard(self, db: Session, lines: Dict[str, RemittanceLine], events: List[dict]):
+        rows = db.execute(
+            select(
+                Invoice.id, Invoice.claim_id, Invoice.patient_id, Invoice.amount,
+                Invoice.currency, Invoice.status, Invoice.created_at
+            )
+            .where(Invoice.id.in_(list(lines)))
+            .with_for_update()
+        ).all()
+        found = {row.id: row for row in rows}
+        insurers: Dict[str, Optional[str]] = {}
+        if self.insurance_id and rows:
+            insurers = dict(db.execute(
+                select(Claim.id, Claim.insurance_id).where(Claim.id.in_({row.claim_id for row in rows if row.claim_id}))
+            ).all())
+        settled_at = datetime.utcnow().replace(microsecond=0)
+        paid: Dict[str, Decimal] = {}
+        glosa: Dict[str, Decimal] = {}
+        codes: Dict[str, Optional[str]] = {}
+        pending = []
+        for invoice_id, line in lines.items():
+            row = found.get(invoice_id)
+            if row is None:
+                self.rejects.add(line.line, line.guia, invoice_id, "unmatched")
+            elif (line.guia is not None and row.claim_id != line.guia) or (
+                    self.insurance_id and insurers.get(row.claim_id) != self.insurance_id):
+                # invoice_id explícito de outra guia ou de outro convênio (digitação, arquivo trocado)
+                self.rejects.add(line.line, line.guia, invoice_id, "mismatch")
+            elif row.status == InvoiceStatus.SETTLED:
+                self.rejects.add(line.line, line.guia, invoice_id, "already_settled")
+            elif row.status != InvoiceStatus.PENDING:
+                self.rejects.add(line.line, line.guia, invoice_id, "not_settleable")
+            else:
+                amount_cents = int((Decimal(row.amount) * 100).to_integral_value())
+                glosa_cents = line.glosa_cents if line.glosa_cents is not None else max(amount_cents - line.paid_cents, 0)
+                paid[invoice_id] = _decimal(line.paid_cents)
+                glosa[invoice_id] = _decimal(glosa_cents)
+                codes[invoice_id] = line.glosa_code
+                pending.append(row)
+                self.paid_cents += line.paid_cents
+                self.glosa_cents += glosa_cents
+                self.glosa_lines += glosa_cents > 0
+
+        deltas: Dict[str, SummaryDelta] = {}
+        if pending:
+            # UPDATE Core (sem o caminho ORM de bulk update): o statement muda a cada chunk
+            # (nº de WHENs), então o custo de compilação conta no throughput
+            invoices = Invoice.__table__
+            db.execute(
+                update(invoices)
+                .where(invoices.c.id.in_(list(paid)), invoices.c.status == InvoiceStatus.PENDING)
+                .values(
+                    status=InvoiceStatus.SETTLED,
+                    settled_at=settled_at,
+                    version=invoices.c.version + 1,
+                    paid_amount=case(paid, value=invoices.c.id),
+                    glosa_amount=case(glosa, value=invoices.c.id),
+                    glosa_code=case(codes, value=invoices.c.id),
+                )
+            )
+            for row in pending:
+                deltas.setdefault(row.patient_id, SummaryDelta()).add(_settlement_delta(row.amount, settled_at))
+            PatientSummaryService.apply_deltas(db, deltas)
+        db.commit()
+        PatientSummaryService.invalidate(deltas)
+
+        self.settled += len(pending)
+        remittance_lines_total.labels(result="settled").inc(len(pending))
+        events.extend(_invoice_settled_event(row, settled_at) for row in pending)
+
+
+def import_remittance(stream: TextIO, insurance_id: Optional[str] = None, rejects_writer=None) -> Dict:
+    """Importa uma remessa a partir de um arquivo texto já aberto"""
+    importer = RemittanceImporter(
+        chunk_size=settings.REMITTANCE_CHUNK_SIZE,
+        delimiter=settings.REMITTANCE_DELIMITER,
+        max_rejected_details=settings.REMITTANCE_MAX_REJECTED_DETAILS,
+        rejects_writer=rejects_writer,
+    )
+    return importer.run(stream, insurance_id)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Importação de remessa de pagamento do convênio")
+    parser.add_argument("file", help="Arquivo CSV da remessa")
+    parser.add_argument("--insurer", help="Restringe o índice às invoices de guias deste convênio")
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--rejects", help="CSV com todas as linhas rejeitadas (linha, guia, invoice_id, motivo)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.file, newline="", encoding=args.encoding) as remittance:
+        if args.rejects:
+            with open(args.rejects, "w", newline="", encoding="utf-8") as rejects_file:
+                rejects_writer = csv.writer(rejects_file)
+                rejects_writer.writerow(("line", "guia", "invoice_id", "reason"))
+                result = import_remittance(remittance, args.insurer, rejects_writer)
+        else:
+            result = import_remittance(remittance, args.insurer)
+    result.pop("rejected_lines")
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,270 @@
+"""
+Geração de lotes TISS (XML de envio de lote de guias) por convênio
+
+As guias do convênio no período são lidas por cursor do lado do servidor
+(stream_results + yield_per, claims com itens em um único SELECT ordenado por claim) e
+escritas incrementalmente com XMLGenerator: nenhum DOM é montado, então a memória não
+depende do tamanho do lote. O hash do epílogo (MD5 da concatenação dos valores de todos os
+elementos, na ordem do documento) é calculado enquanto o XML é escrito, e o arquivo final
+recebe o nome `{numeroLote}_{hash}.xml`.
+
+Estrutura simplificada do padrão TISS (cabeçalho, loteGuias com guiaSP-SADT e epílogo); a
+validação contra os XSDs da ANS fica com o convênio. Cada convênio é um lote/arquivo, e os
+lotes rodam em paralelo em um pool de processos (um convênio por tarefa).
+
+Uso via CLI:
+    python -m app.services.tiss_export --start 2026-09-01 --end 2026-10-01 [--insurers A,B] [--processes 4]
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import XMLGenerator
+from sqlalchemy import select
+from app.config import settings
+from app.models import Claim, ClaimItem, ClaimStatus
+from app.sharding import dispose_inherited_connections, shards
+
+logger = logging.getLogger(__name__)
+
+TISS_NAMESPACE = "http://www.ans.gov.br/padroes/tiss/schemas"
+TISS_ENCODING = "ISO-8859-1"
+# Tabela 22 (TUSS procedimentos e eventos em saúde)
+TUSS_TABLE = "22"
+
+# (claim_id, patient_id, amount, created_at, ((code, description, value, quantity), ...))
+GuiaRow = Tuple[str, str, Decimal, Optional[datetime], Tuple[Tuple[Optional[str], str, Decimal, int], ...]]
+
+
+class HashingXMLWriter:
+    """XMLGenerator com prefixo `ans:` que acumula o MD5 dos valores dos elementos"""
+
+    def __init__(self, stream):
+        self._xml = XMLGenerator(stream, encoding=TISS_ENCODING, short_empty_elements=True)
+        self._md5 = hashlib.md5()
+
+    def start_document(self):
+        self._xml.startDocument()
+
+    def start(self, name: str, attrs: Optional[Dict[str, str]] = None):
+        self._xml.startElement(f"ans:{name}", attrs or {})
+
+    def end(self, name: str):
+        self._xml.endElement(f"ans:{name}")
+
+    def element(self, name: str, value, hashed: bool = True):
+        text = "" if value is None else str(value)
+        self.start(name)
+        if text:
+            self._xml.characters(text)
+            if hashed:
+                self._md5.update(text.encode(TISS_ENCODING, errors="replace"))
+        self.end(name)
+
+    def end_document(self):
+        self._xml.endDocument()
+
+    def hexdigest(self) -> str:
+        return self._md5.hexdigest()
+
+
+def _money(value) -> str:
+    return f"{Decimal(value):.2f}"
+
+
+def stream_guias(insurance_id: str, start: date, end: date,
+                 statuses: Sequence[ClaimStatus] = (ClaimStatus.APPROVED,),
+                 yield_per: int = 1000) -> Iterator[GuiaRow]:
+    """Guias do convênio com created_at em [start, end), shard a shard, por cursor do servidor"""
+    query = (
+        select(Claim.id, Claim.patient_id, Claim.amount, Claim.created_at,
+               ClaimItem.code, ClaimItem.description, ClaimItem.value, ClaimItem.quantity)
+        .outerjoin(ClaimItem, ClaimItem.claim_id == Claim.id)
+        .where(
+            Claim.insurance_id == insurance_id,
+            Claim.status.in_(list(statuses)),
+            Claim.created_at >= start,
+            Claim.created_at < end,
+        )
+        .order_by(Claim.id, ClaimItem.id)
+        .execution_options(stream_results=True, yield_per=yield_per)
+    )
+    for session_factory in shards.session_factories:
+        with session_factory() as db:
+            db.info["read_only"] = True
+            for claim_id, rows in groupby(db.execute(query), key=lambda row: row[0]):
+                first = next(rows)
+                items = [first] + list(rows)
+                yield (
+                    claim_id, first[1], first[2], first[3],
+                    tuple((row[4], row[5], row[6], row[7]) for row in items if row[5] is not None),
+                )
+
+
+def write_batch(stream, guias: Iterator[GuiaRow], insurance_id: str, batch_number: int,
+                generated_at: Optional[datetime] = None) -> Dict:
+    """Escreve a mensagem TISS de envio de lote; retorna hash e totais"""
+    generated_at = generated_at or datetime.now()
+    writer = HashingXMLWriter(stream)
+    writer.start_document()
+    writer.start("mensagemTISS", {"xmlns:ans": TISS_NAMESPACE})
+
+    writer.start("cabecalho")
+    writer.start("identificacaoTransacao")
+    writer.element("tipoTransacao", "ENVIO_LOTE_GUIAS")
+    writer.element("sequencialTransacao", batch_number)
+    writer.element("dataRegistroTransacao", generated_at.strftime("%Y-%m-%d"))
+    writer.element("horaRegistroTransacao", generated_at.strftime("%H:%M:%S"))
+    writer.end("identificacaoTransacao")
+    writer.start("origem")
+    writer.start("identificacaoPrestador")
+    writer.element("codigoPrestadorNaOperadora", settings.TISS_PROVIDER_CODE)
+    writer.end("identificacaoPrestador")
+    writer.end("origem")
+    writer.start("destino")
+    writer.element("registroANS", insurance_id)
+    writer.end("destino")
+    writer.element("Padrao", settings.TISS_VERSION)
+    writer.end("cabecalho")
+
+    writer.start("prestadorParaOperadora")
+    writer.start("loteGuias")
+    writer.element("numeroLote", batch_number)
+    writer.start("guiasTISS")
+    guia_count = item_count = 0
+    total = Decimal("0")
+    for claim_id, patient_id, amount, created_at, items in guias:
+        writer.start("guiaSP-SADT")
+        writer.start("cabecalhoGuia")
+        writer.element("registroANS", insurance_id)
+        writer.element("numeroGuiaPrestador", claim_id)
+        writer.end("cabecalhoGuia")
+        writer.start("dadosBeneficiario")
+        writer.element("numeroCarteira", patient_id)
+        writer.end("dadosBeneficiario")
+        if created_at is not None:
+            writer.element("dataAtendimento", created_at.strftime("%Y-%m-%d"))
+        writer.start("procedimentosExecutados")
+        for sequence, (code, description, value, quantity) in enumerate(items, start=1):
+            writer.start("procedimentoExecutado")
+            writer.element("sequencialItem", sequence)
+            writer.start("procedimento")
+            writer.element("codigoTabela", TUSS_TABLE)
+            writer.element("codigoProcedimento", code)
+            writer.element("descricaoProcedimento", description)
+            writer.end("procedimento")
+            writer.element("quantidadeExecutada", quantity)
+            writer.element("valorUnitario", _money(value))
+            writer.element("valorTotal", _money(Decimal(value) * quantity))
+            writer.end("procedimentoExecutado")
+        writer.end("procedimentosExecutados")
+        writer.start("valorTotal")
+        writer.element("valorTotalGeral", _money(amount))
+        writer.end("valorTotal")
+        writer.end("guiaSP-SADT")
+        guia_count += 1
+        item_count += len(items)
+        total += Decimal(amount)
+    writer.end("guiasTISS")
+    writer.end("loteGuias")
+    writer.end("prestadorParaOperadora")
+
+    digest = writer.hexdigest()
+    writer.start("epilogo")
+    writer.element("hash", digest, hashed=False)
+    writer.end("epilogo")
+    writer.end("mensagemTISS")
+    writer.end_document()
+    return {"guias": guia_count, "items": item_count, "total": _money(total), "hash": digest}
+
+
+def export_insurer(insurance_id: str, start: date, end: date, batch_number: int, output_dir: str,
+                   statuses: Sequence[str] = (ClaimStatus.APPROVED.value,)) -> Dict:
+    """Gera o lote de um convênio em output_dir/{convênio}/{numeroLote}_{hash}.xml; roda no pool"""
+    started = time.perf_counter()
+    directory = os.path.join(output_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", insurance_id))
+    os.makedirs(directory, exist_ok=True)
+    partial_path = os.path.join(directory, f"{batch_number}.xml.partial")
+    guias = stream_guias(insurance_id, start, end, [ClaimStatus(status) for status in statuses])
+    with open(partial_path, "wb") as stream:
+        result = write_batch(stream, guias, insurance_id, batch_number)
+    path = os.path.join(directory, f"{batch_number:020d}_{result['hash']}.xml")
+    os.replace(partial_path, path)
+    return {
+        "insurance_id": insurance_id,
+        "path": path,
+        **result,
+        "seconds": round(time.perf_counter() - started, 3),
+        # Pico de RSS do processo (KB no Linux): deve ficar estável com o tamanho do lote
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def insurers_with_claims(start: date, end: date,
+                         statuses: Sequence[ClaimStatus] = (ClaimStatus.APPROVED,)) -> List[str]:
+    insurers = set()
+    for session_factory in shards.session_factories:
+        with session_factory() as db:
+            db.info["read_only"] = True
+            insurers.update(db.execute(
+                select(Claim.insurance_id).distinct().where(
+                    Claim.insurance_id.isnot(None),
+                    Claim.status.in_(list(statuses)),
+                    Claim.created_at >= start,
+                    Claim.created_at < end,
+                )
+            ).scalars())
+    return sorted(insurers)
+
+
+def export_batches(start: date, end: date, output_dir: str, insurers: Optional[Sequence[str]] = None,
+                   processes: int = 1, batch_number: Optional[int] = None,
+                   statuses: Sequence[str] = (ClaimStatus.APPROVED.value,)) -> List[Dict]:
+    """Um lote por convênio, em paralelo no pool de processos quando processes > 1"""
+    statuses = list(statuses)
+    if insurers is None:
+        insurers = insurers_with_claims(start, end, [ClaimStatus(status) for status in statuses])
+    batch_number = batch_number or int(datetime.now().strftime("%Y%m%d%H%M%S"))
+    tasks = [(insurer, start, end, batch_number, output_dir, statuses) for insurer in insurers]
+    if processes > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=processes, initializer=dispose_inherited_connections) as pool:
+            results = list(pool.map(export_insurer, *zip(*tasks)))
+    else:
+        results = [export_insurer(*task) for task in tasks]
+    for result in results:
+        logger.info(
+            f"Lote TISS {result['insurance_id']}: {result['guias']} guias, {result['items']} itens, "
+            f"total {result['total']} em {result['seconds']}s -> {result['path']}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Lotes TISS (envio de lote de guias) por convênio")
+    parser.add_argument("--start", required=True, type=date.fromisoformat, help="Início do período (inclusive)")
+    parser.add_argument("--end", required=True, type=date.fromisoformat, help="Fim do período (exclusivo)")
+    parser.add_argument("--insurers", help="Convênios separados por vírgula (padrão: todos com guias no período)")
+    parser.add_argument("--status", default=ClaimStatus.APPROVED.value, help="Status das guias, separados por vírgula")
+    parser.add_argument("--output-dir", default=settings.TISS_OUTPUT_DIR)
+    parser.add_argument("--processes", type=int, default=settings.TISS_EXPORT_PROCESSES)
+    parser.add_argument("--batch-number", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(export_batches(
+        args.start, args.end, args.output_dir,
+        insurers=args.insurers.split(",") if args.insurers else None,
+        processes=args.processes,
+        batch_number=args.batch_number,
+        statuses=args.status.split(","),
+    ), indent=2))
@@ -0,0 +1,389 @@
+"""
+Sharding de claims e invoices por patient_id
+
+- O patient_id é mapeado para um shard por hashing consistente (anel com SHARD_VNODES
+  nós virtuais por shard): ao adicionar um shard, só ~1/N dos pacientes muda de dono.
+- Todos os dados de um paciente (claims, itens, invoices, patient_billing_summary) ficam
+  no mesmo shard, então as escritas continuam em uma única transação local.
+- O shard vai embutido nos IDs: CLM{shard:02X}{hex6} / INV{shard:02X}{hex6}. Busca por
+  ID vai direto ao shard; IDs legados (CLM + 6 hex, anteriores ao sharding) ficam no shard 0.
+- Listagens sem patient_id fazem scatter-gather em paralelo e juntam os resultados
+  ordenados por id; a paginação por cursor (after_id) lê só `limit` linhas por shard.
+
+O shard 0 é o banco configurado em MYSQL_HOST (com as réplicas de leitura); shards
+adicionais vêm de SHARD_MYSQL_URLS. Sem shards adicionais, tudo roda no shard 0.
+Ao adicionar shards, pacientes já existentes no shard 0 cujo dono no anel passou a ser
+outro precisam ser migrados (ver `python -m app.sharding plan`).
+
+Verificação com bancos SQLite locais:
+    python -m app.sharding selfcheck --shards 4 --dir /tmp/shards
+"""
+import re
+import time
+import bisect
+import hashlib
+import heapq
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+from sqlalchemy.orm import Session, sessionmaker
+from app.config import settings
+from app.db_instrumentation import shard_scatter_duration_seconds, shard_sessions_total
+
+logger = logging.getLogger(__name__)
+
+# Shard dos registros criados antes do sharding (IDs sem o shard embutido)
+LEGACY_SHARD = 0
+_SHARDED_ID_PATTERN = re.compile(r"^(?P<prefix>[A-Z]{3})(?P<shard>[0-9A-F]{2})[0-9A-F]{6}$")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Anel de hashing consistente (patient_id -> shard)"""
+
+    def __init__(self, shard_count: int, vnodes: int = 64):
+        if not 1 <= shard_count <= 256:
+            raise ValueError("shard_count deve estar entre 1 e 256 (o shard ocupa 2 dígitos hex no ID)")
+        self.shard_count = shard_count
+        points = sorted(
+            (_hash(f"shard-{shard}#{vnode}"), shard)
+            for shard in range(shard_count)
+            for vnode in range(vnodes)
+        )
+        self._positions = [position for position, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key: str) -> int:
+        if self.shard_count == 1:
+            return 0
+        index = bisect.bisect(self._positions, _hash(key))
+        return self._shards[index % len(self._shards)]
+
+
+def shard_of_id(resource_id: str) -> int:
+    """Shard embutido no ID (IDs legados: shard 0)"""
+    match = _SHARDED_ID_PATTERN.match(resource_id or "")
+    return int(match["shard"], 16) if match else LEGACY_SHARD
+
+
+class ShardSet:
+    """Sessões por shard e helpers de roteamento para os serviços
+
+    Os serviços recebem a sessão da requisição (shard 0) e pedem a sessão do shard certo
+    com session_for_patient/session_for_id; as sessões dos outros shards ficam em
+    db.info["shard_sessions"] e são fechadas junto com a sessão da requisição.
+    """
+
+    def __init__(self, session_factories: Sequence[Callable[[], Session]],
+                 vnodes: int = 64, scatter_workers: int = 8):
+        self.scatter_workers = scatter_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self.configure(session_factories, vnodes)
+
+    def configure(self, session_factories: Sequence[Callable[[], Session]], vnodes: int = 64):
+        self.session_factories = list(session_factories)
+        self.ring = HashRing(len(self.session_factories), vnodes)
+
+    @property
+    def count(self) -> int:
+        return len(self.session_factories)
+
+    # Roteamento ---------------------------------------------------------------
+
+    def shard_for_patient(self, patient_id: str) -> int:
+        return self.ring.shard_for(patient_id)
+
+    def shard_for_id(self, resource_id: str) -> Optional[int]:
+        """Shard de um CLM/INV (None se o ID aponta para um shard inexistente)"""
+        shard = shard_of_id(resource_id)
+        return shard if shard < self.count else None
+
+    def new_id(self, prefix: str, shard: int, token: str) -> str:
+        return f"{prefix}{shard:02X}{token[:6].upper()}"
+
+    def group_ids(self, resource_ids: Iterable[str]) -> Dict[int, List[str]]:
+        """Agrupa IDs por shard (IDs de shards inexistentes são descartados)"""
+        groups: Dict[int, List[str]] = {}
+        for resource_id in resource_ids:
+            shard = self.shard_for_id(resource_id)
+            if shard is not None:
+                groups.setdefault(shard, []).append(resource_id)
+        return groups
+
+    # Sessões ------------------------------------------------------------------
+
+    def session_for_shard(self, db: Session, shard: int, mode: str = "id") -> Session:
+        if db.info.get("shard", 0) == shard:
+            return db
+        sessions = db.info.setdefault("shard_sessions", {})
+        session = sessions.get(shard)
+        if session is None:
+            session = sessions[shard] = self.session_factories[shard]()
+            session.info["client_key"] = db.info.get("client_key")
+            shard_sessions_total.labels(shard=str(shard), mode=mode).inc()
+        return session
+
+    def session_for_patient(self, db: Session, patient_id: str) -> Session:
+        return self.session_for_shard(db, self.shard_for_patient(patient_id), mode="patient")
+
+    def session_for_id(self, db: Session, resource_id: str) -> Optional[Session]:
+        shard = self.shard_for_id(resource_id)
+        return None if shard is None else self.session_for_shard(db, shard)
+
+    # Scatter-gather -----------------------------------------------------------
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.scatter_workers, thread_name_prefix="shard-scatter"
+                    )
+        return self._executor
+
+    def scatter(self, db: Session, query: Callable[[Session, int], list], operation: str = "query",
+                shards: Optional[Iterable[int]] = None) -> List[list]:
+        """Executa `query(sessão, shard)` em cada shard, em paralelo; resultados na ordem dos shards
+
+        Cada sessão é usada por uma única thread; a sessão da requisição (shard 0) é
+        usada por uma thread do pool enquanto a requisição espera. Cada consulta roda com
+        uma cópia do contexto da requisição (ex.: o deadline).
+        """
+        shard_ids = list(range(self.count) if shards is None else shards)
+        sessions = [self.session_for_shard(db, shard, mode="scatter") for shard in shard_ids]
+        if len(sessions) == 1:
+            return [query(sessions[0], shard_ids[0])]
+        start = time.perf_counter()
+        try:
+            futures = [
+                self.executor.submit(contextvars.copy_context().run, query, session, shard)
+                for session, shard in zip(sessions, shard_ids)
+            ]
+            return [future.result() for future in futures]
+        finally:
+            shard_scatter_duration_seconds.labels(operation=operation).observe(time.perf_counter() - start)
+
+    def scatter_merge(self, db: Session, query: Callable[[Session, Optional[str], int, int], list], skip: int,
+                      limit: int, after_id: Optional[str] = None, key: Callable = lambda row: row.id,
+                      operation: str = "query") -> list:
+        """Página da união dos shards, ordenada por `key` (id)
+
+        `query(sessão, after_id, offset, limit)` devolve os registros do shard com id > after_id,
+        já ordenados por id. Com `after_id` (keyset: id do último item da página anterior)
+        cada shard lê só `limit` linhas a partir do cursor, pelo índice do PK, e o merge
+        (heapq.merge) fica com as `limit` primeiras: o custo não cresce com a profundidade.
+        Sem cursor, `skip` exige que cada shard devolva skip+limit linhas (O(shards × skip)).
+        """
+        if self.count == 1:
+            return query(self.session_for_shard(db, 0), after_id, skip, limit)
+        results = self.scatter(
+            db, lambda session, shard: query(session, after_id, 0, skip + limit), operation=operation
+        )
+        return list(islice(heapq.merge(*results, key=key), skip, skip + limit))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def _build_session_factories() -> List[Callable[[], Session]]:
+    from app.database import ReplicaRouter, RoutingSession, SessionLocal, _create_engine
+
+    factories: List[Callable[[], Session]] = [SessionLocal]
+    urls = [url.strip() for url in settings.SHARD_MYSQL_URLS.split(",") if url.strip()]
+    for shard, url in enumerate(urls, start=1):
+        factories.append(sessionmaker(
+            class_=RoutingSession, autocommit=False, autoflush=False,
+            bind=_create_engine(url, f"shard-{shard}"),
+            # Réplicas de leitura são só do shard 0
+            info={"shard": shard, "replica_router": ReplicaRouter()}
+        ))
+    return factories
+
+
+def shard_engines() -> List:
+    """Engine de cada shard (create_all, migrações, diagnóstico)"""
+    engines = []
+    for factory in shards.session_factories:
+        with factory() as session:
+            engines.append(session.get_bind())
+    return engines
+
+
+def dispose_inherited_connections():
+    """Initializer de pools de processos: conexões herdadas do pai (fork) não podem ser reutilizadas"""
+    for engine in shard_engines():
+        engine.dispose(close=False)
+
+
+# Instância global
+shards = ShardSet(
+    _build_session_factories(),
+    vnodes=settings.SHARD_VNODES,
+    scatter_workers=settings.SHARD_SCATTER_WORKERS
+)
+
+
+def plan(db: Session, target_shards: int, vnodes: int = 64, chunk_size: int = 10000) -> Dict[int, int]:
+    """Pacientes do shard 0 por shard de destino em um anel com `target_shards` shards"""
+    from sqlalchemy import select, union
+    from app.models import Claim, Invoice
+
+    ring = HashRing(target_shards, vnodes)
+    moves: Dict[int, int] = {}
+    last_patient_id = ""
+    while True:
+        patients = union(
+            select(Claim.patient_id.label("patient_id")).where(Claim.patient_id > last_patient_id),
+            select(Invoice.patient_id.label("patient_id")).where(Invoice.patient_id > last_patient_id)
+        ).subquery()
+        chunk = db.execute(
+            select(patients.c.patient_id).order_by(patients.c.patient_id).limit(chunk_size)
+        ).scalars().all()
+        if not chunk:
+            break
+        for patient_id in chunk:
+            shard = ring.shard_for(patient_id)
+            moves[shard] = moves.get(shard, 0) + 1
+        last_patient_id = chunk[-1]
+    return moves
+
+
+def selfcheck(shard_count: int, directory: str, patients: int = 200, claims_per_patient: int = 3) -> dict:
+    """Cria `shard_count` bancos SQLite, distribui claims/invoices pelo anel e confere as leituras
+
+    As linhas são gravadas direto no shard do paciente (sem publicar eventos); as leituras
+    passam pelos serviços, como nos endpoints.
+    """
+    import os
+    import uuid
+    from datetime import datetime, timedelta
+    from decimal import Decimal
+    from sqlalchemy import create_engine, func, select
+    from app.database import Base, ReplicaRouter, RoutingSession
+    from app.models import Claim, ClaimItem, ClaimStatus, Invoice, InvoiceStatus
+    from app.services.claim_service import ClaimService
+    from app.services.invoice_service import InvoiceService
+    from app.services.patient_summary import PatientSummaryService
+
+    os.makedirs(directory, exist_ok=True)
+    factories = []
+    for shard in range(shard_count):
+        path = os.path.join(directory, f"shard{shard}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        factories.append(sessionmaker(
+            class_=RoutingSession, autocommit=False, autoflush=False, bind=engine,
+            info={"shard": shard, "replica_router": ReplicaRouter()}
+        ))
+    shards.configure(factories)
+
+    claim_ids: Dict[str, str] = {}
+    invoice_ids: Dict[str, str] = {}
+    sessions = [factory() for factory in factories]
+    created_at = datetime(2026, 1, 1)
+    for p in range(patients):
+        patient_id = f"P{p:06d}"
+        shard = shards.shard_for_patient(patient_id)
+        db = sessions[shard]
+        for c in range(claims_per_patient):
+            claim_id = shards.new_id("CLM", shard, uuid.uuid4().hex)
+            db.add(Claim(id=claim_id, patient_id=patient_id, insurance_id=f"INS{p % 5}", amount=Decimal("100.00"),
+                         status=ClaimStatus.PENDING, created_at=created_at + timedelta(minutes=p * 10 + c)))
+            db.add(ClaimItem(claim_id=claim_id, description="Consulta eletiva", code="10101012",
+                             value=Decimal("100.00"), quantity=1))
+            claim_ids[claim_id] = patient_id
+        invoice_id = shards.new_id("INV", shard, uuid.uuid4().hex)
+        db.add(Invoice(id=invoice_id, claim_id=claim_id, patient_id=patient_id, amount=Decimal("100.00"),
+                       status=InvoiceStatus.PENDING))
+        invoice_ids[invoice_id] = patient_id
+    for shard, db in enumerate(sessions):
+        db.flush()
+        PatientSummaryService.rebuild(db)
+        db.close()
+
+    errors = []
+    with factories[0]() as db:
+        for claim_id, patient_id in claim_ids.items():
+            claim = ClaimService.get_claim(db, claim_id)
+            if claim is None or claim.patient_id != patient_id:
+                errors.append(f"{claim_id}: não encontrado pelo ID")
+        for invoice_id in invoice_ids:
+            if InvoiceService.get_invoice(db, invoice_id) is None:
+                errors.append(f"{invoice_id}: não encontrada pelo ID")
+        if ClaimService.get_claim(db, "CLMFF000000") is not None:
+            errors.append("ID de shard inexistente deveria retornar None")
+
+        expected = sorted(claim_ids)
+        page_size = 37
+        paged = []
+        for skip in range(0, len(expected) + page_size, page_size):
+            paged += [row.id for row in ClaimService.get_claims(db, skip=skip, limit=page_size)]
+        if paged != expected:
+            errors.append("scatter-gather de claims difere da união ordenada dos shards")
+        paged, cursor = [], None
+        while True:
+            page = [row.id for row in ClaimService.get_claims(db, limit=page_size, after_id=cursor)]
+            if not page:
+                break
+            paged += page
+            cursor = page[-1]
+        if paged != expected:
+            errors.append("paginação por cursor (after_id) de claims difere da união ordenada dos shards")
+        all_invoices = [row.id for row in InvoiceService.get_invoices(db, limit=len(invoice_ids) + 10)]
+        if all_invoices != sorted(invoice_ids):
+            errors.append("scatter-gather de invoices difere da união ordenada dos shards")
+
+        patient_id = f"P{patients // 2:06d}"
+        own = sorted(claim_id for claim_id, owner in claim_ids.items() if owner == patient_id)
+        if [row.id for row in ClaimService.get_claims(db, patient_id=patient_id)] != own:
+            errors.append(f"claims do paciente {patient_id} incompletos")
+        items = ClaimService.get_items_by_claim(db, own + expected[:5])
+        if any(not rows for rows in items.values()):
+            errors.append("itens de claims de vários shards incompletos")
+        summary = PatientSummaryService.get_summary(db, patient_id)
+        if summary["total_claims"] != claims_per_patient or summary["pending_invoices"] != 1:
+            errors.append(f"resumo do paciente {patient_id} incorreto: {summary}")
+
+    distribution = []
+    for factory in factories:
+        with factory() as session:
+            distribution.append(session.execute(select(func.count()).select_from(Claim)).scalar())
+    return {"shards": shard_count, "claims_per_shard": distribution, "errors": errors[:20]}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sharding de claims/invoices por patient_id")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser("plan", help="Pacientes do shard 0 por shard de destino")
+    plan_parser.add_argument("--shards", type=int, required=True, help="Quantidade de shards do anel")
+    check_parser = subparsers.add_parser("selfcheck", help="Verifica o roteamento com bancos SQLite locais")
+    check_parser.add_argument("--shards", type=int, default=4)
+    check_parser.add_argument("--dir", default="/tmp/billing-shards")
+    check_parser.add_argument("--patients", type=int, default=200)
+    args = parser.parse_args()
+
+    # Os serviços usam app.sharding.shards, não a cópia deste módulo executado como __main__
+    from app import sharding
+
+    logging.basicConfig(level=logging.ERROR)
+    if args.command == "plan":
+        with sharding.shards.session_factories[0]() as db:
+            print(sharding.plan(db, args.shards, settings.SHARD_VNODES))
+    else:
+        result = sharding.selfcheck(args.shards, args.dir, args.patients)
+        print(result)
+        raise SystemExit(1 if result["errors"] else 0)
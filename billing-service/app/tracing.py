@@ -0,0 +1,484 @@
+"""
+Tracing distribuído (OpenTelemetry)
+
+Desligado por padrão (TRACING_ENABLED). Ligado, gera spans para:
+- cada requisição/handler (instrumentação FastAPI; /health e /metrics ficam de fora);
+- métodos dos serviços (@traced_service / @traced);
+- cada statement SQL (hooks de cursor em todas as engines: primário, réplicas e shards);
+- comandos Redis e publicações Kafka (o contexto segue no header `traceparent` dos eventos).
+
+Amostragem:
+- head: TRACING_SAMPLE_RATIO dos traces iniciados aqui; com `traceparent` na requisição
+  vale a decisão do chamador;
+- tail (TRACING_TAIL_SAMPLING): os demais traces são gravados em memória até o fim do span
+  raiz local e só são exportados se terminarem com erro ou acima de TRACING_TAIL_LATENCY_MS.
+
+Exportadores (TRACING_EXPORTER): file (um span JSON por linha em TRACING_FILE_PATH),
+memory (testes) e otlp (exige opentelemetry-exporter-otlp-proto-http; sem ele cai para file).
+
+Custo por requisição de cada configuração:
+    python -m app.tracing benchmark --requests 5000 --budget-us-per-span 50
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Sequence
+from sqlalchemy import event
+from opentelemetry import propagate, trace
+from opentelemetry.trace import SpanKind, StatusCode
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import (
+    Decision, ParentBased, Sampler, SamplingResult, TraceIdRatioBased
+)
+from app.config import settings
+from app.middleware.observability import tracing_spans_dropped_total, tracing_traces_total
+
+logger = logging.getLogger(__name__)
+
+# Provider/tracer ativos (None enquanto o tracing está desligado)
+_provider: Optional[TracerProvider] = None
+_tracer: Optional[trace.Tracer] = None
+
+
+def enabled() -> bool:
+    return settings.TRACING_ENABLED.lower() == "true"
+
+
+class HeadTailSampler(Sampler):
+    """Head sampling por ratio; com tail sampling, os traces não amostrados são gravados
+    (RECORD_ONLY) para que o TailSamplingProcessor decida no fim do trace"""
+
+    def __init__(self, ratio: float, tail: bool = True):
+        self._head = ParentBased(TraceIdRatioBased(ratio))
+        self._tail = tail
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None,
+                      links=None, trace_state=None) -> SamplingResult:
+        result = self._head.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+        if result.decision == Decision.DROP and self._tail:
+            return SamplingResult(Decision.RECORD_ONLY, result.attributes, result.trace_state)
+        return result
+
+    def get_description(self) -> str:
+        return f"HeadTailSampler{{{self._head.get_description()}, tail={self._tail}}}"
+
+
+class TailSamplingProcessor(SpanProcessor):
+    """Exporta em lote os spans amostrados no head e, dos demais, só os traces lentos ou com erro
+
+    Spans não amostrados ficam agrupados por trace até o fim do span raiz local (sem pai ou
+    com pai remoto); no máximo `max_traces` traces em aberto (o mais antigo é descartado).
+    A exportação roda em uma thread própria, fora do caminho da requisição.
+    """
+
+    def __init__(self, exporter: SpanExporter, latency_threshold_seconds: float = 0.5,
+                 max_traces: int = 2000, max_spans_per_trace: int = 256,
+                 max_queue_size: int = 8192, batch_size: int = 512,
+                 export_interval_seconds: float = 1.0):
+        self.exporter = exporter
+        self.latency_threshold_ns = int(latency_threshold_seconds * 1e9)
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.export_interval_seconds = export_interval_seconds
+        self._pending: "OrderedDict[int, List[ReadableSpan]]" = OrderedDict()
+        self._pending_lock = threading.Lock()
+        self._queue: List[ReadableSpan] = []
+        self._condition = threading.Condition()
+        self._export_lock = threading.Lock()
+        self._shutdown = False
+        self._worker = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._worker.start()
+
+    def on_start(self, span, parent_context=None):
+        pass
+
+    def on_end(self, span: ReadableSpan):
+        local_root = span.parent is None or span.parent.is_remote
+        if span.context.trace_flags.sampled:
+            if local_root:
+                tracing_traces_total.labels(decision="head").inc()
+            self._enqueue([span])
+            return
+
+        trace_id = span.context.trace_id
+        with self._pending_lock:
+            spans = self._pending.pop(trace_id, None) if local_root else self._pending.get(trace_id)
+            if spans is None:
+                spans = []
+                if not local_root:
+                    if len(self._pending) >= self.max_traces:
+                        self._pending.popitem(last=False)
+                        tracing_traces_total.labels(decision="evicted").inc()
+                    self._pending[trace_id] = spans
+            if len(spans) < self.max_spans_per_trace:
+                spans.append(span)
+        if not local_root:
+            return
+
+        if any(s.status.status_code == StatusCode.ERROR for s in spans):
+            decision = "error"
+        elif span.end_time - span.start_time >= self.latency_threshold_ns:
+            decision = "slow"
+        else:
+            decision = "dropped"
+        tracing_traces_total.labels(decision=decision).inc()
+        if decision != "dropped":
+            self._enqueue(spans)
+
+    def _enqueue(self, spans: List[ReadableSpan]):
+        with self._condition:
+            if len(self._queue) + len(spans) > self.max_queue_size:
+                tracing_spans_dropped_total.inc(len(spans))
+                return
+            self._queue.extend(spans)
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._queue and not self._shutdown:
+                    self._condition.wait(self.export_interval_seconds)
+                if self._shutdown and not self._queue:
+                    return
+            self._export()
+
+    def _export(self):
+        with self._condition:
+            batch, self._queue = self._queue, []
+        if not batch:
+            return
+        with self._export_lock:
+            for start in range(0, len(batch), self.batch_size):
+                try:
+                    self.exporter.export(batch[start:start + self.batch_size])
+                except Exception as e:
+                    tracing_spans_dropped_total.inc(len(batch[start:start + self.batch_size]))
+                    logger.warning(f"Falha ao exportar spans: {e}")
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        self._export()
+        return True
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+        self._worker.join(timeout=5)
+        self._export()
+        self.exporter.shutdown()
+
+
+class FileSpanExporter(SpanExporter):
+    """Um span por linha (JSON), para inspeção local ou coleta por um agente de logs"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+def build_exporter(name: str) -> SpanExporter:
+    if name == "memory":
+        return InMemorySpanExporter()
+    if name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            return OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT or None)
+        except ImportError:
+            logger.warning("opentelemetry-exporter-otlp-proto-http não instalado. Exportando spans para arquivo.")
+    return FileSpanExporter(settings.TRACING_FILE_PATH)
+
+
+def build_provider(exporter: SpanExporter, sample_ratio: float, tail: bool,
+                   tail_latency_ms: float, max_traces: int) -> TracerProvider:
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.SERVICE_NAME}),
+        sampler=HeadTailSampler(sample_ratio, tail=tail)
+    )
+    provider.add_span_processor(TailSamplingProcessor(
+        exporter,
+        latency_threshold_seconds=tail_latency_ms / 1000.0,
+        max_traces=max_traces
+    ))
+    return provider
+
+
+def setup_tracing(app=None) -> Optional[TracerProvider]:
+    """Liga o tracing (se TRACING_ENABLED) e instrumenta app, engines e Redis; idempotente"""
+    global _provider, _tracer
+    if _provider is not None or not enabled():
+        return _provider
+
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from app.redis_client import redis_client
+
+    provider = build_provider(
+        build_exporter(settings.TRACING_EXPORTER),
+        sample_ratio=settings.TRACING_SAMPLE_RATIO,
+        tail=settings.TRACING_TAIL_SAMPLING.lower() == "true",
+        tail_latency_ms=settings.TRACING_TAIL_LATENCY_MS,
+        max_traces=settings.TRACING_TAIL_MAX_TRACES
+    )
+    trace.set_tracer_provider(provider)
+    _provider, _tracer = provider, provider.get_tracer("billing-service")
+
+    if app is not None:
+        # Sem os spans internos de send/receive do ASGI (2-4 por requisição, sem informação útil)
+        FastAPIInstrumentor.instrument_app(
+            app, tracer_provider=provider, excluded_urls="/health,/metrics", exclude_spans=["receive", "send"]
+        )
+    instrument_redis(redis_client)
+    logger.info(
+        f"Tracing habilitado: exporter={settings.TRACING_EXPORTER}, head={settings.TRACING_SAMPLE_RATIO}, "
+        f"tail={settings.TRACING_TAIL_SAMPLING} (>{settings.TRACING_TAIL_LATENCY_MS}ms ou erro)"
+    )
+    return provider
+
+
+def shutdown_tracing():
+    global _provider, _tracer
+    if _provider is not None:
+        _provider.shutdown()
+        _provider, _tracer = None, None
+
+
+def _active() -> bool:
+    """Tracing ligado e trace corrente gravando (ou ainda sem trace: este span será a raiz)
+
+    Filhos de um trace descartado no head (sem tail sampling) não criam span nenhum.
+    """
+    if _tracer is None:
+        return False
+    current = trace.get_current_span()
+    return current.is_recording() or not current.get_span_context().is_valid
+
+
+def span(name: str, kind: SpanKind = SpanKind.INTERNAL, attributes: Optional[Dict] = None):
+    """Context manager de span; sem tracing ligado não custa nada além da chamada"""
+    if not _active():
+        return nullcontext()
+    return _tracer.start_as_current_span(name, kind=kind, attributes=attributes)
+
+
+def traced(name: Optional[str] = None, kind: SpanKind = SpanKind.INTERNAL):
+    """Decorator: executa a função dentro de um span (no-op com TRACING_ENABLED=false)"""
+    def decorator(fn: Callable) -> Callable:
+        if not enabled():
+            return fn
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _active():
+                return fn(*args, **kwargs)
+            with _tracer.start_as_current_span(span_name, kind=kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_service(cls):
+    """Decorator de classe: um span por método estático do serviço (Classe.metodo)"""
+    if not enabled():
+        return cls
+    for attr_name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod) and not attr_name.startswith("__"):
+            setattr(cls, attr_name, staticmethod(traced(f"{cls.__name__}.{attr_name}")(attr.__func__)))
+    return cls
+
+
+def instrument_engine(engine, name: str = "primary"):
+    """Um span CLIENT por statement SQL (no-op com TRACING_ENABLED=false)
+
+    Usa os mesmos hooks de cursor de db_instrumentation em vez do SQLAlchemyInstrumentor,
+    que instrumenta create_engine globalmente (inclusive o módulo asyncio, que exige
+    greenlet). O statement vai como fingerprint, sem os literais (dados de pacientes).
+    """
+    if not enabled():
+        return engine
+    from app.db_instrumentation import fingerprint_statement
+    db_system = engine.dialect.name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_span(conn, cursor, statement, parameters, context, executemany):
+        if context is None or not _active():
+            return
+        operation = statement.lstrip()[:6].upper().rstrip()
+        context._billing_span = _tracer.start_span(
+            f"{operation} {name}", kind=SpanKind.CLIENT,
+            attributes={"db.system": db_system, "db.statement": fingerprint_statement(statement), "billing.pool": name}
+        )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end_span(conn, cursor, statement, parameters, context, executemany):
+        current = getattr(context, "_billing_span", None)
+        if current is not None:
+            current.set_attribute("db.rows_affected", cursor.rowcount)
+            current.end()
+            context._billing_span = None
+
+    @event.listens_for(engine, "handle_error")
+    def _error_span(exception_context):
+        current = getattr(exception_context.execution_context, "_billing_span", None)
+        if current is not None:
+            current.record_exception(exception_context.original_exception)
+            current.set_status(StatusCode.ERROR)
+            current.end()
+            exception_context.execution_context._billing_span = None
+
+    return engine
+
+
+def instrument_redis(client):
+    """Um span CLIENT por comando Redis"""
+    execute_command = client.execute_command
+
+    @functools.wraps(execute_command)
+    def traced_execute_command(*args, **options):
+        if not _active():
+            return execute_command(*args, **options)
+        command = str(args[0]) if args else "?"
+        with _tracer.start_as_current_span(
+            f"redis {command}", kind=SpanKind.CLIENT,
+            attributes={"db.system": "redis", "db.operation": command}
+        ):
+            return execute_command(*args, **options)
+
+    client.execute_command = traced_execute_command
+    return client
+
+
+def inject_headers(headers: list) -> list:
+    """Acrescenta o contexto do trace corrente (traceparent/tracestate) aos headers Kafka"""
+    if _tracer is None:
+        return headers
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    return headers + [(key, value.encode("utf-8")) for key, value in carrier.items()]
+
+
+# Benchmark -----------------------------------------------------------------
+
+# Forma típica de um POST /claims: handler, serviço, 6 statements, 1 Redis, 1 Kafka
+BENCHMARK_SPANS_PER_REQUEST = 10
+
+
+def _simulated_request(tracer: Optional[trace.Tracer], index: int, work: Callable[[], None]):
+    """Spans de handler e SQL como os das instrumentações (sempre criados); os demais via span()"""
+    def instrumented(name, kind, attributes):
+        if tracer is None:
+            return nullcontext()
+        return tracer.start_as_current_span(name, kind=kind, attributes=attributes)
+
+    with instrumented("POST /claims/", SpanKind.SERVER, {"http.method": "POST", "http.route": "/claims/"}):
+        with span("ClaimService.create_claim"):
+            for statement in range(6):
+                with instrumented("INSERT billing", SpanKind.CLIENT,
+                                  {"db.system": "mysql", "db.statement": f"INSERT {statement}"}):
+                    work()
+            with span("redis GET", SpanKind.CLIENT, {"db.system": "redis"}):
+                work()
+            with span("billing-events publish", SpanKind.PRODUCER, {"messaging.system": "kafka"}) as current:
+                work()
+                # 1% das requisições com erro (exercita o tail sampling)
+                if current is not None and index % 100 == 0:
+                    current.set_status(StatusCode.ERROR)
+
+
+def benchmark(requests: int = 5000, budget_us_per_span: float = 50.0) -> Dict:
+    """Overhead por requisição de cada configuração em relação ao tracing desligado
+
+    O orçamento vale para a configuração padrão (head 1% + tail sampling).
+    """
+    global _tracer
+
+    def work():
+        sum(range(50))
+
+    def run(tracer) -> float:
+        global _tracer
+        _tracer = tracer
+        try:
+            start = time.perf_counter()
+            for index in range(requests):
+                _simulated_request(tracer, index, work)
+            return time.perf_counter() - start
+        finally:
+            _tracer = None
+
+    baseline = min(run(None) for _ in range(3))
+    file_path = os.path.join(tempfile.mkdtemp(prefix="traces-"), "spans.jsonl")
+    scenarios = {
+        "head_1pct+tail": (InMemorySpanExporter, 0.01, True),
+        "head_1pct": (InMemorySpanExporter, 0.01, False),
+        "all_memory": (InMemorySpanExporter, 1.0, False),
+        "all_file": (lambda: FileSpanExporter(file_path), 1.0, False),
+    }
+    budget_us = budget_us_per_span * BENCHMARK_SPANS_PER_REQUEST
+    results = {
+        "requests": requests,
+        "spans_per_request": BENCHMARK_SPANS_PER_REQUEST,
+        "baseline_us_per_request": round(baseline / requests * 1e6, 1),
+        "budget_us_per_request": budget_us,
+        "scenarios": {},
+    }
+    for name, (make_exporter, ratio, tail) in scenarios.items():
+        exporter = make_exporter()
+        provider = build_provider(exporter, ratio, tail, tail_latency_ms=500, max_traces=2000)
+        elapsed = min(run(provider.get_tracer("benchmark")) for _ in range(2))
+        provider.shutdown()
+        overhead_us = max(0.0, (elapsed - baseline) / requests * 1e6)
+        results["scenarios"][name] = {
+            "overhead_us_per_request": round(overhead_us, 1),
+            "exported_spans": (
+                len(exporter.get_finished_spans()) if isinstance(exporter, InMemorySpanExporter) else None
+            ),
+        }
+    results["default_within_budget"] = results["scenarios"]["head_1pct+tail"]["overhead_us_per_request"] <= budget_us
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tracing (OpenTelemetry)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench = subparsers.add_parser("benchmark", help="Overhead por requisição de cada configuração de amostragem")
+    bench.add_argument("--requests", type=int, default=5000)
+    bench.add_argument("--budget-us-per-span", type=float, default=50.0,
+                       help="Orçamento de overhead por span na configuração padrão (head 1%% + tail)")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.requests, args.budget_us_per_span)
+    print(json.dumps(results, indent=2))
+    return 0 if results["default_within_budget"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())